@@ -0,0 +1,253 @@
+"""
+End to end benchmarks for promote_solution flows and migrate_solution, run against local Instabase stand-in
+servers (tests/ib_stand_in.py) with configurable latency and bandwidth. Records wall-clock time, request
+count and bytes moved for each run, so performance regressions can be caught offline
+
+Run from the project directory:
+
+    python -m benchmarks.run_benchmarks --latency 0.02 --bandwidth 50000000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ib_cicd.ib_helpers import close_ib_clients
+from ib_cicd.solution_migration_udf import migrate_solution
+from tests.ib_stand_in import IBStandIn, make_ibsolution
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOLUTION_NAME = "benchmark_solution"
+SOLUTION_VERSION = "1.0.0"
+REL_FLOW_PATH = "flow/flow.ibflow"
+
+SOURCE_ROOT = "benchmark/source/fs/Instabase Drive"
+TARGET_ROOT = "benchmark/target/fs/Instabase Drive"
+SOURCE_SOLUTION_DIR = f"{SOURCE_ROOT}/solution"
+SOURCE_WORKING_DIR = f"{SOURCE_ROOT}/working"
+SOURCE_COMPILED_SOLUTIONS_PATH = f"{SOURCE_ROOT}/compiled"
+TARGET_IB_PATH = f"{TARGET_ROOT}/solutions"
+
+SCENARIOS = ["remote_flow", "local_flow", "migrate_solution"]
+
+
+def solution_package(dependency_count):
+    """
+    Builds the package.json of the benchmarked solution
+
+    :param dependency_count: (int) number of marketplace dependencies the solution has
+    :return: (dict) package.json contents
+    """
+    return {
+        "name": SOLUTION_NAME,
+        "version": SOLUTION_VERSION,
+        "dependencies": {
+            "models": [],
+            "dev_exchange_packages": [
+                f"dependency_{i}==1.0.0" for i in range(dependency_count)
+            ],
+        },
+    }
+
+
+def seed_environments(source, target, dependency_count, payload_size):
+    """
+    Writes the solution, its compiled .ibsolution and its marketplace dependencies to the stand-in servers
+
+    :param source: (IBStandIn) source environment
+    :param target: (IBStandIn) target environment
+    :param dependency_count: (int) number of marketplace dependencies to publish on the source
+    :param payload_size: (int) size in bytes of the payload in the solution and in each dependency
+    :return: None
+    """
+    package = solution_package(dependency_count)
+    flow = os.urandom(payload_size)
+
+    source.write_file(
+        f"{SOURCE_SOLUTION_DIR}/package.json", json.dumps(package).encode()
+    )
+    source.write_file(f"{SOURCE_SOLUTION_DIR}/icon.png", b"icon")
+    source.write_file(f"{SOURCE_SOLUTION_DIR}/{REL_FLOW_PATH}", flow)
+    source.write_file(f"{SOURCE_SOLUTION_DIR}/flow/modules/module.py", b"")
+    source.write_file(
+        f"{SOURCE_SOLUTION_DIR}/{SOLUTION_NAME}-{SOLUTION_VERSION}.ibsolution",
+        make_ibsolution(package, {"flow/flow.ibflowbin": flow}),
+    )
+    source.write_file(
+        f"{SOURCE_COMPILED_SOLUTIONS_PATH}/{SOLUTION_NAME}-{SOLUTION_VERSION}.ibsolution",
+        make_ibsolution(package, {"flow/flow.ibflowbin": flow}),
+    )
+    source.folders.add(SOURCE_WORKING_DIR)
+    target.folders.add(TARGET_IB_PATH)
+
+    for i in range(dependency_count):
+        source.marketplace[(f"dependency_{i}", "1.0.0")] = make_ibsolution(
+            {"name": f"dependency_{i}", "version": "1.0.0"},
+            {"data.bin": os.urandom(payload_size)},
+        )
+
+
+def write_local_solution(directory, dependency_count, payload_size):
+    """
+    Writes the solution to the local filesystem for the local flow
+
+    :param directory: (string) local directory to write the solution folder in
+    :param dependency_count: (int) number of marketplace dependencies the solution has
+    :param payload_size: (int) size in bytes of the flow file
+    :return: (string) name of the solution folder
+    """
+    solution_dir = os.path.join(directory, SOLUTION_NAME)
+    os.makedirs(os.path.join(solution_dir, "flow"))
+    with open(os.path.join(solution_dir, "package.json"), "w") as fp:
+        json.dump(solution_package(dependency_count), fp)
+    with open(os.path.join(solution_dir, REL_FLOW_PATH), "wb") as fp:
+        fp.write(os.urandom(payload_size))
+    return SOLUTION_NAME
+
+
+def run_promote_solution(source, target, flags, working_dir):
+    """
+    Runs promote_solution in a subprocess configured through environment variables, as the CI pipelines do
+
+    :param source: (IBStandIn) source environment
+    :param target: (IBStandIn) target environment
+    :param flags: (list) command line flags to pass to promote_solution
+    :param working_dir: (string) local directory to run in
+    :return: None
+    """
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [PROJECT_DIR, os.environ.get("PYTHONPATH")])
+        ),
+        SOURCE_IB_HOST=source.host,
+        SOURCE_IB_API_TOKEN=source.api_token,
+        TARGET_IB_HOST=target.host,
+        TARGET_IB_API_TOKEN=target.api_token,
+        TARGET_IB_PATH=TARGET_IB_PATH,
+        SOURCE_WORKING_DIR=SOURCE_WORKING_DIR,
+        SOURCE_SOLUTION_DIR=SOURCE_SOLUTION_DIR,
+        SOURCE_COMPILED_SOLUTIONS_PATH=SOURCE_COMPILED_SOLUTIONS_PATH,
+        LOCAL_SOLUTION_DIR=SOLUTION_NAME,
+        REL_FLOW_PATH=REL_FLOW_PATH,
+    )
+    result = subprocess.run(
+        [sys.executable, "-m", "ib_cicd.promote_solution", *flags],
+        cwd=working_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise Exception(f"promote_solution {' '.join(flags)} failed:\n{result.stderr}")
+
+
+def run_scenario(
+    scenario, latency=0, bandwidth=None, dependency_count=3, payload_size=1048576
+):
+    """
+    Runs one benchmark scenario against fresh stand-in servers
+
+    :param scenario: (string) one of SCENARIOS
+    :param latency: (float) seconds added to every request
+    :param bandwidth: (float) bytes per second bodies are transferred at, None for unlimited
+    :param dependency_count: (int) number of marketplace dependencies the solution has
+    :param payload_size: (int) size in bytes of the payload in the solution and in each dependency
+    :return: (dict) wall-clock seconds and traffic statistics of each environment
+    """
+    source = IBStandIn("source-token", latency=latency, bandwidth=bandwidth)
+    target = IBStandIn("target-token", latency=latency, bandwidth=bandwidth)
+    with source, target, tempfile.TemporaryDirectory() as working_dir:
+        seed_environments(source, target, dependency_count, payload_size)
+        if scenario == "local_flow":
+            write_local_solution(working_dir, dependency_count, payload_size)
+        source.reset_stats()
+
+        start_time = time.perf_counter()
+        if scenario == "migrate_solution":
+            try:
+                migrate_solution(
+                    source.host,
+                    target.host,
+                    source.api_token,
+                    target.api_token,
+                    SOURCE_SOLUTION_DIR,
+                    TARGET_IB_PATH,
+                )
+            finally:
+                close_ib_clients()
+        else:
+            run_promote_solution(source, target, [f"--{scenario}"], working_dir)
+        seconds = time.perf_counter() - start_time
+
+        return {
+            "scenario": scenario,
+            "seconds": seconds,
+            "source": source.stats(),
+            "target": target.stats(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Seconds added to every request"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=None,
+        help="Bytes per second, unlimited by default",
+    )
+    parser.add_argument("--dependencies", type=int, default=3)
+    parser.add_argument("--payload_size", type=int, default=1048576)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Path to write results JSON to")
+    args = parser.parse_args()
+
+    settings = {
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "dependency_count": args.dependencies,
+        "payload_size": args.payload_size,
+    }
+    runs = []
+    for scenario in args.scenario or SCENARIOS:
+        for _ in range(args.repeat):
+            runs.append(run_scenario(scenario, **settings))
+
+    summary = {}
+    for scenario in args.scenario or SCENARIOS:
+        scenario_runs = [run for run in runs if run["scenario"] == scenario]
+        last_run = scenario_runs[-1]
+        summary[scenario] = {
+            "median_seconds": statistics.median(
+                run["seconds"] for run in scenario_runs
+            ),
+            "requests": last_run["source"]["requests"] + last_run["target"]["requests"],
+            "bytes": sum(
+                last_run[env]["bytes_received"] + last_run[env]["bytes_sent"]
+                for env in ["source", "target"]
+            ),
+        }
+        print(
+            f"{scenario}: {summary[scenario]['median_seconds']:.3f}s, "
+            f"{summary[scenario]['requests']} requests, {summary[scenario]['bytes']} bytes"
+        )
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {"settings": settings, "summary": summary, "runs": runs}, fp, indent=2
+            )
+
+
+if __name__ == "__main__":
+    main()
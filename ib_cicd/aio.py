@@ -0,0 +1,1024 @@
+"""
+Asyncio versions of the ib_helpers and migration_helpers functions, so a single event loop can drive many
+concurrent promotions and job polls. Requires aiohttp (pip install instabase-app-cicd-toolkit[aio])
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+import weakref
+from urllib.parse import quote
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from ib_cicd.ib_helpers import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_POOL_SIZE,
+    RETRYABLE_STATUS_CODES,
+    UPLOAD_PART_SIZE,
+    _clamp_request_timeout,
+    _clamp_to_run_deadline,
+    _load_upload_checkpoint,
+    _remaining_part,
+    _remove_upload_checkpoint,
+    _save_upload_checkpoint,
+    get_job_id,
+    get_polling_policy,
+    get_request_timeout,
+)
+from ib_cicd.migration_helpers import (
+    DEFAULT_MAX_WORKERS,
+    _DigestWriter,
+    get_manifest_path,
+)
+
+
+class AsyncResponse:
+    """
+    Fully read response, exposing the same attributes as requests.Response that the helpers rely on
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncIBClient:
+    """
+    Asyncio client for a single Instabase environment
+
+    Holds an aiohttp.ClientSession so connections to the IB host are pooled between API calls. The session
+    belongs to the event loop the client is first used on
+    """
+
+    def __init__(
+        self,
+        ib_host,
+        api_token,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=None,
+        verify=False,
+    ):
+        """
+        :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+        :param api_token: (string) API token for IB environment
+        :param pool_size: (int) maximum number of connections to keep open to the IB host
+        :param timeout: (float or tuple) timeout in seconds for all requests, either a total or a (connect, read)
+                        tuple. None uses the default timeout of each endpoint
+        :param verify: (bool) flag indicating whether to verify TLS certificates
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "ib_cicd.aio requires aiohttp, install it with: pip install instabase-app-cicd-toolkit[aio]"
+            )
+
+        self.ib_host = ib_host
+        self.timeout = timeout
+        self.verify = verify
+        self._api_token = api_token
+        self._pool_size = pool_size
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"Authorization": "Bearer {0}".format(self._api_token)},
+                connector=aiohttp.TCPConnector(
+                    limit=self._pool_size, ssl=None if self.verify else False
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def api_root(self, api_version="v2", add_files_suffix=True):
+        """
+        Gets file api root for the IB host
+
+        :param api_version: (string) api_version to add to ib_host to create file api root url
+        :param add_files_suffix: (bool) flag indicating whether to add 'files' suffix to the api root
+        :return: (string) IB host + file api root (e.g. https://www.instabase.com/api/v2/files)
+        """
+        if add_files_suffix:
+            return os.path.join(*[self.ib_host, "api", api_version, "files"])
+
+        return os.path.join(*[self.ib_host, "api", api_version])
+
+    def _timeout(self, method, url, timeout=None):
+        """
+        Picks the timeout of a request the same way as ib_helpers.IBClient.request: the given timeout, else the
+        client's, else the endpoint default, cut short to end by the run deadline
+
+        :param method: (string) HTTP method
+        :param url: (string) url of the request
+        :param timeout: (float or tuple) timeout passed for the request
+        :return: aiohttp.ClientTimeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            timeout = get_request_timeout(method, url)
+
+        # Time left until the run deadline, None without one. aiohttp treats a timeout of 0 as no timeout, so
+        # this raises TimeoutError rather than returning 0
+        total = _clamp_request_timeout(method, url, None)
+        timeout = _clamp_request_timeout(method, url, timeout)
+
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return aiohttp.ClientTimeout(
+                total=total, sock_connect=connect, sock_read=read
+            )
+        return aiohttp.ClientTimeout(total=timeout)
+
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request through the pooled session and reads the whole response body. Without a timeout for the
+        client or the request, the default timeout of the endpoint is used
+
+        :param method: (string) HTTP method
+        :param url: (string) url to send request to
+        :param kwargs: keyword arguments passed through to aiohttp.ClientSession.request
+        :return: AsyncResponse
+        """
+        kwargs["timeout"] = self._timeout(method, url, kwargs.get("timeout"))
+        async with self.session.request(method, url, **kwargs) as resp:
+            content = await resp.read()
+            return AsyncResponse(resp.status, resp.headers, content)
+
+    async def iter_file_chunks(self, path_to_file, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Reads a file from the IB environment as a stream of chunks
+
+        :param path_to_file: (string) path to file on IB environment
+        :param chunk_size: (int) maximum number of bytes in each chunk
+        :return: async generator of bytes
+        """
+        url = os.path.join(self.api_root(), path_to_file)
+        params = {"expect-node-type": "file"}
+        timeout = self._timeout("GET", url)
+        async with self.session.get(url, params=params, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise Exception(
+                    f"Error reading file: {await resp.read()}, for url: {url}"
+                )
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def upload_parts(self, path, parts, checkpoint_key=None):
+        """
+        Uploads a sequence of parts to a location on the Instabase environment, sending one PATCH request per
+        part with the IB-Cursor header. Failed parts are retried and interrupted uploads resumed the same way as
+        ib_helpers.IBClient.upload_parts
+
+        :param path: (string) path on IB environment to upload to
+        :param parts: (iterable or async iterable of bytes) parts to upload in order
+        :param checkpoint_key: (string) identifies the uploaded content, see ib_helpers.IBClient.upload_parts
+        :return: AsyncResponse
+        """
+        append_root_url = os.path.join(self.api_root(), path)
+
+        async def iterate():
+            if hasattr(parts, "__aiter__"):
+                async for part in parts:
+                    yield part
+            else:
+                for part in parts:
+                    yield part
+
+        resume_from = await self._resume_offset(path, append_root_url, checkpoint_key)
+        resp = None
+        part_num = 0
+        offset = 0
+        async for part in iterate():
+            part_num += 1
+            end = offset + len(part)
+            if end <= resume_from:
+                # Already uploaded by an earlier run
+                offset = end
+                continue
+            if offset < resume_from:
+                part = memoryview(part)[resume_from - offset :]
+                offset = resume_from
+
+            resp = await self._upload_part(append_root_url, part, offset, part_num)
+            offset = end
+            await asyncio.to_thread(
+                _save_upload_checkpoint, self.ib_host, path, checkpoint_key, offset
+            )
+
+        if resp is None and resume_from == 0:
+            # Nothing to send, still create an empty file at the path
+            resp = await self._upload_part(append_root_url, b"", 0, 1)
+        elif resp is None:
+            # Everything was uploaded by an earlier run
+            resp = await self.request("HEAD", append_root_url)
+        await asyncio.to_thread(_remove_upload_checkpoint, self.ib_host, path)
+        return resp
+
+    async def _upload_part(self, url, part, offset, part_num):
+        """
+        Sends one part starting at offset in the file, retrying with backoff until it has been received
+
+        :param url: (string) Files API url of the file being uploaded
+        :param part: (bytes) part to upload
+        :param offset: (int) position of the part in the file
+        :param part_num: (int) number of the part in the upload, counting from 1
+        :return: AsyncResponse
+        """
+        policy = get_polling_policy("upload_part")
+        deadline = policy.deadline()
+        intervals = policy.intervals()
+        data, data_offset = part, offset
+        while True:
+            headers = {"IB-Cursor": "0" if data_offset == 0 else "-1"}
+            try:
+                resp = await self.request("PATCH", url, headers=headers, data=data)
+                if resp.status_code == 204:
+                    return resp
+                if resp.status_code not in RETRYABLE_STATUS_CODES:
+                    raise Exception(
+                        f"Upload of part {part_num} of {url} failed: {resp.content}"
+                    )
+                error = f"status {resp.status_code}: {resp.content}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"Upload of part {part_num} of {url} kept failing: {error}"
+                )
+            await asyncio.sleep(_clamp_to_run_deadline(next(intervals)))
+
+            # The failed request may have been partly or fully written, continue from what arrived
+            remote_size, head_resp = await self._remote_size(url)
+            data, data_offset = _remaining_part(url, part, offset, remote_size)
+            if data is None:
+                return head_resp
+            logging.warning(
+                f"Retrying part {part_num} of {url} from byte {data_offset} after error: {error}"
+            )
+
+    async def _remote_size(self, url):
+        """
+        :return: (tuple) size of the file at url, or None if it couldn't be read, and the HEAD response
+        """
+        try:
+            resp = await self.request("HEAD", url)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None, None
+        if resp.status_code != 200:
+            return None, resp
+        return int(resp.headers.get("Content-Length", 0)), resp
+
+    async def _resume_offset(self, path, url, checkpoint_key):
+        offset = await asyncio.to_thread(
+            _load_upload_checkpoint, self.ib_host, path, checkpoint_key
+        )
+        # Only resume if the environment still has exactly the checkpointed bytes
+        if not offset or (await self._remote_size(url))[0] != offset:
+            return 0
+        logging.info(f"Resuming upload of {path} from byte {offset}")
+        return offset
+
+    async def upload_chunks(self, path, file_data, part_size=UPLOAD_PART_SIZE):
+        """
+        Uploads bytes to a location on the Instabase environment
+
+        :param path: (string) path on IB environment to upload to
+        :param file_data: (bytes) Data to upload (bytes)
+        :param part_size: (int) size of each uploaded part in bytes
+        :return: AsyncResponse
+        """
+        view = memoryview(file_data)
+        parts = (
+            view[offset : offset + part_size]
+            for offset in range(0, len(file_data), part_size)
+        )
+        return await self.upload_parts(path, parts)
+
+    async def upload_local_file(self, path, local_path, part_size=UPLOAD_PART_SIZE):
+        """
+        Uploads a file from the local filesystem in chunks
+
+        :param path: (string) path on IB environment to upload to
+        :param local_path: (string) path of local file to upload
+        :param part_size: (int) size of each uploaded part in bytes
+        :return: AsyncResponse
+        """
+
+        async def read_parts(f):
+            while True:
+                part = await asyncio.to_thread(f.read, part_size)
+                if not part:
+                    return
+                yield part
+
+        stat = await asyncio.to_thread(os.stat, local_path)
+        checkpoint_key = (
+            f"{os.path.abspath(local_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        )
+        f = await asyncio.to_thread(open, local_path, "rb")
+        try:
+            return await self.upload_parts(
+                path, read_parts(f), checkpoint_key=checkpoint_key
+            )
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def upload_file(self, file_path, file_data):
+        """
+        Upload single file to path on IB environment
+
+        :param file_path: (string) path on IB environment to upload to
+        :param file_data: (bytes) Data to upload (bytes)
+        :return: AsyncResponse
+        """
+        url = os.path.join(self.api_root(), file_path)
+
+        resp = await self.request("PUT", url, data=file_data)
+        logging.info(f"File upload status : {resp.status_code}")
+
+        if resp.status_code != 204:
+            raise Exception(f"Upload file failed: {resp.content}")
+
+        return resp
+
+    async def read_file(self, path_to_file):
+        """
+        Read file from IB environment
+
+        :param path_to_file: (string) path to file on IB environment
+        :return: AsyncResponse
+        """
+        url = os.path.join(*[self.api_root(), path_to_file])
+
+        params = {"expect-node-type": "file"}
+        resp = await self.request("GET", url, params=params)
+
+        if resp.status_code != 200:
+            raise Exception(f"Error reading file: {resp.content}, for url: {url}")
+
+        return resp
+
+    async def download_file(
+        self, path_to_file, local_path, chunk_size=DEFAULT_CHUNK_SIZE
+    ):
+        """
+        Streams a file from IB environment straight to the local filesystem in chunks. Disk writes run in a
+        worker thread so they don't hold up other transfers on the event loop
+
+        :param path_to_file: (string) path to file on IB environment
+        :param local_path: (string) local path to write file to
+        :param chunk_size: (int) number of bytes to read from the response at a time
+        :return: (int) number of bytes written
+        """
+        start_time = time.perf_counter()
+        bytes_written = 0
+        fd = await asyncio.to_thread(open, local_path, "wb")
+        try:
+            async for chunk in self.iter_file_chunks(path_to_file, chunk_size):
+                await asyncio.to_thread(fd.write, chunk)
+                bytes_written += len(chunk)
+        finally:
+            await asyncio.to_thread(fd.close)
+
+        elapsed = max(time.perf_counter() - start_time, 1e-6)
+        logging.info(
+            f"Downloaded {path_to_file} to {local_path}: {bytes_written} bytes in {elapsed:.2f}s "
+            f"({bytes_written / elapsed:.0f} bytes/sec)"
+        )
+        return bytes_written
+
+    async def get_file_metadata(self, file_path):
+        """
+        Get metadata of file (using file API)
+
+        :param file_path: (string) path to file to read metadata from
+        :return: AsyncResponse
+        """
+        url = os.path.join(self.api_root(), file_path)
+        headers = {
+            "IB-Retry-Config": json.dumps({"retries": 2, "backoff-seconds": 1}),
+        }
+        return await self.request("HEAD", url, headers=headers)
+
+    async def create_folder_if_it_does_not_exists(self, folder_path):
+        """
+        Creates a folder in the IB environment if it doesn't exist
+
+        :param folder_path: (string) path to folder on IB environment
+        :return: AsyncResponse
+        """
+        metadata_url = os.path.join(self.api_root(), folder_path)
+
+        r = await self.request("HEAD", metadata_url)
+        if r.status_code == 404:
+            create_url = os.path.dirname(metadata_url)
+            folder_name = os.path.basename(folder_path)
+            data = json.dumps({"name": folder_name, "node_type": "folder"})
+            return await self.request("POST", create_url, data=data)
+
+    async def copy_file(self, source_path, destination_path):
+        """
+        Copies a file within the IB environment
+
+        :param source_path: (string) path of file to copy
+        :param destination_path: (string) path to copy to
+        :return: AsyncResponse
+        """
+        url = os.path.join(self.api_root(), "copy")
+        data = json.dumps({"src_path": source_path, "dst_path": destination_path})
+
+        resp = await self.request("POST", url, data=data)
+
+        if resp.status_code != 202:
+            raise Exception(f"Error copying file: {resp.content}")
+
+        return resp
+
+    async def unzip_files(self, zip_path, destination_path=None):
+        """
+        Unzip file on IB environment
+
+        :param zip_path: (string) path to zip file on IB environment
+        :param destination_path: (string) path to unzip files to
+        :return: AsyncResponse
+        """
+        url = os.path.join(*[self.ib_host, "api/v2", "files", "extract"])
+        destination_path = (
+            destination_path if destination_path else ".".join(zip_path.split(".")[:-1])
+        )
+        data = json.dumps({"src_path": zip_path, "dst_path": destination_path})
+
+        resp = await self.request("POST", url, data=data)
+
+        if resp.status_code != 202:
+            raise Exception(f"Unable to unzip files: {resp.content}")
+
+        return resp
+
+    async def delete_file_or_folder(self, path_to_delete):
+        """
+        Delete a file or folder from the IB environment using the Filesystem API
+
+        :param path_to_delete: (string) path of file or folder to delete
+        :return: AsyncResponse
+        """
+        url = os.path.join(self.api_root(), path_to_delete)
+        return await self.request("DELETE", url)
+
+    async def check_job_status(self, job_id, job_type):
+        """
+        Checks on status of a job id using the Job Status API
+
+        :param job_id: (string) job id to look into
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :return: AsyncResponse
+        """
+        url = self.ib_host + f"/api/v1/jobs/status?job_id={job_id}&type={job_type}"
+
+        resp = await self.request("GET", url)
+
+        # Verify request is successful
+        content = json.loads(resp.content)
+        if resp.status_code != 200 or (
+            "status" in content and content["status"] == "ERROR"
+        ):
+            raise Exception(f"Error checking job status: {resp.content}")
+
+        return resp
+
+    async def wait_until_job_finishes(self, job_id, job_type, polling_policy=None):
+        """
+        Waits until a job finishes without blocking the event loop
+
+        :param job_id: (string) job id to look into
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                               for job_type. Raises TimeoutError if the policy has a timeout and it passes
+        :return: bool indicating whether job completed successfully
+        """
+        policy = polling_policy or get_polling_policy(job_type)
+        deadline = policy.deadline()
+
+        for interval in policy.intervals():
+            content = json.loads(
+                (await self.check_job_status(job_id, job_type)).content
+            )
+            if content["status"] != "OK":
+                return False
+
+            if content["state"] == "DONE" or content["state"] == "COMPLETE":
+                return True
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out after {policy.timeout}s waiting for {job_type} job {job_id} "
+                        f"(last state: {content['state']})"
+                    )
+                interval = min(interval, remaining)
+            await asyncio.sleep(_clamp_to_run_deadline(interval))
+
+    async def publish_to_marketplace(self, ibsolution_path):
+        """
+        Publishes an ibsolution to Marketplace
+
+        :param ibsolution_path: path to .ibsolution file
+        :return: (dict) publish response content, or the AsyncResponse if it isn't JSON
+        """
+        url = f"{self.api_root(api_version='v1', add_files_suffix=False)}/marketplace/publish"
+        json_data = json.dumps({"ibsolution_path": ibsolution_path})
+
+        resp = await self.request("POST", url, data=json_data)
+        try:
+            resp = resp.json()
+            logging.info(f"File: {url}, Solution publish status: {resp}")
+        except ValueError:
+            logging.info(
+                f"Error publishing ibsolution_path: {ibsolution_path}. Solution publish status exception: {resp.content}"
+            )
+
+        return resp
+
+    async def deploy_solution(self, ibsolution_path):
+        """
+        Deploys a solution
+
+        :param ibsolution_path: (string) path to .ibsolution file to deploy
+        :return: AsyncResponse
+        """
+        url = f"{self.api_root(add_files_suffix=False)}/solutions/deployed"
+        json_data = json.dumps({"solution_path": ibsolution_path})
+
+        resp = await self.request("POST", url, data=json_data)
+
+        job_id = get_job_id(resp)
+        if job_id:
+            logging.info(f"Solution deployed with job ID {job_id}")
+        else:
+            logging.info(f"Solution publish status exception: {resp.content}")
+
+        return resp
+
+
+_ib_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_ib_client(ib_host, api_token, **client_kwargs):
+    """
+    Gets the shared AsyncIBClient for an IB host and API token on the running event loop, creating it on
+    first use
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param client_kwargs: keyword arguments passed to AsyncIBClient when the client is first created
+    :return: AsyncIBClient
+    """
+    clients = _ib_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (ib_host, api_token)
+    if key not in clients:
+        clients[key] = AsyncIBClient(ib_host, api_token, **client_kwargs)
+    return clients[key]
+
+
+async def close_async_ib_clients():
+    """
+    Closes and forgets every shared AsyncIBClient of the running event loop
+    """
+    clients = _ib_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+async def upload_chunks(ib_host, path, api_token, file_data):
+    return await get_async_ib_client(ib_host, api_token).upload_chunks(path, file_data)
+
+
+async def upload_file(ib_host, api_token, file_path, file_data):
+    return await get_async_ib_client(ib_host, api_token).upload_file(
+        file_path, file_data
+    )
+
+
+async def upload_local_file(ib_host, api_token, path, local_path):
+    return await get_async_ib_client(ib_host, api_token).upload_local_file(
+        path, local_path
+    )
+
+
+async def read_file_through_api(ib_host, api_token, path_to_file):
+    return await get_async_ib_client(ib_host, api_token).read_file(path_to_file)
+
+
+async def download_file_through_api(ib_host, api_token, path_to_file, local_path):
+    return await get_async_ib_client(ib_host, api_token).download_file(
+        path_to_file, local_path
+    )
+
+
+async def get_file_metadata(ib_host, api_token, file_path):
+    return await get_async_ib_client(ib_host, api_token).get_file_metadata(file_path)
+
+
+async def create_folder_if_it_does_not_exists(ib_host, api_token, folder_path):
+    return await get_async_ib_client(
+        ib_host, api_token
+    ).create_folder_if_it_does_not_exists(folder_path)
+
+
+async def copy_file_within_ib(ib_host, api_token, source_path, destination_path):
+    return await get_async_ib_client(ib_host, api_token).copy_file(
+        source_path, destination_path
+    )
+
+
+async def unzip_files(ib_host, api_token, zip_path, destination_path=None):
+    return await get_async_ib_client(ib_host, api_token).unzip_files(
+        zip_path, destination_path
+    )
+
+
+async def delete_folder_or_file_from_ib(path_to_delete, ib_host, api_token):
+    return await get_async_ib_client(ib_host, api_token).delete_file_or_folder(
+        path_to_delete
+    )
+
+
+async def check_job_status(ib_host, job_id, job_type, api_token):
+    return await get_async_ib_client(ib_host, api_token).check_job_status(
+        job_id, job_type
+    )
+
+
+async def wait_until_job_finishes(
+    ib_host, job_id, job_type, api_token, polling_policy=None
+):
+    return await get_async_ib_client(ib_host, api_token).wait_until_job_finishes(
+        job_id, job_type, polling_policy
+    )
+
+
+async def publish_to_marketplace(ib_host, api_token, ibsolution_path):
+    return await get_async_ib_client(ib_host, api_token).publish_to_marketplace(
+        ibsolution_path
+    )
+
+
+async def deploy_solution(ib_host, api_token, ibsolution_path):
+    return await get_async_ib_client(ib_host, api_token).deploy_solution(
+        ibsolution_path
+    )
+
+
+async def stream_file_between_envs(
+    source_ib_host,
+    source_api_token,
+    source_path,
+    target_ib_host,
+    target_api_token,
+    target_path,
+    part_size=UPLOAD_PART_SIZE,
+    max_buffered_parts=1,
+    tee=None,
+    checkpoint_key=None,
+):
+    """
+    Streams a file from one IB environment to another, downloading the next part while the current one is
+    being uploaded. See ib_helpers.stream_file_between_envs
+
+    :return: AsyncResponse of the last upload request
+    """
+    source_client = get_async_ib_client(source_ib_host, source_api_token)
+    target_client = get_async_ib_client(target_ib_host, target_api_token)
+    buffer = asyncio.Queue(maxsize=max_buffered_parts)
+    finished = object()
+
+    async def download_parts():
+        try:
+            part = bytearray()
+            async for chunk in source_client.iter_file_chunks(source_path):
+                part += chunk
+                while len(part) >= part_size:
+                    await buffer.put((bytes(part[:part_size]), None))
+                    del part[:part_size]
+            if part:
+                await buffer.put((bytes(part), None))
+        except Exception as e:
+            await buffer.put((finished, e))
+            return
+        await buffer.put((finished, None))
+
+    async def parts():
+        while True:
+            part, error = await buffer.get()
+            if part is finished:
+                if error is not None:
+                    raise error
+                return
+            if tee is not None:
+                # Hashing and writing to disk happen off the event loop
+                await asyncio.to_thread(tee.write, part)
+            yield part
+
+    producer = asyncio.create_task(download_parts())
+    try:
+        return await target_client.upload_parts(
+            target_path, parts(), checkpoint_key=checkpoint_key
+        )
+    finally:
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+
+
+async def read_artifact_manifest(ib_host, api_token, file_path):
+    try:
+        resp = await read_file_through_api(
+            ib_host, api_token, get_manifest_path(file_path)
+        )
+        return resp.json()
+    except Exception:
+        return None
+
+
+async def write_artifact_manifest(ib_host, api_token, file_path, sha256, size):
+    manifest = {"name": os.path.basename(file_path), "sha256": sha256, "size": size}
+    return await upload_file(
+        ib_host, api_token, get_manifest_path(file_path), json.dumps(manifest)
+    )
+
+
+async def check_if_file_exists_on_ib_env(
+    ib_host, api_token, file_path, expected_sha256=None
+):
+    """
+    Determines if a complete copy of a file exists on IB environment, see
+    migration_helpers.check_if_file_exists_on_ib_env
+
+    :return: bool
+    """
+    manifest = await read_artifact_manifest(ib_host, api_token, file_path)
+    if not manifest:
+        return False
+    if expected_sha256 and manifest.get("sha256") != expected_sha256:
+        return False
+
+    metadata_response = await get_file_metadata(ib_host, api_token, file_path)
+    if metadata_response.status_code != 200:
+        return False
+    try:
+        content_length = int(metadata_response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return False
+    return content_length == manifest.get("size")
+
+
+async def copy_package_from_marketplace(
+    ib_host, api_token, package_name, package_version, intermediate_path
+):
+    """
+    Uses marketplace copy API to copy an ibsolution to an intermediate location and waits for the copy job
+
+    :return: (string) path the package was copied to
+    """
+    solution_name = f"{package_name}-{package_version}.ibsolution"
+    marketplace_url = os.path.join(
+        ib_host,
+        "api/v1/drives/system/global/fs/Instabase%20Drive/Applications/Marketplace/All",
+        quote(package_name),
+        quote(package_version),
+        solution_name,
+    )
+
+    if not intermediate_path.endswith(solution_name):
+        intermediate_path = os.path.join(intermediate_path, solution_name)
+
+    client = get_async_ib_client(ib_host, api_token)
+    resp = await client.request(
+        "POST",
+        os.path.join(marketplace_url, "copy?is_v2=true"),
+        json={"new_full_path": intermediate_path},
+    )
+    job_id = resp.json()["job_id"]
+    if not await client.wait_until_job_finishes(job_id, "job"):
+        raise Exception(f"Marketplace copy job {job_id} failed for {solution_name}")
+
+    return intermediate_path
+
+
+async def copy_marketplace_package_and_move_to_new_env(
+    source_ib_host,
+    target_ib_host,
+    package_name,
+    package_version,
+    source_api_token,
+    target_api_token,
+    download_folder,
+    prod_upload_folder,
+    artifact_cache=None,
+):
+    """
+    Moves a marketplace package from the source env to a folder on the target env, see
+    migration_helpers.copy_marketplace_package_and_move_to_new_env
+
+    :return: Tuple(AsyncResponse, string) - upload response (None if skipped) and path to uploaded file
+    """
+    solution_name = f"{package_name}-{package_version}.ibsolution"
+    final_upload_path = os.path.join(prod_upload_folder, solution_name)
+
+    # The cache takes a lock shared with threads committing to it, so it is only called from worker threads
+    cache_entry = (
+        await asyncio.to_thread(artifact_cache.entry, package_name, package_version)
+        if artifact_cache is not None
+        else None
+    )
+
+    copy_to_path = os.path.join(download_folder, solution_name)
+
+    # Skip the transfer if the target already has a complete copy of the package, comparing its digest with
+    # the cached copy, or failing that with the manifest left next to the source copy by an earlier transfer
+    expected_sha256 = cache_entry["sha256"] if cache_entry else None
+    if expected_sha256 is None:
+        source_manifest = await read_artifact_manifest(
+            source_ib_host, source_api_token, copy_to_path
+        )
+        expected_sha256 = source_manifest and source_manifest.get("sha256")
+    if await check_if_file_exists_on_ib_env(
+        target_ib_host,
+        target_api_token,
+        final_upload_path,
+        expected_sha256=expected_sha256,
+    ):
+        return None, final_upload_path
+
+    # Upload straight from the local cache if this version has been transferred before
+    cached_path = (
+        await asyncio.to_thread(artifact_cache.checkout, package_name, package_version)
+        if artifact_cache is not None
+        else None
+    )
+    if cached_path:
+        # Checked out so other packages being added to the cache can't evict it during the upload
+        try:
+            resp = await upload_local_file(
+                target_ib_host, target_api_token, final_upload_path, cached_path
+            )
+        finally:
+            await asyncio.to_thread(artifact_cache.release, cached_path)
+        await write_artifact_manifest(
+            target_ib_host,
+            target_api_token,
+            final_upload_path,
+            cache_entry["sha256"],
+            cache_entry["size"],
+        )
+        return resp, final_upload_path
+
+    if not await check_if_file_exists_on_ib_env(
+        source_ib_host, source_api_token, copy_to_path
+    ):
+        await copy_package_from_marketplace(
+            source_ib_host,
+            source_api_token,
+            package_name,
+            package_version,
+            copy_to_path,
+        )
+
+    # Published marketplace versions never change, so an interrupted transfer can be resumed by a rerun
+    checkpoint_key = f"{source_ib_host}/{package_name}/{package_version}"
+    if artifact_cache is not None:
+        # Opening, committing and discarding cache writers touch the disk, so they run in worker threads
+        cache_writer = await asyncio.to_thread(
+            artifact_cache.writer, package_name, package_version
+        )
+        digest = _DigestWriter(forward_to=cache_writer)
+        try:
+            resp = await stream_file_between_envs(
+                source_ib_host,
+                source_api_token,
+                copy_to_path,
+                target_ib_host,
+                target_api_token,
+                final_upload_path,
+                tee=digest,
+                checkpoint_key=checkpoint_key,
+            )
+        except BaseException:
+            await asyncio.to_thread(cache_writer.discard)
+            raise
+        await asyncio.to_thread(cache_writer.commit)
+    else:
+        digest = _DigestWriter()
+        resp = await stream_file_between_envs(
+            source_ib_host,
+            source_api_token,
+            copy_to_path,
+            target_ib_host,
+            target_api_token,
+            final_upload_path,
+            tee=digest,
+            checkpoint_key=checkpoint_key,
+        )
+
+    # Record what was transferred so reruns can tell complete copies from partial ones
+    sha256 = digest.sha256.hexdigest()
+    await asyncio.gather(
+        write_artifact_manifest(
+            target_ib_host, target_api_token, final_upload_path, sha256, digest.size
+        ),
+        write_artifact_manifest(
+            source_ib_host, source_api_token, copy_to_path, sha256, digest.size
+        ),
+    )
+    return resp, final_upload_path
+
+
+async def download_dependencies_from_dev_and_upload_to_prod(
+    source_ib_host,
+    target_ib_host,
+    source_api_token,
+    target_api_token,
+    download_folder_path,
+    upload_folder_path,
+    dependency_dict,
+    max_workers=DEFAULT_MAX_WORKERS,
+    artifact_cache=None,
+):
+    """
+    Moves the packages in dependency_dict from the source env marketplace to a 'target_dependencies' folder on
+    the target env, migrating up to max_workers packages at a time. See
+    migration_helpers.download_dependencies_from_dev_and_upload_to_prod
+
+    :return: List[str] list of paths for uploaded solutions, in dependency_dict order
+    """
+    source_download_folder = os.path.join(download_folder_path, "source_dependencies")
+    target_upload_folder = os.path.join(upload_folder_path, "target_dependencies")
+
+    await asyncio.gather(
+        create_folder_if_it_does_not_exists(
+            source_ib_host, source_api_token, source_download_folder
+        ),
+        create_folder_if_it_does_not_exists(
+            target_ib_host, target_api_token, target_upload_folder
+        ),
+    )
+
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def migrate_package(package_name, package_version):
+        async with semaphore:
+            _, uploaded_path = await copy_marketplace_package_and_move_to_new_env(
+                source_ib_host,
+                target_ib_host,
+                package_name,
+                package_version,
+                source_api_token,
+                target_api_token,
+                source_download_folder,
+                target_upload_folder,
+                artifact_cache=artifact_cache,
+            )
+            return uploaded_path
+
+    results = await asyncio.gather(
+        *[migrate_package(name, version) for name, version in dependency_dict.items()],
+        return_exceptions=True,
+    )
+
+    upload_paths = []
+    for (package_name, package_version), result in zip(
+        dependency_dict.items(), results
+    ):
+        if isinstance(result, BaseException):
+            logging.error(
+                "Error moving package name: {}, package_version: {}. Error: {}".format(
+                    package_name, package_version, result
+                )
+            )
+            continue
+        upload_paths.append(result)
+
+    return upload_paths
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+
+def parse_ibsolution_name(file_name):
+    """
+    Splits an .ibsolution file name into its package name and version
+
+    :param file_name: (string) file name or path (e.g. model_util-1.1.3.ibsolution)
+    :return: (string, string) package name and version, or (None, None) if the name doesn't match
+    """
+    match = re.match(
+        r"^(.+)-([0-9]+(?:\.[0-9]+)*)\.ibsolution$", os.path.basename(file_name)
+    )
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class _CacheWriter:
+    """
+    File-like object that writes an artifact into the cache while hashing it. The artifact only becomes
+    visible in the cache once the writer is committed
+    """
+
+    def __init__(self, cache, package_name, package_version):
+        self._cache = cache
+        self._package_name = package_name
+        self._package_version = package_version
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+        fd, self._temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".partial")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+        self._sha256.update(data)
+        self._size += len(data)
+        return len(data)
+
+    def commit(self):
+        self._file.close()
+        return self._cache._add(
+            self._package_name,
+            self._package_version,
+            self._temp_path,
+            self._sha256.hexdigest(),
+            self._size,
+        )
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+class ArtifactCache:
+    """
+    Local on-disk cache of .ibsolution artifacts. Marketplace artifacts are immutable for a given name and
+    version, so once an artifact has been transferred it can be reused by later runs instead of being copied
+    and downloaded from the source environment again
+
+    Artifacts are stored content-addressed under objects/<sha256>, with index.json mapping each
+    name==version to its digest and size. When the cache grows past max_bytes the least recently used
+    artifacts are evicted, except those checked out for reading
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: (string) local directory to store the cache in, created if it doesn't exist
+        :param max_bytes: (int) maximum total size of cached artifacts in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(directory, "objects")
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        # Number of checkouts of each object still being read, pinned objects are never evicted
+        self._pins = {}
+
+        os.makedirs(self._objects_dir, exist_ok=True)
+        self._index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as fp:
+            json.dump(self._index, fp, indent=2, sort_keys=True)
+        os.replace(temp_path, self._index_path)
+
+    def _object_path(self, sha256):
+        return os.path.join(self._objects_dir, sha256)
+
+    @staticmethod
+    def _key(package_name, package_version):
+        return f"{package_name}=={package_version}"
+
+    def entry(self, package_name, package_version):
+        """
+        Gets the index entry of a cached artifact without touching it
+
+        :param package_name: (string) name of package (e.g. model_util)
+        :param package_version: (string) version of package (e.g. 1.1.5)
+        :return: (dict) {"sha256": ..., "size": ...} or None if the artifact isn't cached
+        """
+        with self._lock:
+            entry = self._index.get(self._key(package_name, package_version))
+            return dict(entry) if entry else None
+
+    def get(self, package_name, package_version):
+        """
+        Looks up a cached artifact and marks it as recently used
+
+        :param package_name: (string) name of package (e.g. model_util)
+        :param package_version: (string) version of package (e.g. 1.1.5)
+        :return: (string) local path to the cached artifact, or None on a cache miss
+        """
+        with self._lock:
+            return self._lookup(package_name, package_version)
+
+    def checkout(self, package_name, package_version):
+        """
+        Looks up a cached artifact like get, and pins it so it isn't evicted while it is being read. Other
+        threads can add to the cache in the meantime. Pass the returned path to release once done with it
+
+        :param package_name: (string) name of package (e.g. model_util)
+        :param package_version: (string) version of package (e.g. 1.1.5)
+        :return: (string) local path to the cached artifact, or None on a cache miss
+        """
+        with self._lock:
+            path = self._lookup(package_name, package_version)
+            if path:
+                self._pins[path] = self._pins.get(path, 0) + 1
+            return path
+
+    def release(self, path):
+        """
+        Unpins an artifact returned by checkout, letting it be evicted again
+
+        :param path: (string) path returned by checkout, None is ignored
+        :return: None
+        """
+        if not path:
+            return
+        with self._lock:
+            self._pins[path] -= 1
+            if not self._pins[path]:
+                del self._pins[path]
+
+    def _lookup(self, package_name, package_version):
+        # Called holding the lock
+        key = self._key(package_name, package_version)
+        entry = self._index.get(key)
+        if not entry:
+            return None
+
+        path = self._object_path(entry["sha256"])
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            # Object was removed or damaged outside of the cache, forget it
+            logging.info(f"Dropping invalid cache entry for {key}")
+            self._index.pop(key)
+            self._write_index()
+            return None
+
+        # mtime is used as the last access time for LRU eviction
+        os.utime(path)
+        return path
+
+    def writer(self, package_name, package_version):
+        """
+        Opens a writer to add an artifact to the cache as it is being transferred. Use as a context manager:
+        the artifact is committed on a clean exit and discarded if an error is raised
+
+        :param package_name: (string) name of package (e.g. model_util)
+        :param package_version: (string) version of package (e.g. 1.1.5)
+        :return: file-like object with write, commit and discard methods
+        """
+        return _CacheWriter(self, package_name, package_version)
+
+    def put_file(self, package_name, package_version, local_path):
+        """
+        Adds a local artifact file to the cache
+
+        :param package_name: (string) name of package (e.g. model_util)
+        :param package_version: (string) version of package (e.g. 1.1.5)
+        :param local_path: (string) path of the artifact to copy into the cache
+        :return: (string) local path to the cached artifact
+        """
+        with self.writer(package_name, package_version) as writer:
+            with open(local_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1048576), b""):
+                    writer.write(chunk)
+        return self.get(package_name, package_version)
+
+    def _add(self, package_name, package_version, temp_path, sha256, size):
+        with self._lock:
+            path = self._object_path(sha256)
+            os.replace(temp_path, path)
+            os.utime(path)
+            self._index[self._key(package_name, package_version)] = {
+                "sha256": sha256,
+                "size": size,
+            }
+            self._evict(keep=sha256)
+            self._write_index()
+        return path
+
+    def _evict(self, keep=None):
+        # Group index keys by object since identical content is only stored once
+        keys_by_object = {}
+        for key, entry in self._index.items():
+            keys_by_object.setdefault(entry["sha256"], []).append(key)
+
+        objects = []
+        total_size = 0
+        for sha256 in keys_by_object:
+            path = self._object_path(sha256)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            objects.append((stat.st_mtime, sha256, stat.st_size))
+            total_size += stat.st_size
+
+        for _, sha256, size in sorted(objects):
+            if total_size <= self.max_bytes:
+                break
+            if sha256 == keep or self._object_path(sha256) in self._pins:
+                continue
+            os.remove(self._object_path(sha256))
+            for key in keys_by_object[sha256]:
+                self._index.pop(key)
+            total_size -= size
+            logging.info(f"Evicted {', '.join(keys_by_object[sha256])} from cache")
+
+    def clear(self):
+        """
+        Removes every artifact from the cache
+        """
+        with self._lock:
+            shutil.rmtree(self._objects_dir, ignore_errors=True)
+            os.makedirs(self._objects_dir, exist_ok=True)
+            self._index = {}
+            self._write_index()
@@ -1,67 +1,1952 @@
 import os
+import bisect
+import hashlib
+import re
+import zipfile
 from io import BytesIO
+import threading
+import queue
 import requests
 import json
 from urllib.parse import quote
 import time
+import random
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+from ib_cicd.artifact_cache import parse_ibsolution_name
+from ib_cicd.profiling import (
+    HTTP,
+    QUEUE,
+    SLEEP,
+    endpoint_template,
+    get_profiler,
+    span,
+)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CHUNK_SIZE = 1048576
+REMOTE_READ_BLOCK_SIZE = 65536
+UPLOAD_PART_SIZE = 10485760
+MIN_UPLOAD_PART_SIZE = 1048576
+MAX_UPLOAD_PART_SIZE = 67108864
+# Upload parts are sized so each request takes about this long, long enough for the round trip to be a small
+# share of it while keeping a failed part cheap to retry
+UPLOAD_PART_SECONDS = 2
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_PUBLISH_WORKERS = 4
+
+# Files that are already compressed gain nothing from being deflated again, so they're stored as they are
+STORED_EXTENSIONS = {
+    ".7z",
+    ".bz2",
+    ".gif",
+    ".gz",
+    ".ibsolution",
+    ".jpeg",
+    ".jpg",
+    ".mp4",
+    ".png",
+    ".tgz",
+    ".webp",
+    ".xz",
+    ".zip",
+}
+
+
+class PollingPolicy:
+    """
+    Schedule for polling the Job Status API. Polls quickly at first, then backs off exponentially up to a cap
+    with random jitter, and gives up once the overall timeout has passed
+    """
+
+    def __init__(
+        self,
+        initial_interval=0.25,
+        max_interval=5,
+        multiplier=2,
+        jitter=0.1,
+        timeout=None,
+    ):
+        """
+        :param initial_interval: (float) seconds to wait before the second poll
+        :param max_interval: (float) maximum seconds to wait between polls
+        :param multiplier: (float) factor the interval grows by after each poll
+        :param jitter: (float) fraction of each interval to randomly add or remove, so concurrent pollers spread out
+        :param timeout: (float) overall seconds to wait for a job before giving up, None waits forever
+        """
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+
+    def __repr__(self):
+        return (
+            f"PollingPolicy(initial_interval={self.initial_interval}, max_interval={self.max_interval}, "
+            f"multiplier={self.multiplier}, jitter={self.jitter}, timeout={self.timeout})"
+        )
+
+    def with_overrides(self, **overrides):
+        """
+        Creates a copy of the policy with some settings replaced
+
+        :param overrides: settings to replace (any of the __init__ parameters)
+        :return: PollingPolicy
+        """
+        settings = vars(self).copy()
+        for key in overrides:
+            if key not in settings:
+                raise ValueError(f"Unknown polling policy setting: {key}")
+        settings.update(overrides)
+        return PollingPolicy(**settings)
+
+    def deadline(self):
+        """
+        :return: (float) time.monotonic() value after which to give up, or None if there is no timeout
+        """
+        if self.timeout is None:
+            return None
+        return time.monotonic() + self.timeout
+
+    def intervals(self):
+        """
+        Generates the seconds to sleep between consecutive polls
+
+        :return: generator of floats
+        """
+        interval = self.initial_interval
+        while True:
+            yield interval * (1 + random.uniform(-self.jitter, self.jitter))
+            interval = min(interval * self.multiplier, self.max_interval)
+
+
+class PartSizer:
+    """
+    Picks the size of each upload part from the throughput measured on the parts sent so far, so that each
+    request takes about target_seconds. High latency or fast links get large parts so the round trip is paid
+    less often, slow links get small parts that are cheap to retry. The size at most doubles or halves per part
+    """
+
+    def __init__(
+        self,
+        initial_size=UPLOAD_PART_SIZE,
+        min_size=None,
+        max_size=None,
+        target_seconds=UPLOAD_PART_SECONDS,
+    ):
+        """
+        :param initial_size: (int) size of the first part in bytes
+        :param min_size: (int) smallest part size in bytes, defaults to the configured minimum
+        :param max_size: (int) largest part size in bytes, defaults to the configured maximum
+        :param target_seconds: (float) how long each part should take to send
+        """
+        self.min_size = min_size or _upload_part_size_bounds[0]
+        self.max_size = max_size or _upload_part_size_bounds[1]
+        self.target_seconds = target_seconds
+        self._size = min(max(initial_size, self.min_size), self.max_size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fixed(cls, size):
+        """
+        :param size: (int) part size in bytes
+        :return: PartSizer that always picks size
+        """
+        return cls(size, min_size=size, max_size=size)
+
+    def next_size(self):
+        """
+        :return: (int) size in bytes to make the next part
+        """
+        with self._lock:
+            return self._size
+
+    def record(self, size, seconds):
+        """
+        Adjusts the part size after a part has been sent
+
+        :param size: (int) size of the sent part in bytes
+        :param seconds: (float) time taken to send it
+        :return: None
+        """
+        if size <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            ideal = size * self.target_seconds / seconds
+            ideal = min(max(ideal, self._size / 2), self._size * 2)
+            self._size = int(min(max(ideal, self.min_size), self.max_size))
+
+
+# Bounds of adaptive upload part sizes, see set_upload_part_size_bounds
+_upload_part_size_bounds = (MIN_UPLOAD_PART_SIZE, MAX_UPLOAD_PART_SIZE)
+
+
+def set_upload_part_size_bounds(min_size=None, max_size=None):
+    """
+    Sets the bounds that adaptive upload part sizes are kept within
+
+    :param min_size: (int) smallest part size in bytes, None keeps the current minimum
+    :param max_size: (int) largest part size in bytes, None keeps the current maximum
+    :return: (tuple) the bounds now used
+    """
+    global _upload_part_size_bounds
+    min_size = min_size or _upload_part_size_bounds[0]
+    max_size = max_size or _upload_part_size_bounds[1]
+    if min_size > max_size:
+        raise ValueError(
+            f"Minimum part size {min_size} is larger than maximum part size {max_size}"
+        )
+    _upload_part_size_bounds = (min_size, max_size)
+    return _upload_part_size_bounds
+
+
+# Default polling policies per job type, flows run much longer than file/marketplace jobs. Jobs are waited for
+# until they finish unless a timeout is set for their type or the run deadline passes
+_polling_policies = {
+    "job": PollingPolicy(),
+    "async": PollingPolicy(),
+    "flow": PollingPolicy(initial_interval=1, max_interval=30),
+    # Waits for the output file of work that returned no job ID, which never appears if the work failed
+    "file": PollingPolicy(timeout=1800),
+    # Retries of a failed upload part, the timeout bounds how long one part is retried for
+    "upload_part": PollingPolicy(initial_interval=1, max_interval=30, timeout=600),
+}
+
+# Upload responses worth retrying, anything else (e.g. 401, 404) fails the same way on every attempt
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Directory to checkpoint upload progress in so a rerun can resume an interrupted upload, None disables it
+_upload_checkpoint_dir = None
+
+
+def get_polling_policy(job_type):
+    """
+    Gets the polling policy used for a job type
+
+    :param job_type: (string) job type [flow, refiner, job, async, group]
+    :return: PollingPolicy
+    """
+    return _polling_policies.get(job_type) or PollingPolicy()
+
+
+def set_polling_policy(job_type, **overrides):
+    """
+    Overrides settings of the polling policy used for a job type
+
+    :param job_type: (string) job type [flow, refiner, job, async, group]
+    :param overrides: settings to replace (any of the PollingPolicy parameters)
+    :return: PollingPolicy now used for job_type
+    """
+    _polling_policies[job_type] = get_polling_policy(job_type).with_overrides(
+        **overrides
+    )
+    return _polling_policies[job_type]
+
+
+# Default (connect, read) timeouts in seconds of API requests, looked up by "METHOD endpoint", then by method, then
+# "default". Transfers of large files get longer read timeouts, HEAD and job status checks shorter ones
+_request_timeouts = {
+    "default": (10, 120),
+    "HEAD": (10, 30),
+    "GET /api/v1/jobs/status": (10, 30),
+    "GET /api/v2/files/{path}": (10, 600),
+    "PUT /api/v2/files/{path}": (10, 600),
+    "PATCH /api/v2/files/{path}": (10, 600),
+}
+
+# time.monotonic() value after which no more API requests are sent, see set_run_deadline
+_run_deadline = None
+
+
+def get_request_timeout(method, url):
+    """
+    Gets the default timeout of an API request
+
+    :param method: (string) HTTP method
+    :param url: (string) url of the request
+    :return: (tuple) connect and read timeouts in seconds
+    """
+    return (
+        _request_timeouts.get(f"{method} {endpoint_template(url)}")
+        or _request_timeouts.get(method)
+        or _request_timeouts["default"]
+    )
+
+
+def set_request_timeout(key, connect=None, read=None):
+    """
+    Overrides the default timeout of API requests
+
+    :param key: (string) "METHOD endpoint" (e.g. "PATCH /api/v2/files/{path}"), a method (e.g. "HEAD"), or
+                "default" for every other request
+    :param connect: (float) seconds to wait for a connection, None keeps the current value
+    :param read: (float) seconds to wait for each read of the response, None keeps the current value
+    :return: (tuple) connect and read timeouts now used for key
+    """
+    current_connect, current_read = _request_timeouts.get(
+        key, _request_timeouts["default"]
+    )
+    _request_timeouts[key] = (
+        current_connect if connect is None else connect,
+        current_read if read is None else read,
+    )
+    return _request_timeouts[key]
+
+
+def set_run_deadline(seconds):
+    """
+    Sets a deadline for the whole run. Request timeouts and polling waits are cut short so nothing waits past
+    it, and requests made after it raise TimeoutError
+
+    :param seconds: (float) seconds from now until the deadline, None removes the deadline
+    :return: (float) time.monotonic() value of the deadline, or None
+    """
+    global _run_deadline
+    _run_deadline = None if seconds is None else time.monotonic() + seconds
+    return _run_deadline
+
+
+def get_run_deadline():
+    """
+    :return: (float) time.monotonic() value of the run deadline, or None if there is no deadline
+    """
+    return _run_deadline
+
+
+def _clamp_to_run_deadline(seconds):
+    # Shortens a wait so it ends by the run deadline
+    if _run_deadline is None:
+        return seconds
+    remaining = max(0, _run_deadline - time.monotonic())
+    return remaining if seconds is None else min(seconds, remaining)
+
+
+def _clamp_request_timeout(method, url, timeout):
+    # Cuts a request timeout, a value or a (connect, read) tuple, short to end by the run deadline. Raises
+    # TimeoutError once nothing is left of it rather than passing requests a timeout of 0
+    if _run_deadline is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        timeout = tuple(_clamp_to_run_deadline(value) for value in timeout)
+    else:
+        timeout = _clamp_to_run_deadline(timeout)
+    if min(timeout if isinstance(timeout, tuple) else (timeout,)) <= 0:
+        raise TimeoutError(
+            f"Run deadline passed before {method} {endpoint_template(url)}"
+        )
+    return timeout
+
+
+def set_upload_checkpoint_dir(directory):
+    """
+    Sets the local directory used to checkpoint upload progress. Uploads that are given a checkpoint key
+    record how many bytes have been sent after every part, and an upload of the same content to the same
+    path picks up where an interrupted run left off
+
+    :param directory: (string) local directory to keep checkpoints in, None disables checkpointing
+    :return: None
+    """
+    global _upload_checkpoint_dir
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _upload_checkpoint_dir = directory
+
+
+def _upload_checkpoint_path(ib_host, path):
+    name = hashlib.sha256(f"{ib_host}/{path}".encode()).hexdigest()
+    return os.path.join(_upload_checkpoint_dir, f"{name}.json")
+
+
+def _load_upload_checkpoint(ib_host, path, checkpoint_key):
+    # Gets the offset an earlier upload of the same content reached, 0 if there's no checkpoint for it
+    if not (_upload_checkpoint_dir and checkpoint_key):
+        return 0
+    try:
+        with open(_upload_checkpoint_path(ib_host, path)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get("key") != checkpoint_key:
+        return 0
+    return checkpoint.get("offset", 0)
+
+
+def _save_upload_checkpoint(ib_host, path, checkpoint_key, offset):
+    if not (_upload_checkpoint_dir and checkpoint_key):
+        return
+    checkpoint_path = _upload_checkpoint_path(ib_host, path)
+    with open(f"{checkpoint_path}.tmp", "w") as f:
+        json.dump({"key": checkpoint_key, "offset": offset}, f)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+def _remove_upload_checkpoint(ib_host, path):
+    if not _upload_checkpoint_dir:
+        return
+    try:
+        os.remove(_upload_checkpoint_path(ib_host, path))
+    except FileNotFoundError:
+        pass
+
+
+def _remaining_part(url, part, offset, remote_size):
+    """
+    Works out what is left to send of a part after a failed upload request, from the size of the file on the
+    environment
+
+    :param url: (string) Files API url of the file being uploaded
+    :param part: (bytes) part that failed
+    :param offset: (int) position of the part in the file
+    :param remote_size: (int) size of the file on the environment, None if it couldn't be read
+    :return: (tuple) data still to send and its position in the file, data is None if the whole part arrived
+    """
+    end = offset + len(part)
+    if remote_size == end:
+        return None, end
+    if remote_size is not None and offset <= remote_size < end:
+        return memoryview(part)[remote_size - offset :], remote_size
+    if offset == 0:
+        return part, 0
+    raise Exception(
+        f"Can't resume upload of {url}: expected {offset} bytes on the environment, found {remote_size}"
+    )
+
+
+def get_job_id(resp):
+    """
+    Gets the job ID returned by an API that starts an asynchronous job (e.g. extract, copy, compile)
+
+    :param resp: Response object
+    :return: (string) job ID, or None if the response doesn't contain one
+    """
+    try:
+        content = json.loads(resp.content)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(content, dict):
+        return None
+    if content.get("job_id"):
+        return content["job_id"]
+    data = content.get("data")
+    if isinstance(data, dict):
+        return data.get("job_id")
+    return None
+
+
+class FolderListing:
+    """
+    Listing of a folder on an IB environment, with an index of the .ibsolution files in it sorted by version
+    so the latest one can be looked up without scanning the listing again
+    """
+
+    def __init__(self, folder_path):
+        """
+        :param folder_path: (string) path of the listed folder
+        """
+        self.folder_path = folder_path
+        self.nodes = {}
+        self._ibsolutions = []
+
+    def add_nodes(self, nodes):
+        """
+        Adds a page of listed nodes to the listing and the version index
+
+        :param nodes: (list) node dictionaries returned by the Filesystem API
+        :return: None
+        """
+        for node in nodes:
+            full_path = node["full_path"]
+            self.nodes[full_path] = node
+
+            _, version = parse_ibsolution_name(full_path)
+            if version:
+                bisect.insort(
+                    self._ibsolutions,
+                    (tuple(map(int, version.split("."))), full_path),
+                )
+
+    def file_size(self, path):
+        """
+        :param path: (string) full path of a file in the folder
+        :return: (int) listed size of the file, or None if there is no such file in the listing
+        """
+        node = self.nodes.get(path)
+        if node is None or node.get("type") == "folder":
+            return None
+        return node.get("size")
+
+    def folder_paths(self):
+        """
+        :return: (list) paths of the folders in the folder
+        """
+        return [
+            path for path, node in self.nodes.items() if node.get("type") == "folder"
+        ]
+
+    def ibsolution_paths(self):
+        """
+        :return: (list) paths of the .ibsolution files in the folder, oldest version first
+        """
+        return [path for _, path in self._ibsolutions]
+
+    def latest_ibsolution_path(self):
+        """
+        :return: (string) path of the .ibsolution with the highest version, or "" if there are none
+        """
+        return self._ibsolutions[-1][1] if self._ibsolutions else ""
+
+
+class RemoteFile:
+    """
+    Read-only, seekable file-like view of a file on an IB environment that fetches the bytes it is asked for
+    with HTTP range requests, so zipfile can read one member of a large archive without downloading it all
+
+    Reads are rounded up to block_size and the last block of the file is fetched in one go, as zip readers
+    start by reading the central directory at the end. If the server ignores the Range header the whole
+    file is streamed into memory once and served from there
+    """
+
+    def __init__(self, client, path, block_size=REMOTE_READ_BLOCK_SIZE):
+        """
+        :param client: (IBClient) client for the IB environment
+        :param path: (string) path to file on IB environment
+        :param block_size: (int) minimum number of bytes to fetch per request
+        """
+        self._client = client
+        self._url = os.path.join(client.api_root(), path)
+        self._block_size = block_size
+        self._position = 0
+        self._size = None
+        self._buffer = b""
+        self._buffer_start = 0
+
+        # Fetching the tail of the file first also tells us its size
+        self._fetch(None, block_size)
+
+    def _fetch(self, start, length):
+        # A start of None requests the last length bytes of the file
+        byte_range = f"-{length}" if start is None else f"{start}-{start + length - 1}"
+        resp = self._client.get(
+            self._url,
+            params={"expect-node-type": "file"},
+            headers={"Range": f"bytes={byte_range}"},
+            stream=True,
+        )
+        with resp:
+            if resp.status_code == 206:
+                content_range = re.match(
+                    r"bytes (\d+)-\d+/(\d+)", resp.headers.get("Content-Range", "")
+                )
+                if content_range:
+                    self._buffer = resp.content
+                    self._buffer_start = int(content_range.group(1))
+                    self._size = int(content_range.group(2))
+                    return
+            if resp.status_code not in [200, 206]:
+                raise Exception(
+                    f"Error reading file: {resp.content}, for url: {self._url}"
+                )
+
+            # Range isn't supported, fall back to streaming the whole file into memory
+            logging.info(
+                f"Range requests not supported for {self._url}, reading whole file"
+            )
+            self._buffer = b"".join(resp.iter_content(chunk_size=DEFAULT_CHUNK_SIZE))
+            self._buffer_start = 0
+            self._size = len(self._buffer)
+            self._block_size = self._size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._position
+        size = min(size, self._size - self._position)
+        if size <= 0:
+            return b""
+
+        offset = self._position - self._buffer_start
+        if offset < 0 or offset + size > len(self._buffer):
+            tail_start = max(0, self._size - self._block_size)
+            if self._position >= tail_start:
+                self._fetch(tail_start, self._size - tail_start)
+            else:
+                length = min(max(size, self._block_size), self._size - self._position)
+                self._fetch(self._position, length)
+            offset = self._position - self._buffer_start
+
+        data = self._buffer[offset : offset + size]
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._position = offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        elif whence == os.SEEK_END:
+            self._position = self._size + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._buffer = b""
+
+
+class JobPoller:
+    """
+    Tracks the asynchronous jobs started on one IB environment and resolves a Future for each. A single
+    background thread checks every unfinished job through the Job Status API, so waiting on many jobs takes one
+    thread rather than one polling loop per caller. Jobs polled with the same PollingPolicy share one backoff
+    schedule and are checked together, and the schedule starts over whenever a job joins so new jobs are checked
+    quickly. The thread exits once no jobs are left
+    """
+
+    def __init__(self, client):
+        """
+        :param client: (IBClient) client for the IB environment the jobs run on
+        """
+        self.client = client
+        # Unfinished jobs grouped by polling policy, each group with its own backoff schedule
+        self._groups = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def track(self, job_id, job_type="job", polling_policy=None):
+        """
+        Starts tracking a job
+
+        :param job_id: (string) job id to track
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                               for job_type
+        :return: (Future) resolves to the final Job Status API content of the job (a dict with its "status" and
+                 "state") once it finishes or fails. Raises TimeoutError if the policy has a timeout and it passes
+        """
+        policy = polling_policy or get_polling_policy(job_type)
+        future = Future()
+        future.set_running_or_notify_cancel()
+        job = {
+            "job_id": job_id,
+            "job_type": job_type,
+            "timeout": policy.timeout,
+            "deadline": policy.deadline(),
+            "state": None,
+            "future": future,
+        }
+
+        with self._condition:
+            key = repr(policy)
+            intervals = policy.intervals()
+            group = self._groups.get(key)
+            if group is None:
+                self._groups[key] = {
+                    "key": key,
+                    "jobs": [job],
+                    "intervals": intervals,
+                    "next_poll": time.monotonic(),
+                }
+            else:
+                group["jobs"].append(job)
+                group["intervals"] = intervals
+                group["next_poll"] = min(
+                    group["next_poll"], time.monotonic() + next(intervals)
+                )
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ib-job-poller", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def close(self):
+        """
+        Stops tracking every unfinished job, failing their Futures
+
+        :return: None
+        """
+        with self._condition:
+            for group in self._groups.values():
+                for job in group["jobs"]:
+                    job["future"].set_exception(
+                        Exception(
+                            f"Stopped tracking {job['job_type']} job {job['job_id']}, the IB client was closed"
+                        )
+                    )
+            self._groups.clear()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._wait_for_due_groups()
+                if due is None:
+                    self._thread = None
+                    return
+                polls = [(group, list(group["jobs"])) for group in due]
+
+            outcomes = [(job, self._check(job)) for _, jobs in polls for job in jobs]
+
+            with self._condition:
+                for job, outcome in outcomes:
+                    if outcome is not None and not job["future"].done():
+                        resolve, value = outcome
+                        resolve(value)
+
+                now = time.monotonic()
+                for group, _ in polls:
+                    group["jobs"] = [
+                        job for job in group["jobs"] if not job["future"].done()
+                    ]
+                    if not group["jobs"]:
+                        self._groups.pop(group["key"], None)
+                        continue
+                    group["next_poll"] = now + next(group["intervals"])
+                    # Check again by the earliest job timeout so it's reported on time
+                    deadlines = [
+                        job["deadline"]
+                        for job in group["jobs"]
+                        if job["deadline"] is not None
+                    ]
+                    if deadlines:
+                        group["next_poll"] = min(group["next_poll"], min(deadlines))
+
+    def _wait_for_due_groups(self):
+        # Waits until a group is due to be polled, called holding the condition. Returns None once no jobs are left
+        while self._groups:
+            now = time.monotonic()
+            # Once the run deadline has passed every job is checked, which fails it with TimeoutError
+            deadline_passed = _run_deadline is not None and now >= _run_deadline
+            due = [
+                group
+                for group in self._groups.values()
+                if deadline_passed or group["next_poll"] <= now
+            ]
+            if due:
+                return due
+
+            wait = min(group["next_poll"] for group in self._groups.values()) - now
+            with span("poll wait", SLEEP, reason="poll"):
+                self._condition.wait(_clamp_to_run_deadline(wait))
+        return None
+
+    def _check(self, job):
+        # Polls one job, returning the Future method and value to resolve it with or None if it's still running
+        try:
+            resp = self.client.check_job_status(job["job_id"], job["job_type"])
+            content = json.loads(resp.content)
+        except Exception as e:
+            return job["future"].set_exception, e
+
+        job["state"] = content.get("state")
+        if content.get("status") != "OK" or job["state"] in ["DONE", "COMPLETE"]:
+            return job["future"].set_result, content
+
+        if job["deadline"] is not None and time.monotonic() >= job["deadline"]:
+            return job["future"].set_exception, TimeoutError(
+                f"Timed out after {job['timeout']}s waiting for {job['job_type']} job {job['job_id']} "
+                f"(last state: {job['state']})"
+            )
+        return None
 
 
-def __get_file_api_root(ib_host, api_version="v2", add_files_suffix=True):
+class IBClient:
     """
-    Gets file api root from an ib host url
-    E.g.
+    Client for a single Instabase environment
+
+    Holds a requests.Session so connections to the IB host are kept alive and pooled between API calls,
+    and the Authorization header is only built once
+    """
+
+    def __init__(
+        self,
+        ib_host,
+        api_token,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=None,
+        verify=False,
+    ):
+        """
+        :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+        :param api_token: (string) API token for IB environment
+        :param pool_size: (int) maximum number of connections to keep open to the IB host
+        :param timeout: (float or tuple) timeout in seconds for all requests, either a single value or a
+                        (connect, read) tuple. None uses the default timeout of each endpoint
+        :param verify: (bool) flag indicating whether to verify TLS certificates
+        """
+        self.ib_host = ib_host
+        self.timeout = timeout
+        self.verify = verify
+
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": "Bearer {0}".format(api_token)})
+
+        # Single pool per host as each client only talks to one IB environment
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Folder listings fetched during this run, dropped when this client writes into the folder
+        self._listings = {}
+        self._listing_locks = {}
+        self._listing_invalidations = 0
+        self._listings_lock = threading.Lock()
+
+        # Tracks the asynchronous jobs started through this client
+        self.job_poller = JobPoller(self)
+
+    def api_root(self, api_version="v2", add_files_suffix=True):
+        """
+        Gets file api root for the IB host
+
+        :param api_version: (string) api_version to add to ib_host to create file api root url
+        :param add_files_suffix: (bool) flag indicating whether to add 'files' suffix to the api root
+        :return: (string) IB host + file api root (e.g. https://www.instabase.com/api/v2/files)
+        """
+
+        # Add 'files' suffix if required
+        if add_files_suffix:
+            return os.path.join(*[self.ib_host, "api", api_version, "files"])
+
+        return os.path.join(*[self.ib_host, "api", api_version])
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through the pooled session, applying the client's TLS settings and timeout. Without a
+        timeout for the client or the request, the default timeout of the endpoint is used. Timeouts are cut
+        short to end by the run deadline
+
+        :param method: (string) HTTP method
+        :param url: (string) url to send request to
+        :param kwargs: keyword arguments passed through to requests.Session.request
+        :return: Response object
+        """
+        kwargs.setdefault("verify", self.verify)
+        timeout = kwargs.get("timeout", self.timeout)
+        if timeout is None:
+            timeout = get_request_timeout(method, url)
+        kwargs["timeout"] = _clamp_request_timeout(method, url, timeout)
+
+        profiler = get_profiler()
+        if profiler is None:
+            return self.session.request(method, url, **kwargs)
+
+        endpoint = endpoint_template(url)
+        name = f"{method} {endpoint}"
+        args = {
+            "method": method,
+            "endpoint": endpoint,
+            "bytes_sent": _body_size(kwargs),
+        }
+        if not kwargs.get("stream"):
+            with profiler.span(name, HTTP, **args) as args:
+                resp = self.session.request(method, url, **kwargs)
+                args["status"] = resp.status_code
+                args["bytes_received"] = len(resp.content)
+                return resp
+
+        # A streamed body is read after this returns, so the span ends when the body is read or closed
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            args["error"] = type(e).__name__
+            profiler.record(name, HTTP, start, time.perf_counter() - start, args)
+            raise
+        args["status"] = resp.status_code
+        args["bytes_received"] = 0
+        resp.raw = _ProfiledBody(resp.raw, profiler, name, start, args)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def list_folder(self, folder_path):
+        """
+        Lists a folder, paging through the listing. Listings are cached for the lifetime of the client and
+        invalidated when the client writes into the folder, so only changes made by other clients are missed
+
+        :param folder_path: (string) path of folder on IB environment
+        :return: FolderListing
+        """
+        folder_path = folder_path.rstrip("/")
+        with self._listings_lock:
+            folder_lock = self._listing_locks.setdefault(folder_path, threading.Lock())
+
+        # Concurrent steps listing the same folder wait for one fetch instead of each listing it
+        with folder_lock:
+            with self._listings_lock:
+                if folder_path in self._listings:
+                    return self._listings[folder_path]
+                invalidations = self._listing_invalidations
+            return self._fetch_listing(folder_path, invalidations)
+
+    def _fetch_listing(self, folder_path, invalidations):
+        listing = FolderListing(folder_path)
+        url = os.path.join(self.api_root(), quote(folder_path))
+        params = {"expect-node-type": "folder"}
+        while True:
+            resp = self.get(url, params=params)
+            if resp.status_code != 200:
+                raise Exception(f"Error listing folder: {resp.content}, for url: {url}")
+
+            # Index each page as it arrives rather than collecting the whole listing first
+            content = json.loads(resp.content)
+            listing.add_nodes(content.get("nodes", []))
+            if not content.get("has_more") or not content.get("next_page_token"):
+                break
+            params = {**params, "start-token": content["next_page_token"]}
+
+        with self._listings_lock:
+            # Don't cache a listing that may have missed a write made while it was being fetched
+            if invalidations == self._listing_invalidations:
+                self._listings[folder_path] = listing
+        return listing
+
+    def invalidate_listing(self, path):
+        """
+        Drops cached listings affected by a write to path: its parent folder, the path itself and any folder
+        inside it
+
+        :param path: (string) path of file or folder written to
+        :return: None
+        """
+        path = path.rstrip("/")
+        parent = os.path.dirname(path)
+        with self._listings_lock:
+            self._listing_invalidations += 1
+            for folder_path in list(self._listings):
+                if folder_path in [path, parent] or folder_path.startswith(path + "/"):
+                    self._listings.pop(folder_path)
+
+    def close(self):
+        self.job_poller.close()
+        self.session.close()
+
+    def upload_chunks(self, path, data, part_size=None):
+        """
+        Uploads data to a location on the Instabase environment in parts. Unless part_size is given, parts are
+        sized from the throughput measured while uploading, and the next part is read while the current one is
+        being sent. Bytes are sliced into parts without being copied
+
+        :param path: (string) path on IB environment to upload to
+        :param data: (bytes, string or file-like) data to upload, a path of a local file to upload, or a binary
+                     file-like object to read the data from
+        :param part_size: (int) fixed size of each uploaded part in bytes
+        :return: Response object
+        """
+        sizer = PartSizer() if part_size is None else PartSizer.fixed(part_size)
+
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            checkpoint_key = None
+            if _upload_checkpoint_dir:
+                checkpoint_key = f"sha256:{hashlib.sha256(data).hexdigest()}"
+            parts = _iter_buffer_parts(data, sizer)
+            return self.upload_parts(
+                path, parts, checkpoint_key=checkpoint_key, part_sizer=sizer
+            )
+
+        if isinstance(data, (str, os.PathLike)):
+            stat = os.stat(data)
+            checkpoint_key = (
+                f"{os.path.abspath(data)}:{stat.st_size}:{stat.st_mtime_ns}"
+            )
+            with open(data, "rb") as f:
+                return self._upload_file_object(path, f, sizer, checkpoint_key)
+
+        return self._upload_file_object(path, data, sizer, None)
+
+    def _upload_file_object(self, path, f, sizer, checkpoint_key):
+        # Read the next part on a background thread while the current one is being sent
+        parts = _prefetch(iter(lambda: f.read(sizer.next_size()), b""))
+        try:
+            return self.upload_parts(
+                path, parts, checkpoint_key=checkpoint_key, part_sizer=sizer
+            )
+        finally:
+            parts.close()
+
+    def upload_parts(self, path, parts, checkpoint_key=None, part_sizer=None):
+        """
+        Uploads a sequence of parts to a location on the Instabase environment, sending one PATCH request per
+        part with the IB-Cursor header. Parts are consumed lazily so they can be produced while earlier parts
+        are still being sent
+
+        A part that fails is retried with backoff, after checking with a HEAD request how much of it the
+        environment already received so only the missing bytes are sent again. With a checkpoint key and a
+        checkpoint directory set, progress is saved after every part and a later upload with the same key
+        skips the bytes that are already on the environment
+
+        :param path: (string) path on IB environment to upload to
+        :param parts: (iterable of bytes) parts to upload in order
+        :param checkpoint_key: (string) identifies the uploaded content, e.g. local path, size and mtime. Must
+                               change whenever the content does
+        :param part_sizer: (PartSizer) told how long each part took to send, to size the parts still to come
+        :return: Response object
+        """
+        append_root_url = os.path.join(self.api_root(), path)
+
+        resume_from = self._resume_offset(path, append_root_url, checkpoint_key)
+        resp = None
+        offset = 0
+        for part in parts:
+            end = offset + len(part)
+            if end <= resume_from:
+                # Already uploaded by an earlier run
+                offset = end
+                continue
+            if offset < resume_from:
+                part = memoryview(part)[resume_from - offset :]
+                offset = resume_from
+
+            start_time = time.perf_counter()
+            resp = self._upload_part(append_root_url, part, offset)
+            if part_sizer is not None:
+                part_sizer.record(len(part), time.perf_counter() - start_time)
+            offset = end
+            _save_upload_checkpoint(self.ib_host, path, checkpoint_key, offset)
+
+        if resp is None and resume_from == 0:
+            # Nothing to send, still create an empty file at the path
+            resp = self._upload_part(append_root_url, b"", 0)
+        elif resp is None:
+            # Everything was uploaded by an earlier run
+            resp = self.head(append_root_url)
+        self.invalidate_listing(path)
+        _remove_upload_checkpoint(self.ib_host, path)
+        return resp
+
+    def _upload_part(self, url, part, offset):
+        """
+        Sends one part starting at offset in the file, retrying with backoff until it has been received
+
+        :param url: (string) Files API url of the file being uploaded
+        :param part: (bytes) part to upload
+        :param offset: (int) position of the part in the file
+        :return: Response object
+        """
+        policy = get_polling_policy("upload_part")
+        deadline = policy.deadline()
+        intervals = policy.intervals()
+        data, data_offset = part, offset
+        while True:
+            headers = {"IB-Cursor": "0" if data_offset == 0 else "-1"}
+            try:
+                resp = self.patch(url, headers=headers, data=data)
+                if resp.status_code == 204:
+                    return resp
+                if resp.status_code not in RETRYABLE_STATUS_CODES:
+                    raise Exception(f"Upload failed: {resp.content}")
+                error = f"status {resp.status_code}: {resp.content}"
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"Upload of part at offset {offset} of {url} kept failing: {error}"
+                )
+            with span(
+                "upload retry backoff",
+                SLEEP,
+                reason="retry",
+                method="PATCH",
+                endpoint=endpoint_template(url),
+            ):
+                time.sleep(_clamp_to_run_deadline(next(intervals)))
+
+            # The failed request may have been partly or fully written, continue from what arrived
+            remote_size, head_resp = self._remote_size(url)
+            data, data_offset = _remaining_part(url, part, offset, remote_size)
+            if data is None:
+                return head_resp
+            logging.warning(
+                f"Retrying upload of {url} from byte {data_offset} after error: {error}"
+            )
+
+    def _remote_size(self, url):
+        """
+        :return: (tuple) size of the file at url, or None if it couldn't be read, and the HEAD response
+        """
+        try:
+            resp = self.head(url)
+        except requests.exceptions.RequestException:
+            return None, None
+        if resp.status_code != 200:
+            return None, resp
+        return int(resp.headers.get("Content-Length", 0)), resp
+
+    def _resume_offset(self, path, url, checkpoint_key):
+        offset = _load_upload_checkpoint(self.ib_host, path, checkpoint_key)
+        # Only resume if the environment still has exactly the checkpointed bytes
+        if not offset or self._remote_size(url)[0] != offset:
+            return 0
+        logging.info(f"Resuming upload of {path} from byte {offset}")
+        return offset
+
+    def upload_local_file(self, path, local_path, part_size=None):
+        """
+        Uploads a file from the local filesystem in chunks, reading the next part while the current one
+        is being sent
+
+        :param path: (string) path on IB environment to upload to
+        :param local_path: (string) path of local file to upload
+        :param part_size: (int) fixed size of each uploaded part in bytes, adapted to throughput if None
+        :return: Response object
+        """
+        return self.upload_chunks(path, local_path, part_size=part_size)
+
+    def upload_directory_as_zip(
+        self,
+        path,
+        directory,
+        compresslevel=DEFAULT_COMPRESSION_LEVEL,
+        part_size=None,
+    ):
+        """
+        Zips a local directory and uploads the archive in chunks as it is being written, without creating
+        the archive on disk. The next part is compressed while the current one is being sent
+
+        :param path: (string) path on IB environment to upload the zip file to
+        :param directory: (string) local directory to zip, its contents are placed at the root of the archive
+        :param compresslevel: (int) deflate compression level from 0 (fastest) to 9 (smallest)
+        :param part_size: (int) fixed size of each uploaded part in bytes, adapted to throughput if None
+        :return: Response object
+        """
+        sizer = PartSizer() if part_size is None else PartSizer.fixed(part_size)
+        parts = _prefetch(
+            _iter_parts(_iter_zip_chunks(directory, compresslevel), sizer)
+        )
+        try:
+            return self.upload_parts(path, parts, part_sizer=sizer)
+        finally:
+            parts.close()
+
+    def upload_file(self, file_path, file_data):
+        """
+        Upload single file to path on IB environment
+
+        :param file_path: (string) path on IB environment to upload to
+        :param file_data: (bytes) Data to upload (bytes)
+        :return: Response object
+        """
+        url = os.path.join(self.api_root(), file_path)
+
+        resp = self.put(url, data=file_data)
+        self.invalidate_listing(file_path)
+        logging.info(f"File upload status : {resp.status_code}")
+
+        if resp.status_code != 204:
+            raise Exception(f"Upload file failed: {resp.content}")
+
+        return resp
+
+    def read_file(self, path_to_file, stream=False):
+        """
+        Read file from IB environment
+
+        :param path_to_file: (string) path to file on IB environment
+                             (e.g. ganan.prabaharan/testing/fs/Instabase Drive/testing_flow)
+        :param stream: (bool) flag indicating whether to defer downloading the body so it can be consumed
+                       with iter_content instead of being buffered in memory
+        :return: Response object
+        """
+        url = os.path.join(*[self.api_root(), path_to_file])
+
+        params = {"expect-node-type": "file"}
+        if stream:
+            resp = self.get(url, params=params, stream=True)
+        else:
+            resp = self.get(url, params=params)
+
+        if resp.status_code != 200:
+            raise Exception(f"Error reading file: {resp.content}, for url: {url}")
+
+        return resp
+
+    def read_member_from_remote_ibsolution(self, path, member):
+        """
+        Reads a single file out of an .ibsolution (or any zip archive) on the IB environment, fetching only
+        the archive's central directory and the member rather than extracting it on the server
+
+        :param path: (string) path to .ibsolution file on IB environment
+        :param member: (string) name of file inside the archive (e.g. package.json)
+        :return: (bytes) content of the member
+        """
+        with zipfile.ZipFile(RemoteFile(self, path)) as archive:
+            return archive.read(member)
+
+    def download_file(self, path_to_file, local_path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Streams a file from IB environment straight to the local filesystem in chunks, so memory use stays
+        flat regardless of the file size
+
+        :param path_to_file: (string) path to file on IB environment
+        :param local_path: (string) local path to write file to
+        :param chunk_size: (int) number of bytes to read from the response at a time
+        :return: Response object (body already consumed)
+        """
+        start_time = time.perf_counter()
+        bytes_written = 0
+
+        with self.read_file(path_to_file, stream=True) as resp:
+            with open(local_path, "wb") as fd:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    fd.write(chunk)
+                    bytes_written += len(chunk)
+
+        elapsed = max(time.perf_counter() - start_time, 1e-6)
+        logging.info(
+            f"Downloaded {path_to_file} to {local_path}: {bytes_written} bytes in {elapsed:.2f}s "
+            f"({bytes_written / elapsed:.0f} bytes/sec)"
+        )
+        return resp
+
+    def publish_to_marketplace(self, ibsolution_path):
+        """
+        Publishes an ibsolution to Marketplace
+
+        :param ibsolution_path: path to .ibsolution file
+        :return: Response object
+        """
+        url = f"{self.api_root(api_version='v1', add_files_suffix=False)}/marketplace/publish"
+
+        args = {
+            "ibsolution_path": ibsolution_path,
+        }
+        json_data = json.dumps(args)
+
+        resp = self.post(url, data=json_data)
+        try:
+            resp = resp.json()
+            logging.info(f"File: {url}, Solution publish status: {resp}")
+        except:
+            logging.info(
+                f"Error publishing ibsolution_path: {ibsolution_path}. Solution publish status exception: {resp.content}"
+            )
+
+        return resp
+
+    def package_solution(self, content_folder, output_folder):
+        """
+        Publish a directory as a solution
+
+        :param content_folder: (string) path to solution build directory
+        :param output_folder: (string) path to create .ibsolution in
+        :return: Response object
+        """
+        # Url for packaging solution build directory into an .ibsolution file
+        create_solution_url = os.path.join(
+            *[self.ib_host, "api/v1", "solution", "create"]
+        )
+
+        args = {"content_folder": content_folder, "output_folder": output_folder}
+        json_data = json.dumps(args)
+
+        resp = self.post(create_solution_url, data=json_data)
+        self.invalidate_listing(output_folder)
+
+        # Verify request was completed successful
+        content = json.loads(resp.content)
+        if resp.status_code != 200 or (
+            "status" in content and content["status"] == "ERROR"
+        ):
+            raise Exception(f"Error with compile solution job: {resp.content}")
+
+        return resp
+
+    def unzip_files(self, zip_path, destination_path=None):
+        """
+        Unzip file on IB environment
+
+        :param zip_path: (string) path to zip file on IB environment
+        :param destination_path: (string) path to unzip files to
+        :return: Response object, with the extract job tracked as its job attribute (a Future, None if the response
+                 has no job ID)
+        """
+        # Unzip files url
+        url = os.path.join(*[self.ib_host, "api/v2", "files", "extract"])
+        destination_path = (
+            destination_path if destination_path else ".".join(zip_path.split(".")[:-1])
+        )
+
+        data = json.dumps({"src_path": zip_path, "dst_path": destination_path})
+
+        resp = self.post(url, data=data)
+        self.invalidate_listing(destination_path)
+
+        if resp.status_code != 202:
+            raise Exception(f"Unable to unzip files: {resp.content}")
+
+        job_id = get_job_id(resp)
+        resp.job = self.track_job(job_id, "async") if job_id else None
+        return resp
+
+    def compile_solution(self, solution_path, relative_flow_path):
+        """
+        Compiles a flow
+
+        :param solution_path: (string) path to root folder of solution
+                                  (e.g. ganan.prabaharan/testing/fs/Instabase Drive/testing_solution)
+        :param relative_flow_path: relative path of flow from solution_path (e.g. testing_flow.ibflow)
+                                   full flow path is {solutionPath}/{relative_flow_path}
+        :return: Response object
+        """
+        # TODO: API docs issue
+        path_encoded = quote(solution_path)
+
+        url = os.path.join(
+            *[self.ib_host, "api/v1", "flow_binary", "compile", path_encoded]
+        )
+        bin_path = relative_flow_path.replace(".ibflow", ".ibflowbin")
+        data = json.dumps(
+            {
+                "binary_type": "Single Flow",
+                "flow_project_root": os.path.join(
+                    solution_path, *relative_flow_path.split("/")[:-1]
+                ),
+                "predefined_binary_path": os.path.join(solution_path, bin_path),
+                "settings": {
+                    "flow_file": relative_flow_path.split("/")[-1],
+                    "is_flow_v3": True,
+                },
+            }
+        )
+        resp = self.post(url.replace("//d", "/d"), data=data)
+        self.invalidate_listing(os.path.join(solution_path, bin_path))
+
+        # Verify request is successful
+        content = json.loads(resp.content)
+        if resp.status_code != 200 or (
+            "status" in content and content["status"] == "ERROR"
+        ):
+            raise Exception(f"Error with compile solution job: {resp.content}")
+
+        return resp
+
+    def copy_file(self, source_path, destination_path):
+        """
+        Copies a file within the IB environment
+
+        :param source_path: (string) path of file to copy
+        :param destination_path: (string) path to copy to
+        :return: Response object
+        """
+        url = os.path.join(self.api_root(), "copy")
+
+        data = json.dumps({"src_path": source_path, "dst_path": destination_path})
+
+        resp = self.post(url, data=data)
+        self.invalidate_listing(destination_path)
+
+        if resp.status_code != 202:
+            raise Exception(f"Error copying file: {resp.content}")
+
+        return resp
+
+    def get_file_metadata(self, file_path):
+        """
+        Get metadata of file (using file API)
+
+        :param file_path: (string) path to file to read metadata from
+                         (e.g. ganan.prabaharan/testing/fs/Instabase Drive/test.txt)
+        :return: Response Object
+        """
+        url = os.path.join(self.api_root(), file_path)
+
+        headers = {
+            "IB-Retry-Config": json.dumps({"retries": 2, "backoff-seconds": 1}),
+        }
+
+        r = self.head(url, headers=headers)
+        return r
+
+    def create_folder_if_it_does_not_exists(self, folder_path):
+        """
+        Creates a folder in the IB environment if it doesn't exist
+
+        :param folder_path: (string) path to folder on IB environment
+        :return: Response object
+        """
+        metadata_url = os.path.join(self.api_root(), folder_path)
+
+        r = self.head(metadata_url)
+        if r.status_code == 404:
+            create_url = os.path.dirname(metadata_url)
+            folder_name = os.path.basename(folder_path)
+            data = json.dumps({"name": folder_name, "node_type": "folder"})
+            resp = self.post(create_url, data=data)
+            self.invalidate_listing(folder_path)
+            return resp
+
+    def check_job_status(self, job_id, job_type):
+        """
+        Checks on status of a job id using the Job Status API (https://www.instabase.com/docs/apis/jobs/index.html#job-status)
+
+        :param job_id: (string) job id to look into
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :return: Response object
+        """
+        url = self.ib_host + f"/api/v1/jobs/status?job_id={job_id}&type={job_type}"
+
+        resp = self.get(url)
+
+        # Verify request is successful
+        content = json.loads(resp.content)
+        if resp.status_code != 200 or (
+            "status" in content and content["status"] == "ERROR"
+        ):
+            raise Exception(f"Error checking job status: {resp.content}")
+
+        return resp
+
+    def track_job(self, job_id, job_type="job", polling_policy=None):
+        """
+        Hands a job to the client's JobPoller, which polls it alongside every other unfinished job
+
+        :param job_id: (string) job id to track
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                               for job_type
+        :return: (Future) resolves to the final Job Status API content of the job, see JobPoller.track
+        """
+        return self.job_poller.track(job_id, job_type, polling_policy)
+
+    def wait_until_job_finishes(self, job_id, job_type, polling_policy=None):
+        """
+        Waits until a job finishes (uses job status api to determine this)
+
+        :param job_id: (string) job id to look into
+        :param job_type: (string) job type [flow, refiner, job, async, group]
+        :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                               for job_type. Raises TimeoutError if the policy has a timeout and it passes
+        :return: bool indicating whether job completed successfully
+        """
+        content = self.track_job(job_id, job_type, polling_policy).result()
+        return content.get("status") == "OK"
+
+    def publish_many(
+        self,
+        ibsolution_paths,
+        max_workers=DEFAULT_PUBLISH_WORKERS,
+        polling_policy=None,
+    ):
+        """
+        Publishes several .ibsolution files to Marketplace at once and waits for every publish job. Publish
+        requests are sent up to max_workers at a time, then all the returned jobs are tracked by the client's
+        JobPoller
+
+        :param ibsolution_paths: (list) paths to .ibsolution files to publish
+        :param max_workers: (int) maximum number of publish requests to send concurrently
+        :param polling_policy: (PollingPolicy) schedule to poll the jobs with, defaults to the "job" policy
+        :return: (list) result of each publish in ibsolution_paths order, a dict with the "path", "job_id",
+                 "succeeded" flag, last job "state", "error" message and "seconds" taken
+        """
+        results = [
+            {
+                "path": path,
+                "job_id": None,
+                "succeeded": False,
+                "state": None,
+                "error": None,
+                "seconds": None,
+            }
+            for path in ibsolution_paths
+        ]
+
+        def submit(result):
+            result["started_at"] = time.monotonic()
+            try:
+                publish_resp = self.publish_to_marketplace(result["path"])
+            except Exception as e:
+                result["error"] = str(e)
+                return
+            result["job_id"] = (
+                publish_resp.get("job_id")
+                if isinstance(publish_resp, dict)
+                else get_job_id(publish_resp)
+            )
+            if not result["job_id"]:
+                result["error"] = f"No job ID in publish response: {publish_resp}"
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            list(executor.map(submit, results))
+
+        def finish(result, succeeded, error=None):
+            result["succeeded"] = succeeded
+            result["error"] = error
+            result["seconds"] = time.monotonic() - result["started_at"]
+
+        policy = polling_policy or get_polling_policy("job")
+        jobs = {
+            self.track_job(result["job_id"], "job", policy): result
+            for result in results
+            if result["job_id"]
+        }
+        for result in results:
+            if not result["job_id"]:
+                finish(result, False, result["error"])
+
+        for job in as_completed(jobs):
+            result = jobs[job]
+            try:
+                content = job.result()
+            except Exception as e:
+                finish(result, False, str(e))
+                continue
+
+            result["state"] = content.get("state")
+            if content.get("status") != "OK":
+                finish(result, False, f"Publish job failed: {content}")
+            else:
+                finish(result, True)
+
+        for result in results:
+            result.pop("started_at", None)
+        return results
+
+    def wait_until_file_exists(
+        self, file_path, previous_last_modified=None, polling_policy=None
+    ):
+        """
+        Waits until a file exists on the IB environment, used to tell when a server side job has written its
+        output when the job can't be tracked through the Job Status API
+
+        :param file_path: (string) path to file to wait for
+        :param previous_last_modified: (string) Last-Modified header of the file before the job started, if the file
+                                       already existed. The file only counts once its Last-Modified changes
+        :param polling_policy: (PollingPolicy) schedule to poll the file with, defaults to the "file" policy
+        :return: Response object of the HEAD request that found the file
+        """
+        policy = polling_policy or get_polling_policy("file")
+        deadline = policy.deadline()
+        url = os.path.join(self.api_root(), file_path)
+
+        for interval in policy.intervals():
+            resp = self.head(url)
+            if resp.status_code == 200 and (
+                previous_last_modified is None
+                or resp.headers.get("Last-Modified") != previous_last_modified
+            ):
+                return resp
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out after {policy.timeout}s waiting for {file_path} to be written"
+                    )
+                interval = min(interval, remaining)
+            with span("poll wait", SLEEP, reason="poll"):
+                time.sleep(_clamp_to_run_deadline(interval))
+
+    def wait_until_request_completes(
+        self,
+        resp,
+        job_type="async",
+        expected_path=None,
+        previous_last_modified=None,
+        polling_policy=None,
+    ):
+        """
+        Waits until the server side work started by an API request has finished. Waits for the job tracked on the
+        response or the job ID returned in it if there is one, otherwise for the request's expected output path to
+        be written
+
+        :param resp: Response object returned by the request that started the work
+        :param job_type: (string) job type of the returned job ID [flow, refiner, job, async, group]
+        :param expected_path: (string) path the request writes to, used when no job ID is returned
+        :param previous_last_modified: (string) Last-Modified header of expected_path before the request was sent
+        :param polling_policy: (PollingPolicy) schedule to poll with
+        :return: None
+        """
+        # Requests made through this client are already tracked, see unzip_files and deploy_solution
+        job = getattr(resp, "job", None)
+        job_id = get_job_id(resp)
+        if job is None and job_id:
+            job = self.track_job(job_id, job_type, polling_policy)
+        if job is not None:
+            if job.result().get("status") != "OK":
+                raise Exception(f"{job_type} job {job_id} failed: {resp.content}")
+        elif expected_path:
+            self.wait_until_file_exists(
+                expected_path, previous_last_modified, polling_policy
+            )
+
+        # Server side writes land after the request returns, so drop listings fetched while they ran
+        if expected_path:
+            self.invalidate_listing(expected_path)
+
+    def delete_file_or_folder(self, path_to_delete):
+        """
+        Delete a file or folder from the IB environment using the Filesystem API
+
+        :param path_to_delete: (string) path of file or folder to delete
+        :return: Response object
+        """
+        url = os.path.join(self.api_root(), path_to_delete)
+
+        # TODO: Check status code
+        resp = self.delete(url)
+        self.invalidate_listing(path_to_delete)
+        return resp
+
+    def deploy_solution(self, ibsolution_path):
+        """
+        Deploys a solution
+
+        :param ibsolution_path: (string) path to .ibsolution file to deploy
+        :return: Response object return from deploy request, with the deploy job tracked as its job attribute (a
+                 Future, None if the response has no job ID)
+        """
+        url = f"{self.api_root(add_files_suffix=False)}/solutions/deployed"
+
+        args = {
+            "solution_path": ibsolution_path,
+        }
+        json_data = json.dumps(args)
+
+        resp = self.post(url, data=json_data)
+
+        job_id = get_job_id(resp)
+        if job_id:
+            logging.info(f"Solution deployed with job ID {job_id}")
+        else:
+            logging.info(f"Solution publish status exception: {resp.content}")
+        resp.job = self.track_job(job_id, "job") if job_id else None
+
+        return resp
+
+
+def _iter_parts(chunks, sizer):
+    """
+    Regroups an iterable of byte chunks of any size into parts of the size picked by sizer (the last part may
+    be smaller)
+
+    :param chunks: (iterable of bytes) chunks to regroup
+    :param sizer: (PartSizer) picks the size of each part
+    :return: generator of bytes
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= sizer.next_size():
+            part_size = sizer.next_size()
+            yield bytes(memoryview(buffer)[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _iter_buffer_parts(data, sizer):
+    """
+    Slices a bytes-like object into parts of the size picked by sizer, as memoryviews so nothing is copied
+
+    :param data: (bytes-like) data to slice
+    :param sizer: (PartSizer) picks the size of each part
+    :return: generator of memoryview
+    """
+    view = memoryview(data).cast("B")
+    offset = 0
+    while offset < len(view):
+        part_size = sizer.next_size()
+        yield view[offset : offset + part_size]
+        offset += part_size
+
+
+class _ChunkSink:
+    """
+    Write-only, unseekable stream that collects what is written to it so it can be passed on in chunks
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _iter_zip_chunks(directory, compresslevel=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Zips a local directory, yielding the archive's bytes as they are written. Files with extensions in
+    STORED_EXTENSIONS are stored, everything else is deflated
+
+    :param directory: (string) local directory to zip, its contents are placed at the root of the archive
+    :param compresslevel: (int) deflate compression level from 0 (fastest) to 9 (smallest)
+    :return: generator of bytes
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(
+        sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+    ) as archive:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            relative_root = os.path.relpath(root, directory)
+            if relative_root != ".":
+                archive.write(root, relative_root)
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                arcname = os.path.normpath(os.path.join(relative_root, file_name))
+                # Members opened by name take the archive's compression and compresslevel
+                if os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+                    archive.compression = zipfile.ZIP_STORED
+                else:
+                    archive.compression = zipfile.ZIP_DEFLATED
+                # The size isn't known up front when opening by name, so large files need zip64 asked for
+                force_zip64 = os.path.getsize(file_path) * 1.05 > zipfile.ZIP64_LIMIT
+
+                with (
+                    open(file_path, "rb") as src,
+                    archive.open(arcname, "w", force_zip64=force_zip64) as dst,
+                ):
+                    for chunk in iter(lambda: src.read(DEFAULT_CHUNK_SIZE), b""):
+                        dst.write(chunk)
+                        yield from sink.drain()
+                yield from sink.drain()
+    yield from sink.drain()
+
+
+def _body_size(request_kwargs):
+    # Size of a request body when it's known up front, bodies streamed from iterables count as 0
+    data = request_kwargs.get("data")
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, memoryview):
+        return data.nbytes
+    if isinstance(data, str):
+        return len(data.encode())
+    if request_kwargs.get("json") is not None:
+        return len(json.dumps(request_kwargs["json"]).encode())
+    return 0
+
+
+class _ProfiledBody:
+    """
+    Wraps the raw body of a streamed response, counting the bytes read and ending the response's HTTP span
+    once the body has been read to the end or closed
+    """
+
+    def __init__(self, raw, profiler, name, start, args):
+        self._raw = raw
+        self._profiler = profiler
+        self._name = name
+        self._start = start
+        self._args = args
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def stream(self, *args, **kwargs):
+        try:
+            for chunk in self._raw.stream(*args, **kwargs):
+                self._args["bytes_received"] += len(chunk)
+                yield chunk
+        except Exception as e:
+            self._finish(type(e).__name__)
+            raise
+        self._finish()
+
+    def read(self, *args, **kwargs):
+        try:
+            data = self._raw.read(*args, **kwargs)
+        except Exception as e:
+            self._finish(type(e).__name__)
+            raise
+        self._args["bytes_received"] += len(data)
+        # Reading without a size returns the whole body in one go
+        amt = args[0] if args else kwargs.get("amt")
+        if not data or amt is None:
+            self._finish()
+        return data
+
+    def close(self):
+        try:
+            self._raw.close()
+        finally:
+            self._finish()
+
+    def _finish(self, error=None):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        if error is not None:
+            self._args["error"] = error
+        self._profiler.record(
+            self._name,
+            HTTP,
+            self._start,
+            time.perf_counter() - self._start,
+            self._args,
+        )
+
+
+def _prefetch(iterable, max_buffered=1):
+    """
+    Iterates over an iterable on a background thread, keeping at most max_buffered items ready ahead of the
+    consumer so that producing the next item overlaps with consuming the current one. Errors raised by the
+    producer are re-raised in the consumer, and closing the generator stops the producer
+
+    :param iterable: iterable to consume in the background
+    :param max_buffered: (int) maximum number of produced items waiting to be consumed
+    :return: generator yielding the items of iterable in order
+    """
+    buffer = queue.Queue(maxsize=max_buffered)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((finished, e))
+            return
+        put((finished, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            with span("prefetch wait", QUEUE):
+                item, error = buffer.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+_ib_clients = {}
+_ib_clients_lock = threading.Lock()
+
+
+def get_ib_client(ib_host, api_token, **client_kwargs):
+    """
+    Gets the shared IBClient for an IB host and API token, creating it on first use so every helper call
+    for the same environment reuses one pooled session for the whole run
+
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
-    :param api_version: (string) api_version to add to ib_host to create file api root url
-    :param add_files_suffix: (bool) flag indicating whether to add 'files' suffix to the api root
-    :return: (string) IB host + file api root (e.g. https://www.instabase.com/api/v2/files)
+    :param api_token: (string) API token for IB environment
+    :param client_kwargs: keyword arguments passed to IBClient when the client is first created
+    :return: IBClient
+    """
+    key = (ib_host, api_token)
+    with _ib_clients_lock:
+        if key not in _ib_clients:
+            _ib_clients[key] = IBClient(ib_host, api_token, **client_kwargs)
+        return _ib_clients[key]
+
+
+def close_ib_clients():
+    """
+    Closes and forgets every shared IBClient
     """
+    with _ib_clients_lock:
+        for client in _ib_clients.values():
+            client.close()
+        _ib_clients.clear()
 
-    # Add 'files' suffix if required
-    if add_files_suffix:
-        return os.path.join(*[ib_host, "api", api_version, "files"])
 
-    return os.path.join(*[ib_host, "api", api_version])
+def list_folder(ib_host, api_token, folder_path):
+    """
+    Lists a folder on the IB environment, reusing the listing fetched earlier in the run if the folder hasn't
+    been written to since
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param folder_path: (string) path of folder on IB environment
+    :return: FolderListing
+    """
+    return get_ib_client(ib_host, api_token).list_folder(folder_path)
 
 
 def upload_chunks(ib_host, path, api_token, file_data):
     """
-    Uploads bytes to a location on the Instabase environment
+    Uploads data to a location on the Instabase environment
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
     :param path: (string) path on IB environment to upload to
     :param api_token: (string) API token for IB environment
-    :param file_data: (bytes) Data to upload (bytes)
+    :param file_data: (bytes, string or file-like) data to upload, a path of a local file to upload, or a binary
+                      file-like object to read the data from
     :return: Response object
     """
-    part_size = 10485760
+    return get_ib_client(ib_host, api_token).upload_chunks(path, file_data)
 
-    file_api_root = __get_file_api_root(ib_host)
-    append_root_url = os.path.join(file_api_root, path)
 
-    headers = {
-        "Authorization": "Bearer {0}".format(api_token),
-    }
+def upload_local_file(ib_host, api_token, path, local_path):
+    """
+    Upload file from the local filesystem to path on IB environment in chunks, without reading it into memory
 
-    # Send data in parts
-    bytes_io_content = BytesIO(file_data)
-    with bytes_io_content as f:
-        # Create parts from bytes data
-        part_num = 0
-        for chunk in iter(lambda: f.read(part_size), b""):
-            if part_num == 0:
-                headers["IB-Cursor"] = "0"
-            else:
-                headers["IB-Cursor"] = "-1"
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param path: (string) path on IB environment to upload to
+    :param local_path: (string) path of local file to upload
+    :return: Response object
+    """
+    return get_ib_client(ib_host, api_token).upload_local_file(path, local_path)
 
-            # Send patch request for part upload
-            resp = requests.patch(
-                append_root_url, headers=headers, data=chunk, verify=False
-            )
-            part_num += 1
 
-    if resp.status_code != 204:
-        raise Exception(f"Upload failed: {resp.content}")
-    return resp
+def upload_directory_as_zip(
+    ib_host, api_token, path, directory, compresslevel=DEFAULT_COMPRESSION_LEVEL
+):
+    """
+    Zips a local directory and streams the archive to path on IB environment, without writing it to disk
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param path: (string) path on IB environment to upload the zip file to
+    :param directory: (string) local directory to zip
+    :param compresslevel: (int) deflate compression level from 0 (fastest) to 9 (smallest)
+    :return: Response object
+    """
+    return get_ib_client(ib_host, api_token).upload_directory_as_zip(
+        path, directory, compresslevel
+    )
 
 
 def upload_file(ib_host, api_token, file_path, file_data):
@@ -74,41 +1959,53 @@ def upload_file(ib_host, api_token, file_path, file_data):
     :param file_data: (bytes) Data to upload (bytes)
     :return: Response object
     """
-    file_api_root = __get_file_api_root(ib_host)
-    url = os.path.join(file_api_root, file_path)
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-    resp = requests.put(url, headers=headers, data=file_data, verify=False)
-    logging.info(f"File upload status : {resp.status_code}")
+    return get_ib_client(ib_host, api_token).upload_file(file_path, file_data)
 
-    if resp.status_code != 204:
-        raise Exception(f"Upload file failed: {resp.content}")
 
-    return resp
-
-
-def read_file_through_api(ib_host, api_token, path_to_file):
+def read_file_through_api(ib_host, api_token, path_to_file, stream=False):
     """
     Read file from IB environment
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
     :param path_to_file: (string) path to file on IB environment
                          (e.g. ganan.prabaharan/testing/fs/Instabase Drive/testing_flow)
     :param api_token: (string) API token for IB environment
+    :param stream: (bool) flag indicating whether to return a streaming response to be read with iter_content
     :return: Response object
     """
-    file_api_root = __get_file_api_root(ib_host)
-    url = os.path.join(*[file_api_root, path_to_file])
+    return get_ib_client(ib_host, api_token).read_file(path_to_file, stream=stream)
 
-    params = {"expect-node-type": "file"}
-    headers = {
-        "Authorization": "Bearer {0}".format(api_token),
-    }
-    resp = requests.get(url, headers=headers, params=params, verify=False)
 
-    if resp.status_code != 200:
-        raise Exception(f"Error reading file: {resp.content}, for url: {url}")
+def read_member_from_remote_ibsolution(ib_host, api_token, path, member):
+    """
+    Reads a single file out of an .ibsolution on the IB environment without unzipping it on the server
 
-    return resp
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param path: (string) path to .ibsolution file on IB environment
+    :param member: (string) name of file inside the archive (e.g. package.json)
+    :return: (bytes) content of the member
+    """
+    return get_ib_client(ib_host, api_token).read_member_from_remote_ibsolution(
+        path, member
+    )
+
+
+def download_file_through_api(
+    ib_host, api_token, path_to_file, local_path, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """
+    Stream file from IB environment to the local filesystem without holding it in memory
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param path_to_file: (string) path to file on IB environment
+    :param local_path: (string) local path to write file to
+    :param chunk_size: (int) number of bytes to read from the response at a time
+    :return: Response object (body already consumed)
+    """
+    return get_ib_client(ib_host, api_token).download_file(
+        path_to_file, local_path, chunk_size
+    )
 
 
 def publish_to_marketplace(ib_host, api_token, ibsolution_path):
@@ -120,25 +2017,42 @@ def publish_to_marketplace(ib_host, api_token, ibsolution_path):
     :param ibsolution_path: path to .ibsolution file
     :return: Response object
     """
-    file_api_v1 = __get_file_api_root(ib_host, api_version="v1", add_files_suffix=False)
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-    url = f"{file_api_v1}/marketplace/publish"
+    return get_ib_client(ib_host, api_token).publish_to_marketplace(ibsolution_path)
 
-    args = {
-        "ibsolution_path": ibsolution_path,
-    }
-    json_data = json.dumps(args)
 
-    resp = requests.post(url, headers=headers, data=json_data, verify=False)
-    try:
-        resp = resp.json()
-        logging.info(f"File: {url}, Solution publish status: {resp}")
-    except:
-        logging.info(
-            f"Error publishing ibsolution_path: {ibsolution_path}. Solution publish status exception: {resp.content}"
-        )
+def publish_many(
+    ib_host, api_token, ibsolution_paths, max_workers=DEFAULT_PUBLISH_WORKERS
+):
+    """
+    Publishes several .ibsolution files to Marketplace concurrently and waits for all the publish jobs
 
-    return resp
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) API token for IB environment
+    :param ibsolution_paths: (list) paths to .ibsolution files to publish
+    :param max_workers: (int) maximum number of publish requests to send concurrently
+    :return: (list) result dict of each publish, see IBClient.publish_many
+    """
+    return get_ib_client(ib_host, api_token).publish_many(ibsolution_paths, max_workers)
+
+
+def format_publish_results(results):
+    """
+    Formats the results of publish_many as a table for logging
+
+    :param results: (list) results returned by publish_many
+    :return: (string) table with one row per published file
+    """
+    rows = [("PATH", "RESULT", "SECONDS", "JOB ID")]
+    for result in results:
+        outcome = "OK" if result["succeeded"] else f"FAILED: {result['error']}"
+        seconds = f"{result['seconds']:.1f}" if result["seconds"] is not None else "-"
+        rows.append((result["path"], outcome, seconds, result["job_id"] or "-"))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(row, widths + [0]))
+        for row in rows
+    )
 
 
 def package_solution(ib_host, api_token, content_folder, output_folder):
@@ -151,26 +2065,10 @@ def package_solution(ib_host, api_token, content_folder, output_folder):
     :param output_folder: (string) path to create .ibsolution in
     :return: Response object
     """
-    # Url for packaging solution build directory into an .ibsolution file
-    create_solution_url = os.path.join(*[ib_host, "api/v1", "solution", "create"])
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-    args = {"content_folder": content_folder, "output_folder": output_folder}
-    json_data = json.dumps(args)
-
-    resp = requests.post(
-        create_solution_url, headers=headers, data=json_data, verify=False
+    return get_ib_client(ib_host, api_token).package_solution(
+        content_folder, output_folder
     )
 
-    # Verify request was completed successful
-    content = json.loads(resp.content)
-    if resp.status_code != 200 or (
-        "status" in content and content["status"] == "ERROR"
-    ):
-        raise Exception(f"Error with compile solution job: {resp.content}")
-
-    return resp
-
 
 def unzip_files(ib_host, api_token, zip_path, destination_path=None):
     """
@@ -180,23 +2078,10 @@ def unzip_files(ib_host, api_token, zip_path, destination_path=None):
     :param api_token: (string) api token for IB environment
     :param zip_path: (string) path to zip file on IB environment
     :param destination_path: (string) path to unzip files to
-    :return: Response object
+    :return: Response object, with the extract job tracked as its job attribute (a Future, None if the response has
+             no job ID)
     """
-    # Unzip files url
-    url = os.path.join(*[ib_host, "api/v2", "files", "extract"])
-    destination_path = (
-        destination_path if destination_path else ".".join(zip_path.split(".")[:-1])
-    )
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-    data = json.dumps({"src_path": zip_path, "dst_path": destination_path})
-
-    resp = requests.post(url, headers=headers, data=data, verify=False)
-
-    if resp.status_code != 202:
-        raise Exception(f"Unable to unzip files: {resp.content}")
-
-    return resp
+    return get_ib_client(ib_host, api_token).unzip_files(zip_path, destination_path)
 
 
 def compile_solution(ib_host, api_token, solution_path, relative_flow_path):
@@ -211,37 +2096,9 @@ def compile_solution(ib_host, api_token, solution_path, relative_flow_path):
                                full flow path is {solutionPath}/{relative_flow_path}
     :return: Response object
     """
-    # TODO: API docs issue
-    path_encoded = quote(solution_path)
-
-    url = os.path.join(*[ib_host, "api/v1", "flow_binary", "compile", path_encoded])
-    bin_path = relative_flow_path.replace(".ibflow", ".ibflowbin")
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-    data = json.dumps(
-        {
-            "binary_type": "Single Flow",
-            "flow_project_root": os.path.join(
-                solution_path, *relative_flow_path.split("/")[:-1]
-            ),
-            "predefined_binary_path": os.path.join(solution_path, bin_path),
-            "settings": {
-                "flow_file": relative_flow_path.split("/")[-1],
-                "is_flow_v3": True,
-            },
-        }
+    return get_ib_client(ib_host, api_token).compile_solution(
+        solution_path, relative_flow_path
     )
-    resp = requests.post(
-        url.replace("//d", "/d"), headers=headers, data=data, verify=False
-    )
-
-    # Verify request is successful
-    content = json.loads(resp.content)
-    if resp.status_code != 200 or (
-        "status" in content and content["status"] == "ERROR"
-    ):
-        raise Exception(f"Error with compile solution job: {resp.content}")
-
-    return resp
 
 
 def copy_file_within_ib(
@@ -264,18 +2121,9 @@ def copy_file_within_ib(
         if err:
             logging.error(f"Error copying file: {err}")
     else:
-        file_api_root = __get_file_api_root(ib_host)
-        url = os.path.join(file_api_root, "copy")
-        headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-        data = json.dumps({"src_path": source_path, "dst_path": destination_path})
-
-        resp = requests.post(url, headers=headers, data=data, verify=False)
-
-        if resp.status_code != 202:
-            raise Exception(f"Error copying file: {resp.content}")
-
-        return resp
+        return get_ib_client(ib_host, api_token).copy_file(
+            source_path, destination_path
+        )
 
 
 def read_file_content_from_ib(
@@ -322,16 +2170,7 @@ def get_file_metadata(ib_host, api_token, file_path):
                      (e.g. ganan.prabaharan/testing/fs/Instabase Drive/test.txt)
     :return: Response Object
     """
-    file_api_root = __get_file_api_root(ib_host)
-    url = os.path.join(file_api_root, file_path)
-
-    headers = {
-        "Authorization": "Bearer {0}".format(api_token),
-        "IB-Retry-Config": json.dumps({"retries": 2, "backoff-seconds": 1}),
-    }
-
-    r = requests.head(url, headers=headers)
-    return r
+    return get_ib_client(ib_host, api_token).get_file_metadata(file_path)
 
 
 def create_folder_if_it_does_not_exists(ib_host, api_token, folder_path):
@@ -343,17 +2182,9 @@ def create_folder_if_it_does_not_exists(ib_host, api_token, folder_path):
     :param api_token: (string) api token for IB environment
     :return: Response object
     """
-    file_api_root = __get_file_api_root(ib_host)
-    metadata_url = os.path.join(file_api_root, folder_path)
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-    r = requests.head(metadata_url, headers=headers, verify=False)
-    if r.status_code == 404:
-        create_url = os.path.dirname(metadata_url)
-        folder_name = os.path.basename(folder_path)
-        data = json.dumps({"name": folder_name, "node_type": "folder"})
-        resp = requests.post(create_url, headers=headers, data=data, verify=False)
-        return resp
+    return get_ib_client(ib_host, api_token).create_folder_if_it_does_not_exists(
+        folder_path
+    )
 
 
 def check_job_status(ib_host, job_id, job_type, api_token):
@@ -366,23 +2197,25 @@ def check_job_status(ib_host, job_id, job_type, api_token):
     :param api_token: (string) api token for IB environment
     :return: Response object
     """
-    url = ib_host + f"/api/v1/jobs/status?job_id={job_id}&type={job_type}"
-
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
+    return get_ib_client(ib_host, api_token).check_job_status(job_id, job_type)
 
-    resp = requests.get(url, headers=headers, verify=False)
 
-    # Verify request is successful
-    content = json.loads(resp.content)
-    if resp.status_code != 200 or (
-        "status" in content and content["status"] == "ERROR"
-    ):
-        raise Exception(f"Error checking job status: {resp.content}")
+def track_job(ib_host, api_token, job_id, job_type="job", polling_policy=None):
+    """
+    Tracks a job in the background alongside every other unfinished job on the IB environment
 
-    return resp
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param job_id: (string) job id to track
+    :param job_type: (string) job type [flow, refiner, job, async, group]
+    :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                           for job_type
+    :return: (Future) resolves to the final Job Status API content of the job, see JobPoller.track
+    """
+    return get_ib_client(ib_host, api_token).track_job(job_id, job_type, polling_policy)
 
 
-def wait_until_job_finishes(ib_host, job_id, job_type, api_token):
+def wait_until_job_finishes(ib_host, job_id, job_type, api_token, polling_policy=None):
     """
     Helper function to continuously wait until a job finishes (uses job status api to determine this)
 
@@ -390,23 +2223,54 @@ def wait_until_job_finishes(ib_host, job_id, job_type, api_token):
     :param job_id: (string) job id to look into
     :param job_type: (string) job type [flow, refiner, job, async, group]
     :param api_token: (string) api token for IB environment
+    :param polling_policy: (PollingPolicy) schedule to poll the job with, defaults to the policy registered
+                           for job_type. Raises TimeoutError if the policy has a timeout and it passes
 
     :return: bool indicating whether job completed successfully
     """
-    still_running = True
-    while still_running:
-        job_status_response = check_job_status(ib_host, job_id, job_type, api_token)
-        job_status_response_content = json.loads(job_status_response.content)
-        status = job_status_response_content["status"]
-        state = job_status_response_content["state"]
+    return get_ib_client(ib_host, api_token).wait_until_job_finishes(
+        job_id, job_type, polling_policy
+    )
 
-        if status != "OK":
-            return False
 
-        still_running = state != "DONE" and state != "COMPLETE"
-        time.sleep(5)
+def wait_until_file_exists(ib_host, api_token, file_path, previous_last_modified=None):
+    """
+    Waits until a file exists on the IB environment
 
-    return True
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param file_path: (string) path to file to wait for
+    :param previous_last_modified: (string) Last-Modified header of the file before it was rewritten, if it existed
+    :return: Response object of the HEAD request that found the file
+    """
+    return get_ib_client(ib_host, api_token).wait_until_file_exists(
+        file_path, previous_last_modified
+    )
+
+
+def wait_until_request_completes(
+    ib_host,
+    api_token,
+    resp,
+    job_type="async",
+    expected_path=None,
+    previous_last_modified=None,
+):
+    """
+    Waits until the server side work started by an API request (e.g. unzip_files, copy_file_within_ib,
+    compile_solution) has finished, using the job ID in the response or else polling for its output path
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param resp: Response object returned by the request that started the work
+    :param job_type: (string) job type of the returned job ID [flow, refiner, job, async, group]
+    :param expected_path: (string) path the request writes to, used when no job ID is returned
+    :param previous_last_modified: (string) Last-Modified header of expected_path before the request was sent
+    :return: None
+    """
+    get_ib_client(ib_host, api_token).wait_until_request_completes(
+        resp, job_type, expected_path, previous_last_modified
+    )
 
 
 def delete_folder_or_file_from_ib(
@@ -428,13 +2292,7 @@ def delete_folder_or_file_from_ib(
         rm, err = clients.ibfile.rm(path_to_delete)
     else:
         # Use Filesystem API to delete file/folder
-        file_api_root = __get_file_api_root(ib_host)
-        url = os.path.join(file_api_root, path_to_delete)
-
-        headers = {"Authorization": "Bearer {0}".format(api_token)}
-
-        # TODO: Check status code
-        r = requests.delete(url, headers=headers, verify=False)
+        get_ib_client(ib_host, api_token).delete_file_or_folder(path_to_delete)
 
 
 def deploy_solution(ib_host, api_token, ibsolution_path):
@@ -443,23 +2301,65 @@ def deploy_solution(ib_host, api_token, ibsolution_path):
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
     :param api_token: (string) api token for IB environment
     :param ibsolution_path: (string) path to .ibsolution file to deploy
-    :return: Response object return from deploy request
+    :return: Response object return from deploy request, with the deploy job tracked as its job attribute (a
+             Future, None if the response has no job ID)
     """
-    file_api_root = __get_file_api_root(ib_host, add_files_suffix=False)
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-    url = f"{file_api_root}/solutions/deployed"
-
-    args = {
-        "solution_path": ibsolution_path,
-    }
-    json_data = json.dumps(args)
-
-    resp = requests.post(url, headers=headers, data=json_data, verify=False)
-
+    return get_ib_client(ib_host, api_token).deploy_solution(ibsolution_path)
+
+
+def stream_file_between_envs(
+    source_ib_host,
+    source_api_token,
+    source_path,
+    target_ib_host,
+    target_api_token,
+    target_path,
+    part_size=None,
+    max_buffered_parts=1,
+    tee=None,
+    checkpoint_key=None,
+):
+    """
+    Streams a file from one IB environment to another without holding it in memory. The file is read from
+    the source Files API in chunks and sent to the target as chunked IB-Cursor uploads, with the download
+    running ahead of the upload through a bounded buffer so both transfers overlap
+
+    :param source_ib_host: (string) IB host url of env to read file from
+    :param source_api_token: (string) api token for source env
+    :param source_path: (string) path of file on source env
+    :param target_ib_host: (string) IB host url of env to upload file to
+    :param target_api_token: (string) api token for target env
+    :param target_path: (string) path to upload file to on target env
+    :param part_size: (int) fixed size of each uploaded part in bytes, adapted to throughput if None
+    :param max_buffered_parts: (int) maximum number of downloaded parts waiting to be uploaded
+    :param tee: (file-like) optional object whose write method also receives every downloaded part,
+                e.g. to keep a local copy while streaming
+    :param checkpoint_key: (string) identifies the source content so an interrupted upload can be resumed,
+                           only pass one for files that don't change (e.g. marketplace artifacts)
+    :return: Response object of the last upload request
+    """
+    source_client = get_ib_client(source_ib_host, source_api_token)
+    target_client = get_ib_client(target_ib_host, target_api_token)
+    sizer = PartSizer() if part_size is None else PartSizer.fixed(part_size)
+
+    def download_parts():
+        with source_client.read_file(source_path, stream=True) as resp:
+            chunks = resp.iter_content(chunk_size=DEFAULT_CHUNK_SIZE)
+            for part in _iter_parts(chunks, sizer):
+                if tee is not None:
+                    tee.write(part)
+                yield part
+
+    start_time = time.perf_counter()
+    parts = _prefetch(download_parts(), max_buffered_parts)
     try:
-        job_id = json.loads(resp.content)["job_id"]
-        logging.info(f"Solution deployed with job ID {job_id}")
-    except:
-        logging.info(f"Solution publish status exception: {resp.content}")
+        resp = target_client.upload_parts(
+            target_path, parts, checkpoint_key=checkpoint_key, part_sizer=sizer
+        )
+    finally:
+        parts.close()
 
+    logging.info(
+        f"Streamed {source_path} to {target_path} in {time.perf_counter() - start_time:.2f}s"
+    )
     return resp
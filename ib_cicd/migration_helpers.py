@@ -1,15 +1,17 @@
+import hashlib
 import logging
 import json
 import os
-import time
+import shutil
 
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 from pathlib import Path
 
 from ib_cicd.ib_helpers import (
     upload_chunks,
     read_file_through_api,
+    download_file_through_api,
     package_solution,
     unzip_files,
     compile_solution,
@@ -17,8 +19,26 @@ from ib_cicd.ib_helpers import (
     read_file_content_from_ib,
     get_file_metadata,
     create_folder_if_it_does_not_exists,
-    wait_until_job_finishes,
+    get_ib_client,
+    stream_file_between_envs,
+    wait_until_request_completes,
+    upload_local_file,
+    upload_file,
+    read_member_from_remote_ibsolution,
+    upload_directory_as_zip,
+    delete_folder_or_file_from_ib,
+    DEFAULT_COMPRESSION_LEVEL,
+    publish_many,
+    format_publish_results,
+    list_folder,
+    DEFAULT_CHUNK_SIZE,
 )
+from ib_cicd.artifact_cache import parse_ibsolution_name
+
+DEFAULT_MAX_WORKERS = 4
+MANIFEST_SUFFIX = ".manifest.json"
+SYNC_MANIFEST_SUFFIX = ".sync.json"
+MARKETPLACE_PATH = "system/global/fs/Instabase Drive/Applications/Marketplace/All"
 
 
 def parse_dependencies(package_dependencies):
@@ -79,23 +99,25 @@ def get_dependencies_from_solution_build_folder(
 
 def get_dependencies_from_ibsolution(ib_host, api_token, solution_path):
     """
-    Converts an .ibsolution file into a zip file and then unzips it to read its package.json and parse out its
-    model + dev package dependencies
+    Reads the package.json out of an .ibsolution file, without unzipping it on the IB environment, and parses
+    out its model + dev package dependencies
 
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
     :param api_token: (string) api token for IB environment
     :param solution_path: (string) path to .ibsolution file
     :return: dictionary from parse_dependencies
     """
-    new_path = solution_path.replace(".ibsolution", ".zip")
-    copy_file_within_ib(ib_host, api_token, solution_path, new_path)
-
-    unzip_files(ib_host, api_token, new_path)
-
-    return get_dependencies_from_solution_build_folder(
-        ib_host, api_token, new_path.replace(".zip", "")
+    package = json.loads(
+        read_member_from_remote_ibsolution(
+            ib_host, api_token, solution_path, "package.json"
+        )
     )
 
+    if "dependencies" in package:
+        return parse_dependencies(package["dependencies"])
+    else:
+        return {}
+
 
 def compile_and_package_ib_solution(
     ib_host,
@@ -116,12 +138,30 @@ def compile_and_package_ib_solution(
     :param compiled_solution_output_folder_path: (string) path to place compiled ibsolution in
     :return: (Response object, Response object) responses for compile and package requests
     """
+    # Note when the flow binary was last written, so a binary left by a previous compile isn't mistaken
+    # for the output of this one
+    binary_path = os.path.join(
+        solution_directory_path, relative_flow_path.replace(".ibflow", ".ibflowbin")
+    )
+    binary_metadata = get_file_metadata(ib_host, api_token, binary_path)
+    previous_last_modified = (
+        binary_metadata.headers.get("Last-Modified")
+        if binary_metadata.status_code == 200
+        else None
+    )
+
     compile_resp = compile_solution(
         ib_host, api_token, solution_directory_path, relative_flow_path
     )
 
-    # Sleep to allow time for compilation
-    time.sleep(6)
+    # Wait for compilation to finish before packaging the binary
+    wait_until_request_completes(
+        ib_host,
+        api_token,
+        compile_resp,
+        expected_path=binary_path,
+        previous_last_modified=previous_last_modified,
+    )
 
     solution_resp = package_solution(
         ib_host,
@@ -133,7 +173,13 @@ def compile_and_package_ib_solution(
 
 
 def download_ibsolution(
-    ib_host, api_token, solution_path, write_to_local=False, unzip_solution=False
+    ib_host,
+    api_token,
+    solution_path,
+    write_to_local=False,
+    unzip_solution=False,
+    stream=False,
+    artifact_cache=None,
 ):
     """
     Get the bytes content of an .ibsolution file
@@ -142,25 +188,48 @@ def download_ibsolution(
     :param api_token: (string) api token for IB environment
     :param solution_path: (str) path to ibsolution
     :param write_to_local: (bool) flag indicating whether to write .ibsolution bytes to local system
-    :return: Response object
+    :param unzip_solution: (bool) flag indicating whether to extract the written .ibsolution into a folder
+    :param stream: (bool) flag indicating whether to stream the download in chunks instead of buffering it in
+                   memory. With write_to_local the chunks go straight to disk and the returned response body is
+                   already consumed, otherwise the returned response should be read with iter_content
+    :param artifact_cache: (ArtifactCache) local cache of .ibsolution files, used with write_to_local. Only pass
+                           a cache for artifacts that are never rebuilt under the same name and version
+    :return: Response object, or None if the .ibsolution was copied from artifact_cache
     """
+    solution_name = Path(solution_path).name
+    package_name, package_version = parse_ibsolution_name(solution_name)
+    use_cache = write_to_local and artifact_cache is not None and package_name
 
-    # TODO: Check if file exists first
-    resp = read_file_through_api(ib_host, api_token, solution_path)
-
-    if write_to_local:
-        solution_name = Path(solution_path).name
-        with open(solution_name, "wb") as fd:
-            fd.write(resp.content)
+    cached_path = (
+        artifact_cache.checkout(package_name, package_version) if use_cache else None
+    )
+    if cached_path:
+        logging.info(f"Copying {solution_name} from artifact cache")
+        try:
+            shutil.copyfile(cached_path, solution_name)
+        finally:
+            artifact_cache.release(cached_path)
+        resp = None
+    elif write_to_local and stream:
+        # TODO: Check if file exists first
+        resp = download_file_through_api(
+            ib_host, api_token, solution_path, solution_name
+        )
+    else:
+        resp = read_file_through_api(ib_host, api_token, solution_path, stream=stream)
 
-        if unzip_solution:
-            zip_path = Path(solution_path).with_suffix(".zip").name
-            with open(zip_path, "wb") as fd:
+        if write_to_local:
+            with open(solution_name, "wb") as fd:
                 fd.write(resp.content)
-            with ZipFile(zip_path, "r") as zip_ref:
-                unzip_dir = Path(Path(zip_path).parent, Path(zip_path).stem)
-                zip_ref.extractall(unzip_dir)
-            os.remove(zip_path)
+
+    if use_cache and not cached_path:
+        artifact_cache.put_file(package_name, package_version, solution_name)
+
+    if write_to_local and unzip_solution:
+        # .ibsolution files are zip archives so extract straight from the written file
+        with ZipFile(solution_name, "r") as zip_ref:
+            unzip_dir = Path(Path(solution_name).parent, Path(solution_name).stem)
+            zip_ref.extractall(unzip_dir)
 
     return resp
 
@@ -177,7 +246,7 @@ def __copy_package_from_marketplace(
     :param package_version: (string) version of package (e.g. 1.1.5)
     :param intermediate_path: (string) path to intermediate location to copy ibsolution to
                               (e.g. ganan.prabaharan/my-repo/fs/Instabase%20Drive/download_folder)
-    :return:
+    :return: (Future) copy job tracked by the client's JobPoller, resolving to its final Job Status API content
     """
     solution_name = f"{package_name}-{package_version}.ibsolution"
 
@@ -199,30 +268,86 @@ def __copy_package_from_marketplace(
 
     # Send request to copy file from marketplace
     copy_url = os.path.join(dev_marketplace_solution_url, "copy?is_v2=true")
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
     params = {"new_full_path": intermediate_path}
-    resp = requests.post(copy_url, headers=headers, json=params, verify=False)
+    resp = get_ib_client(ib_host, api_token).post(copy_url, json=params)
 
-    # Copy task is async so wait for job to finish before continuing
+    # Copy task is async, hand its job to the poller and let the caller wait for it
     content = json.loads(resp.content)
-    job_id = content["job_id"]
-    wait_until_job_finishes(ib_host, job_id, "job", api_token)
+    return get_ib_client(ib_host, api_token).track_job(content["job_id"], "job")
+
 
-    return intermediate_path
+def __wait_for_marketplace_copy(copy_job, solution_name):
+    """
+    Waits for a copy started by __copy_package_from_marketplace
+
+    :param copy_job: (Future) copy job returned by __copy_package_from_marketplace
+    :param solution_name: (string) name of the copied ibsolution, used in the error message
+    :return: None
+    """
+    content = copy_job.result()
+    if content.get("status") != "OK":
+        raise Exception(f"Marketplace copy job failed for {solution_name}: {content}")
+
+
+def get_manifest_path(file_path):
+    """
+    Gets the path of the manifest sidecar stored next to an artifact
+
+    :param file_path: (string) path to artifact on IB environment
+    :return: (string) path to manifest sidecar
+    """
+    return f"{file_path}{MANIFEST_SUFFIX}"
+
+
+def write_artifact_manifest(ib_host, api_token, file_path, sha256, size):
+    """
+    Writes a manifest sidecar next to an artifact recording the digest and size of its complete content.
+    Only write this once the artifact has been fully uploaded
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param file_path: (string) path to artifact on IB environment
+    :param sha256: (string) hex sha256 digest of the artifact
+    :param size: (int) size of the artifact in bytes
+    :return: Response object
+    """
+    manifest = {"name": Path(file_path).name, "sha256": sha256, "size": size}
+    return upload_file(
+        ib_host, api_token, get_manifest_path(file_path), json.dumps(manifest)
+    )
+
+
+def read_artifact_manifest(ib_host, api_token, file_path):
+    """
+    Reads the manifest sidecar of an artifact
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param file_path: (string) path to artifact on IB environment
+    :return: (dict) manifest with sha256 and size, or None if there is no readable manifest
+    """
+    try:
+        resp = read_file_through_api(ib_host, api_token, get_manifest_path(file_path))
+        return json.loads(resp.content)
+    except Exception:
+        return None
 
 
 def check_if_file_exists_on_ib_env(
-    ib_host, api_token, file_path, use_clients=False, **kwargs
+    ib_host, api_token, file_path, use_clients=False, expected_sha256=None, **kwargs
 ):
     """
     Determines if a file exists on IB environment
-    Uses clients if user sets use_clients, otherwise uses Metadata API and checks if content length is greater than 100000
+    Uses clients if user sets use_clients, otherwise the file only counts as existing if it has a manifest sidecar
+    (see write_artifact_manifest) and its size matches the manifest, so partial uploads are never accepted.
+    Without an expected_sha256 only the size is compared, so pass the digest whenever one is known
 
     :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
     :param api_token: (string) api token for IB environment
     :param file_path: (string) path to file on IB environment
                       (e.g. ganan.prabaharan/my-repo/fs/Instabase%20Drive/package.json)
     :param use_clients:
+    :param expected_sha256: (string) hex sha256 digest the file must have, if known
     :param kwargs:
     :return:
     """
@@ -231,20 +356,181 @@ def check_if_file_exists_on_ib_env(
         # Use clients from kwargs if user sets flag to True
         clients, err = kwargs["_FN_CONTEXT_KEY"].get_by_col_name("CLIENTS")
         return clients.ibfile.is_file(file_path)
-    else:
-        # Check file metadata and determine if file already exists
-        metadata_response = get_file_metadata(ib_host, api_token, file_path)
-        if metadata_response.status_code == 200:
-            try:
-                content_length = metadata_response.headers["Content-Length"]
-                content_length = int(content_length)
-                if content_length > 100000:
-                    # File exists
-                    return True
-            except:
-                pass
 
-    return False
+    # Check file metadata against the manifest written when the file was uploaded
+    manifest = read_artifact_manifest(ib_host, api_token, file_path)
+    if not manifest:
+        return False
+    if expected_sha256 and manifest.get("sha256") != expected_sha256:
+        return False
+
+    metadata_response = get_file_metadata(ib_host, api_token, file_path)
+    if metadata_response.status_code != 200:
+        return False
+    try:
+        content_length = int(metadata_response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return False
+    return content_length == manifest.get("size")
+
+
+def check_files_exist_on_ib_env(
+    ib_host,
+    api_token,
+    file_paths,
+    expected_sha256s=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+):
+    """
+    Checks many artifacts at once the same way check_if_file_exists_on_ib_env checks one, see
+    read_artifact_manifests
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param file_paths: (list) paths to files on IB environment
+    :param expected_sha256s: (dict) hex sha256 digest each file must have, by path, where known
+    :param max_workers: (int) maximum number of manifests to read concurrently
+    :return: (dict) whether a complete copy of each file exists, by path
+    """
+    expected_sha256s = expected_sha256s or {}
+    manifests = read_artifact_manifests(ib_host, api_token, file_paths, max_workers)
+    return {
+        file_path: manifest is not None
+        and (
+            not expected_sha256s.get(file_path)
+            or manifest.get("sha256") == expected_sha256s[file_path]
+        )
+        for file_path, manifest in manifests.items()
+    }
+
+
+def read_artifact_manifests(
+    ib_host, api_token, file_paths, max_workers=DEFAULT_MAX_WORKERS
+):
+    """
+    Reads the manifest sidecars of many artifacts, keeping only those of complete copies. Each folder is
+    listed once and the listings answer which files are there with a manifest and at what size, so only the
+    manifests of files that are present get read rather than every file costing its own round trips
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param file_paths: (list) paths to files on IB environment
+    :param max_workers: (int) maximum number of manifests to read concurrently
+    :return: (dict) manifest of each file whose listed size matches it, None for missing or partial files,
+             by path
+    """
+    if not file_paths:
+        return {}
+
+    listings = {}
+    for folder_path in {os.path.dirname(file_path) for file_path in file_paths}:
+        try:
+            listings[folder_path] = list_folder(ib_host, api_token, folder_path)
+        except Exception:
+            # Nothing exists in a folder that can't be listed
+            listings[folder_path] = None
+
+    listed_sizes = {}
+    for file_path in file_paths:
+        listing = listings[os.path.dirname(file_path)]
+        if listing is None:
+            continue
+        size = listing.file_size(file_path)
+        if size is not None and listing.file_size(get_manifest_path(file_path)):
+            listed_sizes[file_path] = size
+
+    def complete_manifest(file_path):
+        manifest = read_artifact_manifest(ib_host, api_token, file_path)
+        if not manifest or manifest.get("size") != listed_sizes[file_path]:
+            return None
+        return manifest
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        manifests = dict(
+            zip(listed_sizes, executor.map(complete_manifest, listed_sizes))
+        )
+    return {file_path: manifests.get(file_path) for file_path in file_paths}
+
+
+def get_marketplace_ibsolution_path(package_name, package_version):
+    """
+    Gets the path a published package version's .ibsolution is stored at in the marketplace
+
+    :param package_name: (string) name of package (e.g. model_util)
+    :param package_version: (string) version of package (e.g. 1.1.5)
+    :return: (string) path to .ibsolution file
+    """
+    return os.path.join(
+        MARKETPLACE_PATH,
+        package_name,
+        package_version,
+        f"{package_name}-{package_version}.ibsolution",
+    )
+
+
+def check_packages_published_on_ib_env(
+    ib_host, api_token, dependency_dict, max_workers=DEFAULT_MAX_WORKERS
+):
+    """
+    Checks which packages an env's marketplace already has the exact version of. The marketplace folder is
+    listed once to find the packages it has any version of, then only those packages' folders are listed to
+    find their versions
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param dependency_dict: (dict) Dictionary mapping package names to their version numbers
+    :param max_workers: (int) maximum number of package folders to list concurrently
+    :return: (dict) whether the version of each package in dependency_dict is published, by package name
+    """
+    if not dependency_dict:
+        return {}
+
+    try:
+        marketplace = list_folder(ib_host, api_token, MARKETPLACE_PATH)
+    except Exception:
+        # Nothing is published to a marketplace that can't be listed
+        return {package_name: False for package_name in dependency_dict}
+    listed_packages = set(marketplace.folder_paths())
+
+    def version_published(package_name):
+        package_folder = os.path.join(MARKETPLACE_PATH, package_name)
+        try:
+            listing = list_folder(ib_host, api_token, package_folder)
+        except Exception:
+            return False
+        version_folder = os.path.join(package_folder, dependency_dict[package_name])
+        return version_folder in listing.folder_paths()
+
+    candidates = [
+        package_name
+        for package_name in dependency_dict
+        if os.path.join(MARKETPLACE_PATH, package_name) in listed_packages
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        published = dict(zip(candidates, executor.map(version_published, candidates)))
+    return {
+        package_name: published.get(package_name, False)
+        for package_name in dependency_dict
+    }
+
+
+class _DigestWriter:
+    """
+    File-like object that computes the sha256 digest and size of everything written to it, optionally
+    forwarding the data to another writer
+    """
+
+    def __init__(self, forward_to=None):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._forward_to = forward_to
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        if self._forward_to is not None:
+            self._forward_to.write(data)
+        return len(data)
 
 
 def copy_marketplace_package_and_move_to_new_env(
@@ -257,11 +543,17 @@ def copy_marketplace_package_and_move_to_new_env(
     download_folder,
     prod_upload_folder,
     use_clients=False,
+    artifact_cache=None,
+    target_exists=None,
+    source_exists=None,
     **kwargs,
 ):
     """
     Function to download ibsolutions from dev marketplace to prod ma
 
+    Uploaded packages get a manifest sidecar with their sha256 and size, and a package is only skipped when the
+    target already holds a complete copy with matching manifest
+
     :param source_ib_host: (string) IB host url for env where package exists (e.g. https://www.instabase.com)
     :param target_ib_host: (string) IB host url for env to move package to (e.g. https://www.instabase.com)
     :param package_name: (string) name of package (e.g. model_util)
@@ -271,6 +563,10 @@ def copy_marketplace_package_and_move_to_new_env(
     :param download_folder: (string) intermediate folder on source env to copy package to
     :param prod_upload_folder: (string) folder on taregt env to copy package to
     :param use_clients: (bool) flag indicating whether to use clients from a flow
+    :param artifact_cache: (ArtifactCache) local cache of .ibsolution files. On a cache hit the package is uploaded
+                           from the cache without touching the source env, on a miss it is cached while streaming
+    :param target_exists: (bool) whether the target already has a complete copy, if already checked
+    :param source_exists: (bool) whether the source download folder already has a complete copy, if already checked
     :param kwargs: kwargs from flow
     :return: Tuple(Response object, string) - Tuple of upload chunks response, and string of path to uploaded file
     """
@@ -278,45 +574,121 @@ def copy_marketplace_package_and_move_to_new_env(
     solution_name = f"{package_name}-{package_version}.ibsolution"
     final_upload_path = os.path.join(prod_upload_folder, solution_name)
 
-    # Check file metadata and determine if file already exists
-    metadata_response = get_file_metadata(
-        target_ib_host, target_api_token, final_upload_path
+    cache_entry = (
+        artifact_cache.entry(package_name, package_version)
+        if artifact_cache is not None
+        else None
     )
-    if metadata_response.status_code == 200:
-        try:
-            content_length = metadata_response.headers["Content-Length"]
-            content_length = int(content_length)
-            if content_length > 100000:
-                # File exists
-                return None, final_upload_path
-        except:
-            pass
-
-    # If file doesn't exist in target env, copy it to a temporary download folder on source env
-    # and then move it to target env
+
+    # If file doesn't exist in target env, it is copied to a temporary download folder on source env
+    # and then moved to target env
     copy_to_path = os.path.join(download_folder, solution_name)
 
+    # Skip the transfer if the target already has a complete copy of the package, comparing its digest with
+    # the cached copy, or failing that with the manifest left next to the source copy by an earlier transfer
+    if target_exists is None:
+        expected_sha256 = cache_entry["sha256"] if cache_entry else None
+        if expected_sha256 is None and not use_clients:
+            source_manifest = read_artifact_manifest(
+                source_ib_host, source_api_token, copy_to_path
+            )
+            expected_sha256 = source_manifest and source_manifest.get("sha256")
+        target_exists = check_if_file_exists_on_ib_env(
+            target_ib_host,
+            target_api_token,
+            final_upload_path,
+            expected_sha256=expected_sha256,
+        )
+    if target_exists:
+        return None, final_upload_path
+
+    # Upload straight from the local cache if this version has been transferred before
+    if artifact_cache is not None and not use_clients:
+        # Checked out so other packages being added to the cache can't evict it during the upload
+        cached_path = artifact_cache.checkout(package_name, package_version)
+        if cached_path:
+            logging.info(f"Uploading {solution_name} from artifact cache")
+            try:
+                resp = upload_local_file(
+                    target_ib_host, target_api_token, final_upload_path, cached_path
+                )
+            finally:
+                artifact_cache.release(cached_path)
+            write_artifact_manifest(
+                target_ib_host,
+                target_api_token,
+                final_upload_path,
+                cache_entry["sha256"],
+                cache_entry["size"],
+            )
+            return resp, final_upload_path
+
     # Check if file exists in temp download folder on source env, if it doesn't exist then copy it over
-    if not check_if_file_exists_on_ib_env(
-        source_ib_host, source_api_token, copy_to_path, use_clients, **kwargs
-    ):
-        __copy_package_from_marketplace(
+    if source_exists is None:
+        source_exists = check_if_file_exists_on_ib_env(
+            source_ib_host, source_api_token, copy_to_path, use_clients, **kwargs
+        )
+    if not source_exists:
+        copy_job = __copy_package_from_marketplace(
             source_ib_host,
             source_api_token,
             package_name,
             package_version,
             copy_to_path,
         )
+        __wait_for_marketplace_copy(copy_job, solution_name)
 
-    # Download file contents of ibsolution from source env download folder
-    file_contents = read_file_content_from_ib(
-        source_ib_host, source_api_token, copy_to_path, use_clients, **kwargs
-    )
+    # Published marketplace versions never change, so an interrupted transfer can be resumed by a rerun
+    checkpoint_key = f"{source_ib_host}/{package_name}/{package_version}"
+    if use_clients:
+        # Download file contents of ibsolution from source env download folder
+        file_contents = read_file_content_from_ib(
+            source_ib_host, source_api_token, copy_to_path, use_clients, **kwargs
+        )
+
+        # Upload file contents to target env upload folder
+        resp = upload_chunks(
+            target_ib_host, final_upload_path, target_api_token, file_contents
+        )
+        digest = _DigestWriter()
+        digest.write(file_contents)
+    elif artifact_cache is not None:
+        # Stream ibsolution into target env upload folder, keeping a copy in the cache for later runs
+        with artifact_cache.writer(package_name, package_version) as cache_writer:
+            digest = _DigestWriter(forward_to=cache_writer)
+            resp = stream_file_between_envs(
+                source_ib_host,
+                source_api_token,
+                copy_to_path,
+                target_ib_host,
+                target_api_token,
+                final_upload_path,
+                tee=digest,
+                checkpoint_key=checkpoint_key,
+            )
+    else:
+        # Stream ibsolution from source env download folder into target env upload folder
+        digest = _DigestWriter()
+        resp = stream_file_between_envs(
+            source_ib_host,
+            source_api_token,
+            copy_to_path,
+            target_ib_host,
+            target_api_token,
+            final_upload_path,
+            tee=digest,
+            checkpoint_key=checkpoint_key,
+        )
 
-    # Upload file contents to target env upload folder
-    resp = upload_chunks(
-        target_ib_host, final_upload_path, target_api_token, file_contents
+    # Record what was transferred so reruns can tell complete copies from partial ones
+    sha256 = digest.sha256.hexdigest()
+    write_artifact_manifest(
+        target_ib_host, target_api_token, final_upload_path, sha256, digest.size
     )
+    if not use_clients:
+        write_artifact_manifest(
+            source_ib_host, source_api_token, copy_to_path, sha256, digest.size
+        )
     return resp, final_upload_path
 
 
@@ -329,11 +701,15 @@ def download_dependencies_from_dev_and_upload_to_prod(
     upload_folder_path,
     dependency_dict,
     use_clients=False,
+    max_workers=DEFAULT_MAX_WORKERS,
+    artifact_cache=None,
+    published=None,
     **kwargs,
 ):
     """
     Downloads dependencies listed in dependency_dict to a folder called 'dev_dependencies' on dev environment,
-    and uploads them to a folder called 'prod_dependencies' on prod environment
+    and uploads them to a folder called 'prod_dependencies' on prod environment. Packages whose version is
+    already published to the prod environment marketplace are skipped
 
     :param source_ib_host: (string) IB host url for env where package exists (e.g. https://www.instabase.com)
     :param target_ib_host: (string) IB host url for env where package exists (e.g. https://www.instabase.com)
@@ -347,11 +723,38 @@ def download_dependencies_from_dev_and_upload_to_prod(
                                  (e.g. ganan.prabaharan/my-repo/fs/Instabase%20Drive/)
     :param dependency_dict: (dict) Dictionary mapping package names to their version numbers
     :param use_clients: (bool) flag indicating whether to use clients from a flow
+    :param max_workers: (int) maximum number of packages to migrate concurrently
+    :param artifact_cache: (ArtifactCache) local cache of .ibsolution files to reuse between runs
+    :param published: (dict) whether each package is already published to the target env marketplace, by
+                      package name, if already checked
     :param kwargs: kwargs from flow
-    :return: List[str] list of paths for uploaded solutions
+    :return: List[str] list of paths for uploaded solutions, in dependency_dict order
     """
     # TODO: Give possibility to use clients for one environment and the other
 
+    # Packages the target marketplace already has need no transfer or publish
+    if published is None and not use_clients:
+        published = check_packages_published_on_ib_env(
+            target_ib_host, target_api_token, dependency_dict, max_workers
+        )
+    published = published or {}
+    already_published = [
+        f"{package_name}=={package_version}"
+        for package_name, package_version in dependency_dict.items()
+        if published.get(package_name)
+    ]
+    if already_published:
+        logging.info(
+            f"Skipping packages already published on target: {', '.join(already_published)}"
+        )
+        dependency_dict = {
+            package_name: package_version
+            for package_name, package_version in dependency_dict.items()
+            if not published.get(package_name)
+        }
+    if not dependency_dict:
+        return []
+
     # Create download/upload folders on dev/prod environments
     source_download_folder = os.path.join(download_folder_path, "source_dependencies")
     target_upload_folder = os.path.join(upload_folder_path, "target_dependencies")
@@ -363,22 +766,86 @@ def download_dependencies_from_dev_and_upload_to_prod(
         target_ib_host, target_api_token, target_upload_folder
     )
 
-    # Copy all dependency packages from dev to prod
-    upload_paths = []
+    target_paths = {}
+    source_paths = {}
     for package_name, package_version in dependency_dict.items():
-        try:
-            resp, uploaded_path = copy_marketplace_package_and_move_to_new_env(
-                source_ib_host,
-                target_ib_host,
+        solution_name = f"{package_name}-{package_version}.ibsolution"
+        target_paths[package_name] = os.path.join(target_upload_folder, solution_name)
+        source_paths[package_name] = os.path.join(source_download_folder, solution_name)
+
+    # Check which packages are already on each env with one listing per folder rather than per package
+    target_exists = {}
+    source_exists = {}
+    if not use_clients:
+        # Target copies are checked against the digest of the cached copy, or failing that of the source copy
+        expected_sha256s = {}
+        uncached = []
+        for package_name, package_version in dependency_dict.items():
+            cache_entry = (
+                artifact_cache.entry(package_name, package_version)
+                if artifact_cache is not None
+                else None
+            )
+            if cache_entry:
+                expected_sha256s[target_paths[package_name]] = cache_entry["sha256"]
+            else:
+                uncached.append(package_name)
+
+        # Only packages missing from the cache are read from the source download folder
+        source_manifests = read_artifact_manifests(
+            source_ib_host,
+            source_api_token,
+            [source_paths[package_name] for package_name in uncached],
+            max_workers=max_workers,
+        )
+        for package_name in uncached:
+            manifest = source_manifests[source_paths[package_name]]
+            source_exists[source_paths[package_name]] = manifest is not None
+            if manifest and manifest.get("sha256"):
+                expected_sha256s[target_paths[package_name]] = manifest["sha256"]
+
+        target_exists = check_files_exist_on_ib_env(
+            target_ib_host,
+            target_api_token,
+            list(target_paths.values()),
+            expected_sha256s,
+            max_workers=max_workers,
+        )
+
+    def migrate_package(package_name, package_version):
+        resp, uploaded_path = copy_marketplace_package_and_move_to_new_env(
+            source_ib_host,
+            target_ib_host,
+            package_name,
+            package_version,
+            source_api_token,
+            target_api_token,
+            source_download_folder,
+            target_upload_folder,
+            use_clients=use_clients,
+            artifact_cache=artifact_cache,
+            target_exists=target_exists.get(target_paths[package_name]),
+            source_exists=source_exists.get(source_paths[package_name]),
+            **kwargs,
+        )
+        return uploaded_path
+
+    # Copy all dependency packages from dev to prod, migrating up to max_workers packages at a time
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            (
                 package_name,
                 package_version,
-                source_api_token,
-                target_api_token,
-                source_download_folder,
-                target_upload_folder,
-                use_clients=use_clients,
-                **kwargs,
+                executor.submit(migrate_package, package_name, package_version),
             )
+            for package_name, package_version in dependency_dict.items()
+        ]
+
+    # Collect results in dependency_dict order so the returned paths are deterministic
+    upload_paths = []
+    for package_name, package_version, future in futures:
+        try:
+            uploaded_path = future.result()
         except Exception as e:
             logging.error(
                 "Error moving package name: {}, package_version: {}. Error: {}".format(
@@ -391,3 +858,443 @@ def download_dependencies_from_dev_and_upload_to_prod(
         upload_paths.append(uploaded_path)
 
     return upload_paths
+
+
+def cache_dependencies_from_source(
+    source_ib_host,
+    source_api_token,
+    download_folder_path,
+    dependency_dict,
+    artifact_cache,
+    transitive=False,
+    max_workers=DEFAULT_MAX_WORKERS,
+):
+    """
+    Fetches dependency packages from the source env marketplace into a local artifact cache, so they can then be
+    uploaded to any number of target envs without going back to the source. Packages that are already cached
+    aren't fetched again
+
+    :param source_ib_host: (string) IB host url for env where packages exist (e.g. https://www.instabase.com)
+    :param source_api_token: (string) api token for source_ib_host env
+    :param download_folder_path: (string) path to folder on source_ib_host env to create download folder in
+    :param dependency_dict: (dict) Dictionary mapping package names to their version numbers
+    :param artifact_cache: (ArtifactCache) local cache to fetch the packages into
+    :param transitive: (bool) flag indicating whether to also fetch the dependencies of dependencies, read from
+                       the package.json of each cached package
+    :param max_workers: (int) maximum number of packages to fetch concurrently
+    :return: (dict) every cached package name mapped to its version
+    """
+    source_download_folder = os.path.join(download_folder_path, "source_dependencies")
+    create_folder_if_it_does_not_exists(
+        source_ib_host, source_api_token, source_download_folder
+    )
+    client = get_ib_client(source_ib_host, source_api_token)
+
+    def download_path(package_name, package_version):
+        return os.path.join(
+            source_download_folder, f"{package_name}-{package_version}.ibsolution"
+        )
+
+    def fetch_package(package_name, package_version, source_exists):
+        copy_to_path = download_path(package_name, package_version)
+        if not source_exists:
+            copy_job = __copy_package_from_marketplace(
+                source_ib_host,
+                source_api_token,
+                package_name,
+                package_version,
+                copy_to_path,
+            )
+            __wait_for_marketplace_copy(copy_job, os.path.basename(copy_to_path))
+        with artifact_cache.writer(package_name, package_version) as cache_writer:
+            with client.read_file(copy_to_path, stream=True) as resp:
+                for chunk in resp.iter_content(chunk_size=DEFAULT_CHUNK_SIZE):
+                    cache_writer.write(chunk)
+        cache_entry = artifact_cache.entry(package_name, package_version)
+        write_artifact_manifest(
+            source_ib_host,
+            source_api_token,
+            copy_to_path,
+            cache_entry["sha256"],
+            cache_entry["size"],
+        )
+
+    def cache_package(package_name, package_version, source_exists):
+        if not artifact_cache.entry(package_name, package_version):
+            fetch_package(package_name, package_version, source_exists)
+        if not transitive:
+            return {}
+        cached_path = artifact_cache.checkout(package_name, package_version)
+        try:
+            with ZipFile(cached_path) as archive:
+                package = json.loads(archive.read("package.json"))
+        finally:
+            artifact_cache.release(cached_path)
+        if "dependencies" not in package:
+            return {}
+        return parse_dependencies(package["dependencies"])
+
+    cached = {}
+    wave = dict(dependency_dict)
+    while wave:
+        # Check the source download folder once for every package that has to be fetched
+        source_exists = check_files_exist_on_ib_env(
+            source_ib_host,
+            source_api_token,
+            [
+                download_path(name, version)
+                for name, version in wave.items()
+                if not artifact_cache.entry(name, version)
+            ],
+            max_workers=max_workers,
+        )
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [
+                executor.submit(
+                    cache_package,
+                    name,
+                    version,
+                    source_exists.get(download_path(name, version), False),
+                )
+                for name, version in wave.items()
+            ]
+        cached.update(wave)
+
+        # Versions are checked per target when migrating, here every requested version is just fetched
+        next_wave = {}
+        for future in futures:
+            for name, version in future.result().items():
+                if name not in cached:
+                    next_wave.setdefault(name, version)
+        wave = next_wave
+
+    return cached
+
+
+def migrate_dependencies_transitively(
+    source_ib_host,
+    target_ib_host,
+    source_api_token,
+    target_api_token,
+    download_folder_path,
+    upload_folder_path,
+    dependency_dict,
+    max_workers=DEFAULT_MAX_WORKERS,
+    artifact_cache=None,
+):
+    """
+    Moves the packages in dependency_dict and everything they depend on from the source env marketplace to the
+    target env. Packages are migrated a wave at a time: once a wave has been uploaded, the package.json of each
+    package is read from its uploaded copy to find the next wave. Packages the target marketplace already has
+    aren't moved, their package.json is read from the target marketplace instead. Conflicting versions and
+    circular dependencies raise as soon as the wave revealing them has been read, before the next wave is moved
+
+    :param source_ib_host: (string) IB host url for env where package exists (e.g. https://www.instabase.com)
+    :param target_ib_host: (string) IB host url for env to move packages to (e.g. https://www.instabase.com)
+    :param source_api_token: (string) api token for source_ib_host env
+    :param target_api_token: (string) api token for target_ib_host env
+    :param download_folder_path: (string) path to folder on source_ib_host env to create download folder in
+    :param upload_folder_path: (string) path to folder on target_ib_host env to create upload folder in
+    :param dependency_dict: (dict) Dictionary mapping the solution's direct dependencies to their versions
+    :param max_workers: (int) maximum number of packages to migrate concurrently
+    :param artifact_cache: (ArtifactCache) local cache of .ibsolution files to reuse between runs
+    :return: (dict) dependency graph mapping each package name to its "version", uploaded "path",
+             "dependencies" (dict of package name to version) and "published" flag, set for packages the target
+             marketplace already had, whose path is their marketplace copy
+    """
+    graph = {}
+    required_by = {name: ["solution"] for name in dependency_dict}
+    wave = dict(dependency_dict)
+
+    while wave:
+        published = check_packages_published_on_ib_env(
+            target_ib_host, target_api_token, wave, max_workers
+        )
+        upload_paths = download_dependencies_from_dev_and_upload_to_prod(
+            source_ib_host,
+            target_ib_host,
+            source_api_token,
+            target_api_token,
+            download_folder_path,
+            upload_folder_path,
+            wave,
+            max_workers=max_workers,
+            artifact_cache=artifact_cache,
+            published=published,
+        )
+        uploaded = {os.path.basename(path): path for path in upload_paths}
+        failed = [
+            f"{name}=={version}"
+            for name, version in wave.items()
+            if not published[name] and f"{name}-{version}.ibsolution" not in uploaded
+        ]
+        if failed:
+            raise Exception(f"Failed to migrate dependencies: {', '.join(failed)}")
+
+        def read_dependencies(path):
+            return get_dependencies_from_ibsolution(
+                target_ib_host, target_api_token, path
+            )
+
+        # Dependencies of packages already published are read from their marketplace copy
+        paths = [
+            (
+                get_marketplace_ibsolution_path(name, version)
+                if published[name]
+                else uploaded[f"{name}-{version}.ibsolution"]
+            )
+            for name, version in wave.items()
+        ]
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            wave_dependencies = list(executor.map(read_dependencies, paths))
+
+        next_wave = {}
+        for (name, version), path, dependencies in zip(
+            wave.items(), paths, wave_dependencies
+        ):
+            graph[name] = {
+                "version": version,
+                "path": path,
+                "dependencies": dependencies,
+                "published": published[name],
+            }
+            for dependency, dependency_version in dependencies.items():
+                required_by.setdefault(dependency, []).append(f"{name}=={version}")
+                resolved_version = (
+                    graph[dependency]["version"]
+                    if dependency in graph
+                    else wave.get(dependency) or next_wave.get(dependency)
+                )
+                if resolved_version and resolved_version != dependency_version:
+                    raise Exception(
+                        f"Conflicting versions of {dependency}: {resolved_version} and {dependency_version} "
+                        f"(required by {', '.join(required_by[dependency])})"
+                    )
+                if not resolved_version:
+                    next_wave[dependency] = dependency_version
+
+        # A cycle closes once the wave that depends back on an earlier package is read, so fail before
+        # uploading any more packages rather than once the whole graph has been migrated
+        get_dependency_levels(graph)
+        wave = next_wave
+
+    return graph
+
+
+def get_dependency_levels(graph):
+    """
+    Orders a dependency graph into levels that can be published one after another: every package's
+    dependencies are in earlier levels, so packages within a level can be published in parallel
+
+    :param graph: (dict) dependency graph from migrate_dependencies_transitively
+    :return: (list) list of levels, each a sorted list of package names
+    """
+    remaining = {
+        name: {
+            dependency for dependency in package["dependencies"] if dependency in graph
+        }
+        for name, package in graph.items()
+    }
+    levels = []
+    while remaining:
+        level = sorted(
+            name for name, dependencies in remaining.items() if not dependencies
+        )
+        if not level:
+            raise Exception(
+                f"Circular dependencies between packages: {', '.join(sorted(remaining))}"
+            )
+        for name in level:
+            remaining.pop(name)
+        for dependencies in remaining.values():
+            dependencies.difference_update(level)
+        levels.append(level)
+    return levels
+
+
+def write_dependency_lockfile(lockfile_path, graph, levels):
+    """
+    Writes a resolved dependency graph to a JSON lockfile
+
+    :param lockfile_path: (string) local path to write the lockfile to
+    :param graph: (dict) dependency graph from migrate_dependencies_transitively
+    :param levels: (list) publish levels from get_dependency_levels
+    :return: None
+    """
+    lockfile = {
+        "packages": {
+            name: {
+                "version": package["version"],
+                "dependencies": package["dependencies"],
+            }
+            for name, package in sorted(graph.items())
+        },
+        "levels": levels,
+    }
+    with open(lockfile_path, "w") as fp:
+        json.dump(lockfile, fp, indent=2, sort_keys=True)
+
+
+def publish_dependencies_in_levels(
+    ib_host, api_token, graph, levels, max_workers=DEFAULT_MAX_WORKERS
+):
+    """
+    Publishes migrated dependencies to the marketplace a level at a time, waiting for every publish in a level
+    to finish before starting the next so packages are only published after their dependencies
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param graph: (dict) dependency graph from migrate_dependencies_transitively
+    :param levels: (list) publish levels from get_dependency_levels
+    :param max_workers: (int) maximum number of packages to publish concurrently
+    :return: (list) publish_many result of each package, in level order
+    """
+
+    results = []
+    for level in levels:
+        # Packages already in the marketplace don't need publishing again
+        paths = [
+            graph[name]["path"] for name in level if not graph[name].get("published")
+        ]
+        if not paths:
+            continue
+        level_results = publish_many(
+            ib_host,
+            api_token,
+            paths,
+            max_workers=max_workers,
+        )
+        logging.info("Publish results:\n" + format_publish_results(level_results))
+        results += level_results
+
+        # Packages in later levels need these ones, so stop at the first failed level
+        failed = [result["path"] for result in level_results if not result["succeeded"]]
+        if failed:
+            raise Exception(f"Failed to publish dependencies: {', '.join(failed)}")
+    return results
+
+
+def hash_local_directory(directory):
+    """
+    Hashes every file in a local directory
+
+    :param directory: (string) local directory
+    :return: (dict) sha256 hex digest of each file, keyed by its path relative to directory using / separators
+    """
+    hashes = {}
+    for root, dirs, files in os.walk(directory):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            sha256 = hashlib.sha256()
+            with open(file_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1048576), b""):
+                    sha256.update(chunk)
+            relative_path = Path(os.path.relpath(file_path, directory)).as_posix()
+            hashes[relative_path] = sha256.hexdigest()
+    return hashes
+
+
+def read_sync_manifest(ib_host, api_token, target_directory):
+    """
+    Reads the manifest of what sync_directory_to_ib last pushed to a folder
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param target_directory: (string) path of synced folder on IB environment
+    :return: (dict) sha256 of each synced file keyed by relative path, or None if the folder hasn't been
+             synced or no longer exists
+    """
+    if get_file_metadata(ib_host, api_token, target_directory).status_code != 200:
+        return None
+    try:
+        resp = read_file_through_api(
+            ib_host, api_token, target_directory + SYNC_MANIFEST_SUFFIX
+        )
+        return json.loads(resp.content)["files"]
+    except Exception:
+        return None
+
+
+def sync_directory_to_ib(
+    ib_host,
+    api_token,
+    local_directory,
+    target_directory,
+    max_workers=DEFAULT_MAX_WORKERS,
+    compresslevel=DEFAULT_COMPRESSION_LEVEL,
+):
+    """
+    Makes a folder on the IB environment match a local directory, sending only what changed since the last
+    sync. A manifest of the sha256 of every pushed file is kept next to the folder (<folder>.sync.json);
+    added and changed files are uploaded, removed files are deleted and the manifest is updated last, so an
+    interrupted sync is repeated in full for the files it didn't get to. Files written into the folder on
+    the IB environment (e.g. compiled binaries) are left alone
+
+    Without a manifest the directory is uploaded as a zip and extracted, as it is quicker for a full copy
+
+    :param ib_host: (string) IB host url (e.g. https://www.instabase.com)
+    :param api_token: (string) api token for IB environment
+    :param local_directory: (string) local directory to sync
+    :param target_directory: (string) path of folder on IB environment to sync to
+    :param max_workers: (int) maximum number of files to upload or delete concurrently
+    :param compresslevel: (int) deflate compression level used for a full upload
+    :return: (list, list) relative paths of uploaded files and of deleted files
+    """
+    local_hashes = hash_local_directory(local_directory)
+    remote_hashes = read_sync_manifest(ib_host, api_token, target_directory)
+
+    if remote_hashes is None:
+        logging.info(f"No sync manifest for {target_directory}, uploading everything")
+        zip_path = target_directory + ".zip"
+        upload_directory_as_zip(
+            ib_host, api_token, zip_path, local_directory, compresslevel
+        )
+        unzip_resp = unzip_files(ib_host, api_token, zip_path, target_directory)
+        wait_until_request_completes(
+            ib_host,
+            api_token,
+            unzip_resp,
+            expected_path=os.path.join(target_directory, "package.json"),
+        )
+        delete_folder_or_file_from_ib(zip_path, ib_host, api_token)
+        uploaded, deleted = sorted(local_hashes), []
+    else:
+        uploaded = sorted(
+            path
+            for path, sha256 in local_hashes.items()
+            if remote_hashes.get(path) != sha256
+        )
+        deleted = sorted(set(remote_hashes) - set(local_hashes))
+        logging.info(
+            f"Syncing {target_directory}: {len(uploaded)} files to upload, {len(deleted)} to delete, "
+            f"{len(local_hashes) - len(uploaded)} unchanged"
+        )
+
+        def upload(relative_path):
+            upload_local_file(
+                ib_host,
+                api_token,
+                os.path.join(target_directory, relative_path),
+                os.path.join(local_directory, *relative_path.split("/")),
+            )
+
+        def delete(relative_path):
+            delete_folder_or_file_from_ib(
+                os.path.join(target_directory, relative_path), ib_host, api_token
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(upload, path) for path in uploaded]
+            futures += [executor.submit(delete, path) for path in deleted]
+        # Raise the first error before the manifest is updated
+        for future in futures:
+            future.result()
+
+    upload_file(
+        ib_host,
+        api_token,
+        target_directory + SYNC_MANIFEST_SUFFIX,
+        json.dumps({"files": local_hashes}, sort_keys=True),
+    )
+    return uploaded, deleted
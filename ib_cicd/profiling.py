@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+# Span categories, the summary reports the time spent in each separately
+HTTP = "http"
+SLEEP = "sleep"
+QUEUE = "queue"
+STEP = "step"
+
+# APIs whose url ends in a file path, grouped by API rather than by file
+_PATH_ENDPOINTS = [
+    "/api/v2/files/",
+    "/api/v1/drives/",
+    "/api/v1/flow_binary/compile/",
+]
+_FIXED_ENDPOINTS = {"/api/v2/files/copy", "/api/v2/files/extract"}
+
+_profiler = None
+
+
+def endpoint_template(url):
+    """
+    Gets the endpoint a url calls, with file paths and query strings removed
+
+    :param url: (string) request url (e.g. https://www.instabase.com/api/v2/files/space/fs/a.zip)
+    :return: (string) endpoint template (e.g. /api/v2/files/{path})
+    """
+    path = unquote(urlsplit(url).path)
+    if path in _FIXED_ENDPOINTS:
+        return path
+    for prefix in _PATH_ENDPOINTS:
+        if path.startswith(prefix):
+            return prefix + "{path}"
+    return path
+
+
+class Profiler:
+    """
+    Records timed spans from any thread, for writing out as a Chrome trace and summarising per stage and per
+    endpoint
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def span(self, name, category, **args):
+        """
+        Times a block of code
+
+        :param name: (string) name of the span
+        :param category: (string) one of HTTP, SLEEP, QUEUE or STEP
+        :param args: details to record with the span
+        :return: context manager yielding the args dict, which the block can add details to
+        """
+        return _Span(self, name, category, args)
+
+    def record(self, name, category, start, duration, args):
+        with self._lock:
+            self._spans.append(
+                {
+                    "name": name,
+                    "category": category,
+                    "start": start - self._origin,
+                    "duration": duration,
+                    "thread": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def spans(self):
+        """
+        :return: (list) recorded spans, each a dict of name, category, start, duration, thread and args
+        """
+        with self._lock:
+            return list(self._spans)
+
+    def write_trace(self, path):
+        """
+        Writes the recorded spans in Chrome trace format, viewable in chrome://tracing or Perfetto
+
+        :param path: (string) local path to write the trace to
+        :return: None
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["duration"] * 1e6,
+                "pid": pid,
+                "tid": span["thread"],
+                "args": span["args"],
+            }
+            for span in self.spans()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """
+        Summarises the recorded spans as tables of time per stage, per endpoint and per activity. Activity
+        times are summed over threads, so with concurrent work they can add up to more than the wall time
+
+        :return: (string) summary tables
+        """
+        spans = self.spans()
+        wall_time = time.perf_counter() - self._origin
+
+        stages = {}
+        endpoints = {}
+        activities = {HTTP: 0, SLEEP: 0, QUEUE: 0}
+        for span in spans:
+            args = span["args"]
+            if span["category"] == STEP:
+                stages[span["name"]] = stages.get(span["name"], 0) + span["duration"]
+                continue
+            activities[span["category"]] += span["duration"]
+            if span["category"] == HTTP:
+                key = f"{args.get('method')} {args.get('endpoint')}"
+                endpoint = endpoints.setdefault(key, [0, 0, 0, 0, 0])
+                endpoint[0] += 1
+                endpoint[1] += span["duration"]
+                endpoint[2] += args.get("bytes_sent") or 0
+                endpoint[3] += args.get("bytes_received") or 0
+            elif args.get("reason") == "retry":
+                key = f"{args.get('method')} {args.get('endpoint')}"
+                endpoints.setdefault(key, [0, 0, 0, 0, 0])[4] += 1
+
+        lines = [f"{'Stage':<40}{'Seconds':>10}"]
+        for name, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<40}{seconds:>10.2f}")
+
+        lines.append("")
+        lines.append(
+            f"{'Endpoint':<50}{'Calls':>7}{'Seconds':>10}{'Sent':>14}{'Received':>14}{'Retries':>9}"
+        )
+        for key, (calls, seconds, sent, received, retries) in sorted(
+            endpoints.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                f"{key:<50}{calls:>7}{seconds:>10.2f}{sent:>14}{received:>14}{retries:>9}"
+            )
+
+        lines.append("")
+        lines.append(f"{'Activity':<40}{'Seconds':>10}")
+        lines.append(f"{'Transferring (HTTP requests)':<40}{activities[HTTP]:>10.2f}")
+        lines.append(
+            f"{'Sleeping (polling and retries)':<40}{activities[SLEEP]:>10.2f}"
+        )
+        lines.append(f"{'Waiting for buffered data':<40}{activities[QUEUE]:>10.2f}")
+        lines.append(f"{'Wall time':<40}{wall_time:>10.2f}")
+        return "\n".join(lines)
+
+
+class _Span:
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.profiler.record(
+            self.name,
+            self.category,
+            self.start,
+            time.perf_counter() - self.start,
+            self.args,
+        )
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable_profiling():
+    """
+    Starts recording spans for the rest of the run
+
+    :return: Profiler
+    """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling():
+    """
+    Stops recording spans
+
+    :return: None
+    """
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    """
+    :return: Profiler recording spans, or None if profiling is off
+    """
+    return _profiler
+
+
+def span(name, category, **args):
+    """
+    Times a block of code if profiling is on, costing next to nothing otherwise
+
+    :param name: (string) name of the span
+    :param category: (string) one of HTTP, SLEEP, QUEUE or STEP
+    :param args: details to record with the span
+    :return: context manager yielding a dict the block can add details to
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_SPAN
+    return profiler.span(name, category, **args)
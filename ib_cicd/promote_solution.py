@@ -1,29 +1,53 @@
-import time
-
-import requests
 import logging
 import json
 
 import os
-import shutil
-from urllib.parse import quote
 import argparse
-import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+from zipfile import ZipFile
 
 from ib_cicd.ib_helpers import (
+    download_file_through_api,
+    upload_local_file,
     unzip_files,
-    upload_file,
-    read_file_content_from_ib,
     copy_file_within_ib,
+    get_file_metadata,
+    stream_file_between_envs,
     publish_to_marketplace,
-    delete_folder_or_file_from_ib,
     deploy_solution,
+    list_folder,
+    publish_many,
+    format_publish_results,
+    upload_directory_as_zip,
+    DEFAULT_COMPRESSION_LEVEL,
+    read_member_from_remote_ibsolution,
+    set_polling_policy,
+    set_upload_checkpoint_dir,
+    set_upload_part_size_bounds,
+    set_request_timeout,
+    set_run_deadline,
+    get_run_deadline,
+    wait_until_request_completes,
 )
 from ib_cicd.migration_helpers import (
     download_ibsolution,
     compile_and_package_ib_solution,
     download_dependencies_from_dev_and_upload_to_prod,
+    sync_directory_to_ib,
+    migrate_dependencies_transitively,
+    get_dependency_levels,
+    write_dependency_lockfile,
+    publish_dependencies_in_levels,
+    cache_dependencies_from_source,
+    DEFAULT_MAX_WORKERS,
 )
+from ib_cicd.artifact_cache import ArtifactCache, DEFAULT_MAX_BYTES
+from ib_cicd.step_scheduler import StepGraph
+from ib_cicd.profiling import STEP, enable_profiling, span
 
 TARGET_IB_API_TOKEN = os.environ.get("TARGET_IB_API_TOKEN")
 SOURCE_IB_API_TOKEN = os.environ.get("SOURCE_IB_API_TOKEN")
@@ -37,9 +61,6 @@ SOURCE_COMPILED_SOLUTIONS_PATH = os.environ.get("SOURCE_COMPILED_SOLUTIONS_PATH"
 LOCAL_SOLUTION_DIR = os.environ.get("LOCAL_SOLUTION_DIR")
 REL_FLOW_PATH = os.environ.get("REL_FLOW_PATH")
 
-TARGET_FILES_API = os.path.join(*[TARGET_IB_HOST, "api/v2", "files"])
-SOURCE_FILES_API = os.path.join(*[SOURCE_IB_HOST, "api/v2", "files"])
-
 
 def parse_dependencies(package_dependencies):
     models = {
@@ -60,69 +81,102 @@ def read_local_package_json(directory_name, package_path=None):
     return package
 
 
-def upload_zip_to_instabase():
-    shutil.make_archive("solution", "zip", LOCAL_SOLUTION_DIR)
-
+def upload_zip_to_instabase(compression_level=DEFAULT_COMPRESSION_LEVEL):
     path_to_upload = os.path.join(*[TARGET_IB_PATH, LOCAL_SOLUTION_DIR + ".zip"])
 
-    upload_data = open("solution.zip", "rb")
-    resp = upload_file(TARGET_IB_HOST, TARGET_IB_API_TOKEN, path_to_upload, upload_data)
+    # Zip is streamed to the target as it is compressed rather than written to disk first
+    resp = upload_directory_as_zip(
+        TARGET_IB_HOST,
+        TARGET_IB_API_TOKEN,
+        path_to_upload,
+        LOCAL_SOLUTION_DIR,
+        compression_level,
+    )
     return resp
 
 
-def version_tuple(v):
-    return tuple(map(int, (v.split("."))))
-
+def parse_settings(value):
+    # Parses "name:setting=value,..." e.g. "flow:timeout=3600,max_interval=30" or "HEAD:connect=5,read=30"
+    name, _, settings = value.partition(":")
+    overrides = {}
+    for setting in filter(None, settings.split(",")):
+        key, _, number = setting.partition("=")
+        overrides[key.strip()] = None if number.lower() == "none" else float(number)
+    return name.strip(), overrides
 
-def get_latest_ibsolution_path(api_token, files_api, solution_path):
-    headers = {"Authorization": "Bearer {0}".format(api_token)}
-    params = {"expect-node-type": "folder"}
-    url = os.path.join(files_api, quote(solution_path))
-    resp = requests.get(url, headers=headers, params=params, verify=False)
-    # TODO: Check status code
 
-    nodes = json.loads(resp.content)
-    paths = [
-        s["full_path"] for s in nodes["nodes"] if s["full_path"].endswith(".ibsolution")
-    ]
-
-    latest_version = "0.0.0"
-    latest_path = ""
-    for path in paths:
-        sol_name = path.split(".ibsoluton")[0].split("/")[-1]
-        start, end = re.search("-[0-9]*.[0-9]*.[0-9]*", sol_name).span()
-        version = sol_name[start + 1 : end]
-        if version_tuple(version) > version_tuple(latest_version):
-            latest_version = version
-            latest_path = path
-    return latest_path
+def get_latest_ibsolution_path(ib_host, api_token, solution_path):
+    # Listings are cached for the run, so repeated lookups of the same folder don't list it again
+    return list_folder(ib_host, api_token, solution_path).latest_ibsolution_path()
 
 
 def read_target_package():
-    # Unzip solution into a temporary folder
-    new_path = os.path.join(*TARGET_IB_PATH.split("/")[:-1], "temp_solution")
+    # Read package.json straight out of the latest .ibsolution rather than unzipping it on the target
     path_to_ib_solution = get_latest_ibsolution_path(
-        TARGET_IB_API_TOKEN, TARGET_FILES_API, TARGET_IB_PATH
+        TARGET_IB_HOST, TARGET_IB_API_TOKEN, TARGET_IB_PATH
+    )
+    package_json = read_member_from_remote_ibsolution(
+        TARGET_IB_HOST, TARGET_IB_API_TOKEN, path_to_ib_solution, "package.json"
     )
-    unzip_files(
-        TARGET_IB_HOST, TARGET_IB_API_TOKEN, path_to_ib_solution, new_path
-    )  # TODO: Does this unzip work on a non-zip file path like ib_solution_path?
+    return json.loads(package_json)
 
-    # Add wait for files to unzip
-    time.sleep(5)
 
-    # Read package
-    package_json_path = os.path.join(new_path, "package.json")
-    read_response = read_file_content_from_ib(
-        TARGET_IB_HOST, TARGET_IB_API_TOKEN, package_json_path, use_clients=False
+def read_source_package():
+    path_to_ib_solution = get_latest_ibsolution_path(
+        SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, SOURCE_COMPILED_SOLUTIONS_PATH
     )
-    package_json = json.loads(read_response)
-
-    # Delete temporary solution folder
-    delete_folder_or_file_from_ib(
-        new_path, TARGET_IB_HOST, TARGET_IB_API_TOKEN, use_clients=False
+    package_json = read_member_from_remote_ibsolution(
+        SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, path_to_ib_solution, "package.json"
     )
-    return package_json
+    return json.loads(package_json)
+
+
+def read_targets_file(targets_file):
+    """
+    Reads the environments to promote a solution to from a JSON file holding a list of objects with the "host"
+    of each environment, the "path" of the folder to upload the solution to and "token_env", the name of the
+    environment variable holding its API token. An optional "name" is used in logs and defaults to the host name
+
+    :param targets_file: (string) local path of the targets file
+    :return: (list) dicts with name, host, token and path of each target
+    """
+    with open(targets_file) as fp:
+        entries = json.load(fp)
+
+    targets = []
+    for entry in entries:
+        missing = [key for key in ["host", "path", "token_env"] if not entry.get(key)]
+        if missing:
+            raise Exception(f"Target {entry} is missing {', '.join(missing)}")
+        name = entry.get("name") or urlsplit(entry["host"]).hostname
+        token = os.environ.get(entry["token_env"])
+        if not token:
+            raise Exception(
+                f"Environment variable {entry['token_env']} with the API token for target {name} is not set"
+            )
+        targets.append(
+            {"name": name, "host": entry["host"], "token": token, "path": entry["path"]}
+        )
+    # An empty file would otherwise quietly fall back to the TARGET_* environment variables
+    if not targets:
+        raise Exception(f"Targets file {targets_file} doesn't list any targets")
+    return targets
+
+
+def format_target_results(results):
+    """
+    Formats the per-target results of a fan-out promotion as a table
+
+    :param results: (list) result dicts with target, succeeded, error and seconds
+    :return: (string) table with one row per target
+    """
+    lines = [f"{'Target':<30}{'Result':<10}{'Seconds':>10}  Error"]
+    for result in results:
+        status = "OK" if result["succeeded"] else "FAILED"
+        lines.append(
+            f"{result['target']:<30}{status:<10}{result['seconds']:>10.2f}  {result['error'] or ''}"
+        )
+    return "\n".join(lines)
 
 
 def set_output_version_github(version):
@@ -140,11 +194,32 @@ def copy_solution_to_working_dir(new_solution_dir):
         SOURCE_SOLUTION_DIR, *REL_FLOW_PATH.split("/")[:-1], "modules"
     )
 
+    copies = []
     for path in [package_path, icon_path, flow_path, modules_path]:
         new_path = path.replace(SOURCE_SOLUTION_DIR, new_solution_dir)
-        copy_file_within_ib(
+
+        # The working dir is reused between runs, so note when the previous copy was written to tell it apart
+        # from this one
+        metadata = get_file_metadata(SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, new_path)
+        previous_last_modified = (
+            metadata.headers.get("Last-Modified")
+            if metadata.status_code == 200
+            else None
+        )
+        resp = copy_file_within_ib(
             SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, path, new_path, use_clients=False
         )
+        copies.append((resp, new_path, previous_last_modified))
+
+    # Copies run as async jobs, so wait for all of them once they've all been started
+    for resp, new_path, previous_last_modified in copies:
+        wait_until_request_completes(
+            SOURCE_IB_HOST,
+            SOURCE_IB_API_TOKEN,
+            resp,
+            expected_path=new_path,
+            previous_last_modified=previous_last_modified,
+        )
 
 
 def main():
@@ -162,15 +237,126 @@ def main():
     parser.add_argument("--local_flow", action="store_true")
     parser.add_argument("--remote_flow", action="store_true")
     parser.add_argument("--marketplace", action="store_true")
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of dependencies to migrate concurrently with --upload_dependencies",
+    )
+    parser.add_argument(
+        "--polling_policy",
+        action="append",
+        default=[],
+        help="Override job polling for a job type (job, async, flow, file or upload_part), e.g. "
+        "flow:timeout=3600,max_interval=30. Settings: initial_interval, max_interval, multiplier, jitter, timeout. "
+        "Jobs have no timeout unless one is set here, waits for output files time out after 1800s",
+    )
+    parser.add_argument(
+        "--timeout",
+        action="append",
+        default=[],
+        help='Override API request timeouts, e.g. "PATCH /api/v2/files/{path}:read=900" or HEAD:connect=5,read=30. '
+        "Keys: default, a method, or a method and endpoint. Settings: connect, read",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=os.environ.get("IB_CICD_RUN_DEADLINE"),
+        help="Seconds the whole run may take, after which the run fails straight away with an error naming the "
+        "steps still running",
+    )
+    parser.add_argument(
+        "--artifact_cache_dir",
+        default=os.environ.get("IB_CICD_ARTIFACT_CACHE_DIR"),
+        help="Local directory to cache dependency .ibsolution files in between runs",
+    )
+    parser.add_argument(
+        "--artifact_cache_max_bytes",
+        type=int,
+        default=DEFAULT_MAX_BYTES,
+        help="Maximum size of the artifact cache, least recently used files are evicted first",
+    )
+    parser.add_argument(
+        "--upload_checkpoint_dir",
+        default=os.environ.get("IB_CICD_UPLOAD_CHECKPOINT_DIR"),
+        help="Local directory to record upload progress in, so a rerun resumes interrupted uploads",
+    )
+    parser.add_argument(
+        "--min_upload_part_size",
+        type=int,
+        help="Smallest part size in bytes that uploads adapt their part size down to",
+    )
+    parser.add_argument(
+        "--max_upload_part_size",
+        type=int,
+        help="Largest part size in bytes that uploads adapt their part size up to",
+    )
+    parser.add_argument(
+        "--max_parallel_steps",
+        type=int,
+        default=None,
+        help="Maximum number of pipeline steps to run at once, 1 runs them one after another",
+    )
+    parser.add_argument(
+        "--compression_level",
+        type=int,
+        choices=range(10),
+        default=DEFAULT_COMPRESSION_LEVEL,
+        help="Deflate level (0-9) used to zip the local solution, already compressed files are stored",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="With --local, only upload files that changed since the last sync and delete removed ones",
+    )
+    parser.add_argument(
+        "--transitive_dependencies",
+        action="store_true",
+        help="Also migrate the dependencies of dependencies, publishing them before the packages that need them",
+    )
+    parser.add_argument(
+        "--lockfile",
+        help="Local path to write the resolved dependency graph to, implies --transitive_dependencies",
+    )
+    parser.add_argument(
+        "--targets_file",
+        help="JSON file listing several target environments to promote a remote solution to at once, "
+        "fetching the solution and its dependencies from the source only once",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Local path to write a Chrome trace of every step and API call to, a summary is printed at the end",
+    )
     parser.set_defaults(local=False)
     args = parser.parse_args()
 
-    if args.compile_source_solution:
+    profiler = enable_profiling() if args.profile else None
+    set_run_deadline(args.deadline)
+
+    targets = read_targets_file(args.targets_file) if args.targets_file else None
+    if targets and (args.local or args.local_flow):
+        raise Exception("--targets_file can only be used to promote remote solutions")
+
+    artifact_cache = (
+        ArtifactCache(args.artifact_cache_dir, args.artifact_cache_max_bytes)
+        if args.artifact_cache_dir
+        else None
+    )
+
+    for polling_policy in args.polling_policy:
+        job_type, overrides = parse_settings(polling_policy)
+        set_polling_policy(job_type, **overrides)
+    for timeout in args.timeout:
+        key, overrides = parse_settings(timeout)
+        set_request_timeout(key, **overrides)
+    set_upload_checkpoint_dir(args.upload_checkpoint_dir)
+    set_upload_part_size_bounds(args.min_upload_part_size, args.max_upload_part_size)
+
+    def compile_source():
         new_solution_dir = os.path.join(
             SOURCE_WORKING_DIR, SOURCE_SOLUTION_DIR.split("/")[-1]
         )
         copy_solution_to_working_dir(new_solution_dir)
-        time.sleep(3)
         compile_and_package_ib_solution(
             SOURCE_IB_HOST,
             SOURCE_IB_API_TOKEN,
@@ -179,25 +365,46 @@ def main():
             SOURCE_COMPILED_SOLUTIONS_PATH,
         )
 
-    if args.publish_source_solution or args.local_flow or args.remote_flow:
+    def publish_source():
         source_path = get_latest_ibsolution_path(
-            SOURCE_IB_API_TOKEN, SOURCE_FILES_API, SOURCE_COMPILED_SOLUTIONS_PATH
+            SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, SOURCE_COMPILED_SOLUTIONS_PATH
         )
         if args.marketplace:
             publish_to_marketplace(SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, source_path)
         else:
-            deploy_solution(SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, source_path)
+            deploy_resp = deploy_solution(
+                SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, source_path
+            )
+            wait_until_request_completes(
+                SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, deploy_resp, job_type="job"
+            )
 
-    if args.promote_solution_to_target or args.local_flow or args.remote_flow:
+    def promote_to_target():
         if args.local or args.local_flow:
-            upload_zip_to_instabase()
-
-            # Unzip solution contents
-            zip_path = os.path.join(*[TARGET_IB_PATH, LOCAL_SOLUTION_DIR + ".zip"])
-            unzip_files(TARGET_IB_HOST, TARGET_IB_API_TOKEN, zip_path)
-
             directory_path = os.path.join(TARGET_IB_PATH, LOCAL_SOLUTION_DIR)
-            time.sleep(3)
+            if args.sync:
+                # Only send the files that changed since the last sync
+                sync_directory_to_ib(
+                    TARGET_IB_HOST,
+                    TARGET_IB_API_TOKEN,
+                    LOCAL_SOLUTION_DIR,
+                    directory_path,
+                    max_workers=args.max_workers,
+                    compresslevel=args.compression_level,
+                )
+            else:
+                upload_zip_to_instabase(args.compression_level)
+
+                # Unzip solution contents
+                zip_path = os.path.join(*[TARGET_IB_PATH, LOCAL_SOLUTION_DIR + ".zip"])
+                unzip_resp = unzip_files(TARGET_IB_HOST, TARGET_IB_API_TOKEN, zip_path)
+
+                wait_until_request_completes(
+                    TARGET_IB_HOST,
+                    TARGET_IB_API_TOKEN,
+                    unzip_resp,
+                    expected_path=os.path.join(directory_path, "package.json"),
+                )
             compile_and_package_ib_solution(
                 TARGET_IB_HOST,
                 TARGET_IB_API_TOKEN,
@@ -207,26 +414,98 @@ def main():
             )
         else:
             ib_solution_path = get_latest_ibsolution_path(
-                SOURCE_IB_API_TOKEN, SOURCE_FILES_API, SOURCE_COMPILED_SOLUTIONS_PATH
-            )
-            resp = download_ibsolution(
-                SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, ib_solution_path
+                SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, SOURCE_COMPILED_SOLUTIONS_PATH
             )
             target_path = os.path.join(TARGET_IB_PATH, ib_solution_path.split("/")[-1])
-            upload_file(TARGET_IB_HOST, TARGET_IB_API_TOKEN, target_path, resp.content)
+            # Stream the solution across in parts rather than holding it in memory
+            stream_file_between_envs(
+                SOURCE_IB_HOST,
+                SOURCE_IB_API_TOKEN,
+                ib_solution_path,
+                TARGET_IB_HOST,
+                TARGET_IB_API_TOKEN,
+                target_path,
+            )
 
-    if args.publish_target_solution or args.local_flow or args.remote_flow:
+    def publish_target():
         ib_solution_path = get_latest_ibsolution_path(
-            TARGET_IB_API_TOKEN, TARGET_FILES_API, TARGET_IB_PATH
+            TARGET_IB_HOST, TARGET_IB_API_TOKEN, TARGET_IB_PATH
         )
         if args.marketplace:
             publish_to_marketplace(
                 TARGET_IB_HOST, TARGET_IB_API_TOKEN, ib_solution_path
             )
         else:
-            deploy_solution(TARGET_IB_HOST, TARGET_IB_API_TOKEN, ib_solution_path)
+            deploy_resp = deploy_solution(
+                TARGET_IB_HOST, TARGET_IB_API_TOKEN, ib_solution_path
+            )
+            wait_until_request_completes(
+                TARGET_IB_HOST, TARGET_IB_API_TOKEN, deploy_resp, job_type="job"
+            )
 
-    if args.upload_dependencies or args.local_flow or args.remote_flow:
+    def migrate_dependencies_to(
+        target_ib_host,
+        target_api_token,
+        target_path,
+        requirements_dict,
+        cache,
+        lockfile,
+    ):
+        if args.transitive_dependencies or args.lockfile:
+            # Migrate the dependencies of dependencies too, then publish them leaves first
+            graph = migrate_dependencies_transitively(
+                SOURCE_IB_HOST,
+                target_ib_host,
+                SOURCE_IB_API_TOKEN,
+                target_api_token,
+                SOURCE_WORKING_DIR,
+                target_path,
+                requirements_dict,
+                max_workers=args.max_workers,
+                artifact_cache=cache,
+            )
+            levels = get_dependency_levels(graph)
+            if lockfile:
+                write_dependency_lockfile(lockfile, graph, levels)
+            publish_dependencies_in_levels(
+                target_ib_host,
+                target_api_token,
+                graph,
+                levels,
+                max_workers=args.max_workers,
+            )
+            return
+
+        # Download dependencies needed for ibsolution and upload them onto target environment
+        uploaded_ibsolutions = download_dependencies_from_dev_and_upload_to_prod(
+            SOURCE_IB_HOST,
+            target_ib_host,
+            SOURCE_IB_API_TOKEN,
+            target_api_token,
+            SOURCE_WORKING_DIR,
+            target_path,
+            requirements_dict,
+            max_workers=args.max_workers,
+            artifact_cache=cache,
+        )
+
+        # Publish uploaded ibsolution files to target environment marketplace
+        publish_results = publish_many(
+            target_ib_host,
+            target_api_token,
+            uploaded_ibsolutions,
+            max_workers=args.max_workers,
+        )
+        logging.info(
+            "Dependency publish results:\n" + format_publish_results(publish_results)
+        )
+        failed = [
+            result["path"] for result in publish_results if not result["succeeded"]
+        ]
+        if failed:
+            raise Exception(f"Failed to publish dependencies: {', '.join(failed)}")
+
+    def upload_dependencies():
         if args.local:
             dependencies = read_local_package_json(LOCAL_SOLUTION_DIR)
             requirements_dict = parse_dependencies(dependencies.get("dependencies", {}))
@@ -234,29 +513,18 @@ def main():
             package = read_target_package()
             requirements_dict = parse_dependencies(package.get("dependencies", {}))
 
-        # Download dependencies needed for ibsolution and upload them onto target environment
-        uploaded_ibsolutions = download_dependencies_from_dev_and_upload_to_prod(
-            SOURCE_IB_HOST,
+        migrate_dependencies_to(
             TARGET_IB_HOST,
-            SOURCE_IB_API_TOKEN,
             TARGET_IB_API_TOKEN,
-            SOURCE_WORKING_DIR,
             TARGET_IB_PATH,
             requirements_dict,
+            artifact_cache,
+            args.lockfile,
         )
 
-        # Publish uploaded ibsolution files to target environment marketplace
-        for ib_solution_path in uploaded_ibsolutions:
-            publish_resp = publish_to_marketplace(
-                TARGET_IB_HOST, TARGET_IB_API_TOKEN, ib_solution_path
-            )
-            logging.info(
-                "Publish response for {}: {}".format(ib_solution_path, publish_resp)
-            )
-
-    if args.download_ibsolution or args.local_flow or args.remote_flow:
+    def download_target():
         ib_solution_path = get_latest_ibsolution_path(
-            TARGET_IB_API_TOKEN, TARGET_FILES_API, TARGET_IB_PATH
+            TARGET_IB_HOST, TARGET_IB_API_TOKEN, TARGET_IB_PATH
         )
         download_ibsolution(
             TARGET_IB_HOST,
@@ -264,23 +532,214 @@ def main():
             ib_solution_path,
             write_to_local=True,
             unzip_solution=True,
+            stream=True,
         )
 
-    if args.set_github_actions_env_var:
-        if args.local:
-            package = read_local_package_json(LOCAL_SOLUTION_DIR)
-        else:
-            package = read_target_package()
-        version = package["version"]
-        set_output_version_github(version)
+    def promote_to_targets():
+        # Everything needed from the source is fetched once, then all targets are promoted concurrently
+        source_path = get_latest_ibsolution_path(
+            SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, SOURCE_COMPILED_SOLUTIONS_PATH
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            local_solution_path = os.path.join(work_dir, Path(source_path).name)
+            if args.promote_solution_to_target or flow:
+                # Streamed to disk once, then uploaded to every target in parts
+                download_file_through_api(
+                    SOURCE_IB_HOST,
+                    SOURCE_IB_API_TOKEN,
+                    source_path,
+                    local_solution_path,
+                )
+                with ZipFile(local_solution_path) as archive:
+                    package = json.loads(archive.read("package.json"))
+            else:
+                package = read_source_package()
+            requirements_dict = parse_dependencies(package.get("dependencies", {}))
 
-    if args.set_azure_devops_env_var:
-        if args.local:
-            package = read_local_package_json(LOCAL_SOLUTION_DIR)
-        else:
-            package = read_target_package()
-        version = package["version"]
-        print(f"##vso[task.setvariable variable=PACKAGE_VERSION;]{version}")
+            cache = artifact_cache or ArtifactCache(os.path.join(work_dir, "cache"))
+            if args.upload_dependencies or flow:
+                cache_dependencies_from_source(
+                    SOURCE_IB_HOST,
+                    SOURCE_IB_API_TOKEN,
+                    SOURCE_WORKING_DIR,
+                    requirements_dict,
+                    cache,
+                    transitive=bool(args.transitive_dependencies or args.lockfile),
+                    max_workers=args.max_workers,
+                )
+
+            def promote(target):
+                start_time = time.perf_counter()
+                try:
+                    if args.promote_solution_to_target or flow:
+                        target_path = os.path.join(
+                            target["path"], Path(source_path).name
+                        )
+                        upload_local_file(
+                            target["host"],
+                            target["token"],
+                            target_path,
+                            local_solution_path,
+                        )
+                    if args.upload_dependencies or flow:
+                        lockfile = None
+                        if args.lockfile:
+                            root, extension = os.path.splitext(args.lockfile)
+                            lockfile = f"{root}.{target['name']}{extension}"
+                        migrate_dependencies_to(
+                            target["host"],
+                            target["token"],
+                            target["path"],
+                            requirements_dict,
+                            cache,
+                            lockfile,
+                        )
+                    if args.publish_target_solution or flow:
+                        if not (args.promote_solution_to_target or flow):
+                            # Publish the solution already on the target, like the single target path
+                            target_path = get_latest_ibsolution_path(
+                                target["host"], target["token"], target["path"]
+                            )
+                        if args.marketplace:
+                            publish_to_marketplace(
+                                target["host"], target["token"], target_path
+                            )
+                        else:
+                            deploy_resp = deploy_solution(
+                                target["host"], target["token"], target_path
+                            )
+                            wait_until_request_completes(
+                                target["host"],
+                                target["token"],
+                                deploy_resp,
+                                job_type="job",
+                            )
+                    error = None
+                except Exception as e:
+                    logging.error(f"Promotion to {target['name']} failed: {e}")
+                    error = str(e)
+                return {
+                    "target": target["name"],
+                    "succeeded": error is None,
+                    "error": error,
+                    "seconds": time.perf_counter() - start_time,
+                }
+
+            with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                results = list(executor.map(promote, targets))
+
+        logging.info("Target results:\n" + format_target_results(results))
+        failed = [result["target"] for result in results if not result["succeeded"]]
+        if failed:
+            raise Exception(f"Failed to promote to targets: {', '.join(failed)}")
+        return results
+
+    def download_source():
+        ib_solution_path = get_latest_ibsolution_path(
+            SOURCE_IB_HOST, SOURCE_IB_API_TOKEN, SOURCE_COMPILED_SOLUTIONS_PATH
+        )
+        download_ibsolution(
+            SOURCE_IB_HOST,
+            SOURCE_IB_API_TOKEN,
+            ib_solution_path,
+            write_to_local=True,
+            unzip_solution=True,
+            stream=True,
+        )
+
+    # Each step starts as soon as the steps it needs have finished, so independent steps run concurrently
+    flow = args.local_flow or args.remote_flow
+    steps = StepGraph()
+    if args.compile_source_solution:
+        steps.add("compile_source_solution", compile_source)
+    if args.publish_source_solution or flow:
+        steps.add(
+            "publish_source_solution",
+            publish_source,
+            depends_on=["compile_source_solution"],
+        )
+    if targets:
+        # Fan out: promote, publish and upload dependencies to every target in one step
+        if (
+            args.promote_solution_to_target
+            or args.publish_target_solution
+            or args.upload_dependencies
+            or flow
+        ):
+            steps.add(
+                "promote_to_targets",
+                promote_to_targets,
+                depends_on=["compile_source_solution"],
+            )
+        if args.download_ibsolution or flow:
+            # Every target gets the same file, so it is downloaded from the source
+            steps.add(
+                "download_ibsolution",
+                download_source,
+                depends_on=["compile_source_solution"],
+            )
+    else:
+        if args.promote_solution_to_target or flow:
+            # A local promotion only uploads the local code, a remote one needs the compiled source solution
+            steps.add(
+                "promote_solution_to_target",
+                promote_to_target,
+                depends_on=(
+                    [] if args.local or args.local_flow else ["compile_source_solution"]
+                ),
+            )
+        if args.publish_target_solution or flow:
+            steps.add(
+                "publish_target_solution",
+                publish_target,
+                depends_on=["compile_source_solution", "promote_solution_to_target"],
+            )
+        if args.upload_dependencies or flow:
+            # Locally the package.json is on disk, remotely it is read from the solution promoted to the target
+            steps.add(
+                "upload_dependencies",
+                upload_dependencies,
+                depends_on=(
+                    []
+                    if args.local
+                    else ["compile_source_solution", "promote_solution_to_target"]
+                ),
+            )
+        if args.download_ibsolution or flow:
+            steps.add(
+                "download_ibsolution",
+                download_target,
+                depends_on=["compile_source_solution", "promote_solution_to_target"],
+            )
+    try:
+        steps.run(max_workers=args.max_parallel_steps, deadline=get_run_deadline())
+
+        if args.set_github_actions_env_var:
+            with span("set_github_actions_env_var", STEP):
+                if args.local:
+                    package = read_local_package_json(LOCAL_SOLUTION_DIR)
+                elif targets:
+                    package = read_source_package()
+                else:
+                    package = read_target_package()
+                version = package["version"]
+                set_output_version_github(version)
+
+        if args.set_azure_devops_env_var:
+            with span("set_azure_devops_env_var", STEP):
+                if args.local:
+                    package = read_local_package_json(LOCAL_SOLUTION_DIR)
+                elif targets:
+                    package = read_source_package()
+                else:
+                    package = read_target_package()
+                version = package["version"]
+                print(f"##vso[task.setvariable variable=PACKAGE_VERSION;]{version}")
+    finally:
+        if profiler is not None:
+            # Written even when a step fails, that's often when the trace is most useful
+            profiler.write_trace(args.profile)
+            print(profiler.summary())
 
 
 if __name__ == "__main__":
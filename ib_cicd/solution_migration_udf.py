@@ -1,8 +1,8 @@
-from ib_cicd.ib_helpers import upload_file, publish_to_marketplace
+from ib_cicd.ib_helpers import upload_file, publish_many, format_publish_results
 from ib_cicd.migration_helpers import (
     read_file_through_api,
     download_ibsolution,
-    get_dependencies_from_ibsolution,
+    get_dependencies_from_solution_build_folder,
     download_dependencies_from_dev_and_upload_to_prod,
 )
 
@@ -41,7 +41,7 @@ def migrate_solution(
                                              environment to upload dependency ibsolutions from marketplace.
                                              Defaults to target_ib_solution_folder
     :param kwargs:
-    :return:
+    :return: (list) publish result of each migrated dependency, see ib_helpers.publish_many
     """
     # TODO: Compile build directory to an ibsolution if one doesn't already exist
 
@@ -67,10 +67,10 @@ def migrate_solution(
     # Upload IB Solution to Prod
     solution_name = f'{package["name"]}-{package["version"]}.ibsolution'
     upload_path = os.path.join(target_ib_solution_folder, solution_name)
-    upload_file(source_ib_host, target_api_token, upload_path, resp.content)
+    upload_file(target_ib_host, target_api_token, upload_path, resp.content)
 
     # Get dependencies (dev packages + model solutions) from package.json
-    requirements_dict = get_dependencies_from_ibsolution(
+    requirements_dict = get_dependencies_from_solution_build_folder(
         source_ib_host, source_api_token, solution_build_dir_path
     )
 
@@ -95,12 +95,9 @@ def migrate_solution(
     )
 
     # Publish ibsolutions to Prod marketplace
-    for ib_solution_path in uploaded_ibsolutions:
-        publish_resp = publish_to_marketplace(
-            source_ib_host, source_api_token, ib_solution_path
-        )
-        logging.info(
-            "Publish response for {}: {}".format(ib_solution_path, publish_resp)
-        )
-
-    return
+    publish_results = publish_many(
+        target_ib_host, target_api_token, uploaded_ibsolutions
+    )
+    logging.info("Publish results:\n" + format_publish_results(publish_results))
+
+    return publish_results
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from ib_cicd.profiling import STEP, span
+
+
+class StepGraph:
+    """
+    Dependency graph of pipeline steps. Running the graph starts every step as soon as the steps it depends
+    on have finished, so independent steps run concurrently and the whole run takes as long as its longest
+    chain of dependent steps
+
+    If a step raises, no further steps are started, the steps already running are left to finish and the
+    error is raised once they have. When the run deadline passes a TimeoutError naming the steps still running
+    is raised straight away. Those steps can't be interrupted, they're left running on daemon threads so they
+    don't keep the process alive
+    """
+
+    def __init__(self):
+        self._steps = {}
+
+    def add(self, name, fn, depends_on=()):
+        """
+        Adds a step to the graph
+
+        :param name: (string) unique name of the step
+        :param fn: (callable) function to run, called without arguments
+        :param depends_on: (iterable) names of steps that must finish before this one starts. Names of steps
+                           that aren't in the graph are ignored, so steps can depend on optional steps
+        :return: None
+        """
+        if name in self._steps:
+            raise Exception(f"Step {name} has already been added")
+        self._steps[name] = (fn, tuple(depends_on))
+
+    def __contains__(self, name):
+        return name in self._steps
+
+    def _dependencies(self, name):
+        return {
+            dependency
+            for dependency in self._steps[name][1]
+            if dependency in self._steps
+        }
+
+    def run(self, max_workers=None, deadline=None):
+        """
+        Runs every step in the graph
+
+        :param max_workers: (int) maximum number of steps to run at once, defaults to the number of steps
+        :param deadline: (float) time.monotonic() value by which every step must have finished, None for no
+                         deadline
+        :return: (dict) return value of each step by name
+        """
+        remaining = {name: self._dependencies(name) for name in self._steps}
+        results = {}
+        if not remaining:
+            return results
+
+        max_workers = max_workers or len(remaining)
+        running = {}
+        error = None
+        while remaining or running:
+            if error is None:
+                ready = [name for name, deps in remaining.items() if not deps]
+                if not ready and not running:
+                    raise Exception(
+                        f"Steps have circular dependencies: {', '.join(remaining)}"
+                    )
+                for name in ready[: max_workers - len(running)]:
+                    remaining.pop(name)
+                    running[self._start_step(name)] = name
+            elif not running:
+                break
+
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Deadline passed: blame the steps still running rather than waiting for them
+                raise TimeoutError(
+                    f"Run deadline passed while running steps: {', '.join(sorted(running.values()))}"
+                ) from error
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # Fail fast: let running steps finish but don't start any more
+                    if error is None:
+                        error = e
+                    continue
+                for deps in remaining.values():
+                    deps.discard(name)
+
+        if error is not None:
+            raise error
+        return results
+
+    def _start_step(self, name):
+        # Runs a step on a daemon thread, so a step still running past the deadline doesn't hold up exit
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._run_step(name))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"step-{name}", daemon=True).start()
+        return future
+
+    def _run_step(self, name):
+        start_time = time.perf_counter()
+        logging.info(f"Starting step {name}")
+        try:
+            with span(name, STEP):
+                return self._steps[name][0]()
+        except Exception:
+            logging.error(f"Step {name} failed")
+            raise
+        finally:
+            logging.info(
+                f"Finished step {name} in {time.perf_counter() - start_time:.2f}s"
+            )
@@ -1,5 +1,7 @@
 import pytest
 
+from ib_cicd.ib_helpers import close_ib_clients
+
 _MOCK_IB_HOST_URL = "https://instbase-fake-testing-url.com"
 _MOCK_API_TOKEN = "fake-testing-token"
 _MOCK_AUTH_HEADERS = {"Authorization": f"Bearer {_MOCK_API_TOKEN}"}
@@ -24,3 +26,15 @@ def ib_api_token():
     """
 
     return _MOCK_API_TOKEN
+
+
+@pytest.fixture(autouse=True)
+def ib_clients():
+    """Fixture that clears the shared IB clients so each test builds its own session
+
+    Yields:
+        None
+    """
+    close_ib_clients()
+    yield
+    close_ib_clients()
@@ -0,0 +1,510 @@
+"""Local stand-in for the Instabase APIs used by ib_cicd, backed by an in-memory filesystem"""
+
+import io
+import json
+import threading
+import time
+import uuid
+import zipfile
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+_MARKETPLACE_PATH = "system/global/fs/Instabase Drive/Applications/Marketplace/All"
+_MARKETPLACE_PREFIX = f"/api/v1/drives/{_MARKETPLACE_PATH}/"
+_SEND_CHUNK_SIZE = 64 * 1024
+
+
+def make_ibsolution(package_json, files=None):
+    """Builds the bytes of an .ibsolution archive
+
+    Args:
+        package_json (dict): Contents of the solution's package.json
+        files (dict): Extra archive members mapping name to bytes
+
+    Returns:
+        bytes: .ibsolution content
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("package.json", json.dumps(package_json))
+        for name, data in (files or {}).items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+class IBStandIn:
+    """In-process HTTP server implementing the parts of the Instabase APIs used by ib_cicd
+
+    Files live in memory keyed by path. Asynchronous APIs return job IDs that report RUNNING until job_duration
+    has passed. Every request is delayed by latency, and request and response bodies are throttled to
+    bandwidth, so the cost of a round trip or of moving bytes can be made visible in benchmarks.
+
+    Failing uploads can be simulated by appending to patch_failures: each entry fails the next PATCH request
+    with a 503 after writing that many bytes of its body, None lets the request succeed.
+
+    Args:
+        api_token (str): Token that requests must present as a Bearer token
+        latency (float): Seconds added to every request
+        bandwidth (float): Bytes per second that bodies are transferred at, None for unlimited
+        job_duration (float): Seconds each job runs for before reaching its final state
+        page_size (int): Maximum number of nodes in each page of a folder listing, None for unlimited
+        supports_range (bool): Whether file reads honour the Range header
+    """
+
+    def __init__(
+        self,
+        api_token="stand-in-token",
+        latency=0,
+        bandwidth=None,
+        job_duration=0,
+        page_size=None,
+        supports_range=True,
+    ):
+        self.api_token = api_token
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.job_duration = job_duration
+        self.page_size = page_size
+        self.supports_range = supports_range
+        self.files = {}
+        self.modified = {}
+        self.folders = set()
+        self.marketplace = {}
+        self.deployed = []
+        self.jobs = {}
+        self.patch_failures = []
+        self.requests = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def host(self):
+        """str: Base URL of the running server"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Starts serving on a free local port
+
+        Returns:
+            IBStandIn: The started server
+        """
+        handler = type("Handler", (_Handler,), {"stand_in": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """Summarises the traffic served so far
+
+        Returns:
+            dict: Request count, bytes received and sent, and request count per method and endpoint
+        """
+        with self.lock:
+            endpoints = {}
+            for method, path in self.requests:
+                key = f"{method} {_endpoint(path)}"
+                endpoints[key] = endpoints.get(key, 0) + 1
+            return {
+                "requests": len(self.requests),
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "endpoints": dict(sorted(endpoints.items())),
+            }
+
+    def reset_stats(self):
+        """Forgets the traffic served so far"""
+        with self.lock:
+            self.requests = []
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def add_marketplace_package(self, name, version, dependencies=None):
+        """Publishes a package to the stand-in marketplace
+
+        Args:
+            name (str): Package name
+            version (str): Package version
+            dependencies (dict): Optional package.json dependencies
+
+        Returns:
+            bytes: .ibsolution content of the package
+        """
+        package_json = {"name": name, "version": version}
+        if dependencies:
+            package_json["dependencies"] = dependencies
+        content = make_ibsolution(package_json, {"data.bin": f"{name}-{version}" * 64})
+        self.publish(name, version, content)
+        return content
+
+    def publish(self, name, version, content):
+        """Adds a package version to the marketplace, which is also readable through the filesystem"""
+        with self.lock:
+            self.marketplace[(name, version)] = content
+        self.write_file(
+            f"{_MARKETPLACE_PATH}/{name}/{version}/{name}-{version}.ibsolution",
+            content,
+        )
+
+    def new_job(self, state="DONE"):
+        """Registers a job
+
+        Args:
+            state (str): State the Job Status API reports for the job
+
+        Returns:
+            str: Job ID
+        """
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = (state, time.monotonic() + self.job_duration)
+        return job_id
+
+    def job_state(self, job_id):
+        """Gets the state the Job Status API reports for a job
+
+        Returns:
+            str: Job state, or None for an unknown job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        state, finishes_at = job
+        return state if time.monotonic() >= finishes_at else "RUNNING"
+
+    def write_file(self, path, content):
+        """Writes a file, creating its parent folders"""
+        with self.lock:
+            self.files[path] = bytes(content)
+            self.modified[path] = formatdate(usegmt=True)
+            parent = path.rsplit("/", 1)[0]
+            while parent and parent not in self.folders:
+                self.folders.add(parent)
+                if "/" not in parent:
+                    break
+                parent = parent.rsplit("/", 1)[0]
+
+    def list_folder(self, path):
+        """Lists the direct children of a folder
+
+        Returns:
+            list: Node dictionaries in name order
+        """
+        prefix = path.rstrip("/") + "/"
+        nodes = {}
+        with self.lock:
+            for file_path, content in self.files.items():
+                if file_path.startswith(prefix) and "/" not in file_path[len(prefix) :]:
+                    nodes[file_path] = {"type": "file", "size": len(content)}
+            for folder in self.folders:
+                if folder.startswith(prefix) and "/" not in folder[len(prefix) :]:
+                    nodes[folder] = {"type": "folder", "size": 0}
+        return [
+            {
+                "name": full_path[len(prefix) :],
+                "full_path": full_path,
+                "type": node["type"],
+                "size": node["size"],
+            }
+            for full_path, node in sorted(nodes.items())
+        ]
+
+    def copy(self, src_path, dst_path):
+        """Copies a file, or a folder and everything in it
+
+        Returns:
+            bool: Whether src_path exists
+        """
+        with self.lock:
+            copies = {
+                dst_path + path[len(src_path) :]: content
+                for path, content in self.files.items()
+                if path == src_path or path.startswith(src_path + "/")
+            }
+            is_folder = src_path in self.folders
+        if is_folder:
+            with self.lock:
+                self.folders.add(dst_path)
+        for path, content in copies.items():
+            self.write_file(path, content)
+        return bool(copies) or is_folder
+
+    def extract(self, zip_path, dst_path):
+        """Extracts a zip archive into a folder
+
+        Returns:
+            bool: Whether zip_path is a readable archive
+        """
+        content = self.files.get(zip_path)
+        if content is None or not zipfile.is_zipfile(io.BytesIO(content)):
+            return False
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            for member in archive.infolist():
+                if not member.is_dir():
+                    self.write_file(
+                        f"{dst_path}/{member.filename}", archive.read(member)
+                    )
+        return True
+
+    def create_solution(self, content_folder, output_folder):
+        """Packages a folder into an .ibsolution named after its package.json
+
+        Returns:
+            str: Path of the created .ibsolution, or None if the folder has no package.json
+        """
+        package_json = self.files.get(f"{content_folder}/package.json")
+        if package_json is None:
+            return None
+        package = json.loads(package_json)
+        prefix = content_folder + "/"
+        with self.lock:
+            members = {
+                path[len(prefix) :]: content
+                for path, content in self.files.items()
+                if path.startswith(prefix)
+            }
+        package_json = members.pop("package.json")
+        solution_path = (
+            f"{output_folder}/{package['name']}-{package['version']}.ibsolution"
+        )
+        self.write_file(solution_path, make_ibsolution(package, members))
+        return solution_path
+
+
+def _endpoint(path):
+    # Groups requests by API rather than by file
+    for prefix in [
+        "/api/v2/files/",
+        _MARKETPLACE_PREFIX,
+        "/api/v1/flow_binary/compile/",
+    ]:
+        if path.startswith(prefix) and path not in [
+            "/api/v2/files/copy",
+            "/api/v2/files/extract",
+        ]:
+            return prefix + "..."
+    return path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.stand_in.lock:
+            self.stand_in.bytes_received += len(body)
+        self._throttle(len(body))
+        return body
+
+    def _throttle(self, size):
+        if self.stand_in.bandwidth and size:
+            time.sleep(size / self.stand_in.bandwidth)
+
+    def _send(self, status, body=b"", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        sent = 0 if self.command == "HEAD" else len(body)
+        with self.stand_in.lock:
+            self.stand_in.bytes_sent += sent
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        # Throttle the body after the headers, as a slow link would, so clients see it as transfer time
+        for start in range(0, sent, _SEND_CHUNK_SIZE):
+            chunk = body[start : start + _SEND_CHUNK_SIZE]
+            self._throttle(len(chunk))
+            self.wfile.write(chunk)
+
+    def _handle(self):
+        stand_in = self.stand_in
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self._read_body()
+
+        with stand_in.lock:
+            stand_in.requests.append((self.command, path))
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+
+        if self.headers.get("Authorization") != f"Bearer {stand_in.api_token}":
+            return self._send(401, {"status": "ERROR", "msg": "Unauthorized"})
+
+        if path == "/api/v1/jobs/status":
+            state = stand_in.job_state(query.get("job_id"))
+            if state is None:
+                return self._send(404, {"status": "ERROR", "msg": "Unknown job"})
+            return self._send(200, {"status": "OK", "state": state})
+
+        if path == "/api/v1/marketplace/publish":
+            return self._publish(json.loads(body))
+
+        if path == "/api/v1/solution/create":
+            args = json.loads(body)
+            if not stand_in.create_solution(
+                args["content_folder"], args["output_folder"]
+            ):
+                return self._send(400, {"status": "ERROR", "msg": "No package.json"})
+            return self._send(200, {"status": "OK"})
+
+        if path.startswith("/api/v1/flow_binary/compile/"):
+            args = json.loads(body)
+            flow_path = f"{args['flow_project_root']}/{args['settings']['flow_file']}"
+            if flow_path not in stand_in.files:
+                return self._send(404, {"status": "ERROR", "msg": "Flow not found"})
+            stand_in.write_file(
+                args["predefined_binary_path"], b"binary:" + stand_in.files[flow_path]
+            )
+            return self._send(
+                200, {"status": "OK", "data": {"job_id": stand_in.new_job()}}
+            )
+
+        if path == "/api/v2/solutions/deployed":
+            stand_in.deployed.append(json.loads(body)["solution_path"])
+            return self._send(200, {"job_id": stand_in.new_job()})
+
+        if path.startswith(_MARKETPLACE_PREFIX) and path.endswith("/copy"):
+            name, version = path[len(_MARKETPLACE_PREFIX) :].split("/")[:2]
+            content = stand_in.marketplace.get((name, version))
+            if content is None:
+                return self._send(404, {"status": "ERROR", "msg": "Unknown package"})
+            stand_in.write_file(json.loads(body)["new_full_path"], content)
+            return self._send(200, {"job_id": stand_in.new_job()})
+
+        if path == "/api/v2/files/copy":
+            args = json.loads(body)
+            if not stand_in.copy(args["src_path"], args["dst_path"]):
+                return self._send(404, {"status": "ERROR", "msg": "Not found"})
+            return self._send(202, {"job_id": stand_in.new_job()})
+
+        if path == "/api/v2/files/extract":
+            args = json.loads(body)
+            if not stand_in.extract(args["src_path"], args["dst_path"]):
+                return self._send(400, {"status": "ERROR", "msg": "Not an archive"})
+            return self._send(202, {"job_id": stand_in.new_job()})
+
+        if path.startswith("/api/v2/files/"):
+            return self._files(path[len("/api/v2/files/") :], query, body)
+
+        return self._send(404, {"status": "ERROR", "msg": f"Unknown endpoint {path}"})
+
+    def _publish(self, args):
+        stand_in = self.stand_in
+        content = stand_in.files.get(args["ibsolution_path"])
+        if content is None:
+            return self._send(404, {"status": "ERROR", "msg": "Not found"})
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            package = json.loads(archive.read("package.json"))
+        stand_in.publish(package["name"], package["version"], content)
+        return self._send(200, {"status": "OK", "job_id": stand_in.new_job()})
+
+    def _files(self, file_path, query, body):
+        stand_in = self.stand_in
+        content = stand_in.files.get(file_path)
+        is_folder = file_path in stand_in.folders
+
+        if self.command in ["GET", "HEAD"]:
+            if query.get("expect-node-type") == "folder" and self.command == "GET":
+                if not is_folder:
+                    return self._send(404, {"status": "ERROR", "msg": "Not found"})
+                nodes = stand_in.list_folder(file_path)
+                start = int(query.get("start-token", 0))
+                end = start + stand_in.page_size if stand_in.page_size else len(nodes)
+                return self._send(
+                    200,
+                    {
+                        "nodes": nodes[start:end],
+                        "has_more": end < len(nodes),
+                        "next_page_token": str(end) if end < len(nodes) else None,
+                    },
+                )
+            if content is None:
+                if is_folder and self.command == "HEAD":
+                    return self._send(200)
+                return self._send(404, {"status": "ERROR", "msg": "Not found"})
+            headers = {"Last-Modified": stand_in.modified[file_path]}
+            byte_range = self.headers.get("Range")
+            if byte_range and stand_in.supports_range and self.command == "GET":
+                start, _, end = byte_range[len("bytes=") :].partition("-")
+                if not start:
+                    start, end = max(0, len(content) - int(end)), len(content) - 1
+                start, end = int(start), min(
+                    int(end or len(content) - 1), len(content) - 1
+                )
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+                return self._send(206, content[start : end + 1], headers)
+            return self._send(200, content, headers)
+
+        if self.command == "PUT":
+            stand_in.write_file(file_path, body)
+            return self._send(204)
+
+        if self.command == "PATCH":
+            with stand_in.lock:
+                kept = (
+                    stand_in.patch_failures.pop(0) if stand_in.patch_failures else None
+                )
+            if kept is not None:
+                body = body[:kept]
+            if self.headers.get("IB-Cursor") == "0" or content is None:
+                stand_in.write_file(file_path, body)
+            else:
+                stand_in.write_file(file_path, content + body)
+            return self._send(204 if kept is None else 503)
+
+        if self.command == "DELETE":
+            with stand_in.lock:
+                for path in list(stand_in.files):
+                    if path == file_path or path.startswith(file_path + "/"):
+                        stand_in.files.pop(path)
+                        stand_in.modified.pop(path)
+                for path in list(stand_in.folders):
+                    if path == file_path or path.startswith(file_path + "/"):
+                        stand_in.folders.discard(path)
+            return self._send(202, {"job_id": stand_in.new_job()})
+
+        if self.command == "POST":
+            args = json.loads(body)
+            with stand_in.lock:
+                stand_in.folders.add(f"{file_path}/{args['name']}")
+            return self._send(200, {"status": "OK"})
+
+        return self._send(405)
+
+    do_GET = do_HEAD = do_PUT = do_PATCH = do_DELETE = do_POST = _handle
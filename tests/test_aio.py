@@ -0,0 +1,251 @@
+"""Collection of unit tests for the asyncio helpers, run against a local IB stand-in"""
+
+import asyncio
+import contextlib
+import json
+import time
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from ib_cicd import aio, ib_helpers
+from ib_cicd.ib_helpers import PollingPolicy, set_run_deadline
+from tests.ib_stand_in import IBStandIn
+
+
+@pytest.fixture
+def source_env():
+    """Fixture for a running IB stand-in acting as the source environment
+
+    Yields:
+        IBStandIn: Started stand-in server
+    """
+    with IBStandIn(api_token="source-token") as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def target_env():
+    """Fixture for a running IB stand-in acting as the target environment
+
+    Yields:
+        IBStandIn: Started stand-in server
+    """
+    with IBStandIn(api_token="target-token") as stand_in:
+        yield stand_in
+
+
+def run(coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await aio.close_async_ib_clients()
+
+    return asyncio.run(run_and_close())
+
+
+def test_upload_and_read_file(source_env):
+    # Arrange
+    data = b"0123456789" * 1000
+
+    # Act
+    async def round_trip():
+        client = aio.get_async_ib_client(source_env.host, source_env.api_token)
+        await client.upload_chunks("space/fs/Instabase Drive/data.bin", data, 3000)
+        return await aio.read_file_through_api(
+            source_env.host, source_env.api_token, "space/fs/Instabase Drive/data.bin"
+        )
+
+    resp = run(round_trip())
+
+    # Assert
+    assert resp.status_code == 200
+    assert resp.content == data
+    assert [method for method, _ in source_env.requests] == ["PATCH"] * 4 + ["GET"]
+
+
+def test_upload_retries_failed_part_from_remote_size(source_env):
+    # Arrange
+    data = bytes(range(256)) * 12
+    path = "space/fs/Instabase Drive/data.bin"
+    retry_policy = {"upload_part": PollingPolicy(initial_interval=0.01, timeout=5)}
+    # Second part fails after 400 of its bytes were written
+    source_env.patch_failures = [None, 400]
+
+    # Act
+    async def upload():
+        client = aio.get_async_ib_client(source_env.host, source_env.api_token)
+        await client.upload_chunks(path, data, 1000)
+
+    with mock.patch.dict(ib_helpers._polling_policies, retry_policy):
+        run(upload())
+
+    # Assert
+    assert source_env.files[path] == data
+    methods = [method for method, _ in source_env.requests]
+    assert methods == ["PATCH", "PATCH", "HEAD", "PATCH", "PATCH", "PATCH"]
+
+
+def test_upload_fails_when_a_middle_part_keeps_failing(source_env):
+    # Arrange
+    retry_policy = {"upload_part": PollingPolicy(initial_interval=0.01, timeout=0.1)}
+    source_env.patch_failures = [None] + [0] * 100
+
+    async def upload():
+        client = aio.get_async_ib_client(source_env.host, source_env.api_token)
+        await client.upload_chunks(
+            "space/fs/Instabase Drive/data.bin", b"x" * 3000, 1000
+        )
+
+    # Act / Assert
+    with mock.patch.dict(ib_helpers._polling_policies, retry_policy):
+        with pytest.raises(TimeoutError, match="part 2"):
+            run(upload())
+
+
+def test_wait_until_job_finishes(source_env):
+    # Arrange
+    job_id = source_env.new_job("DONE")
+
+    # Act
+    finished = run(
+        aio.wait_until_job_finishes(
+            source_env.host, job_id, "job", source_env.api_token
+        )
+    )
+
+    # Assert
+    assert finished
+
+
+def test_run_deadline_stops_polling(source_env):
+    # Arrange
+    source_env.job_duration = 10
+    job_id = source_env.new_job()
+    set_run_deadline(0.3)
+    start_time = time.monotonic()
+
+    # Act / Assert
+    try:
+        with pytest.raises(TimeoutError, match="Run deadline passed"):
+            run(
+                aio.wait_until_job_finishes(
+                    source_env.host, job_id, "flow", source_env.api_token
+                )
+            )
+    finally:
+        set_run_deadline(None)
+    assert time.monotonic() - start_time < 1
+
+
+def test_stream_writes_tee_off_the_event_loop(source_env, target_env):
+    # Arrange
+    data = b"x" * 4000
+    source_env.write_file("source/data.bin", data)
+    written = []
+
+    class SlowDisk:
+        def write(self, part):
+            time.sleep(0.2)
+            written.append(part)
+
+    # Act
+    async def stream_while_ticking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await aio.stream_file_between_envs(
+            source_env.host,
+            source_env.api_token,
+            "source/data.bin",
+            target_env.host,
+            target_env.api_token,
+            "target/data.bin",
+            part_size=1000,
+            tee=SlowDisk(),
+        )
+        ticker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await ticker
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        return ticks, pending
+
+    ticks, pending = run(stream_while_ticking())
+
+    # Assert
+    assert b"".join(written) == data
+    assert target_env.files["target/data.bin"] == data
+    # The loop kept running through the 0.8s spent in tee writes
+    assert ticks >= 40
+    assert not pending
+
+
+def test_download_dependencies_from_dev_and_upload_to_prod(source_env, target_env):
+    # Arrange
+    expected = {}
+    for name, version in [("model_util", "1.1.3"), ("ib_signature", "0.0.2")]:
+        expected[name] = source_env.add_marketplace_package(name, version)
+    dependency_dict = {
+        "model_util": "1.1.3",
+        "missing_package": "0.0.1",
+        "ib_signature": "0.0.2",
+    }
+
+    # Act
+    uploaded_paths = run(
+        aio.download_dependencies_from_dev_and_upload_to_prod(
+            source_env.host,
+            target_env.host,
+            source_env.api_token,
+            target_env.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+    )
+
+    # Assert
+    assert uploaded_paths == [
+        "target/target_dependencies/model_util-1.1.3.ibsolution",
+        "target/target_dependencies/ib_signature-0.0.2.ibsolution",
+    ]
+    assert target_env.files[uploaded_paths[0]] == expected["model_util"]
+    assert target_env.files[uploaded_paths[1]] == expected["ib_signature"]
+    manifest = json.loads(target_env.files[uploaded_paths[0] + ".manifest.json"])
+    assert manifest["size"] == len(expected["model_util"])
+
+
+def test_download_dependencies_leaves_out_cancelled_packages(source_env, target_env):
+    # Arrange
+    async def migrate(source_ib_host, target_ib_host, package_name, *args, **kwargs):
+        if package_name == "cancelled":
+            raise asyncio.CancelledError()
+        return None, f"target/target_dependencies/{package_name}.ibsolution"
+
+    # Act
+    with mock.patch.object(
+        aio, "copy_marketplace_package_and_move_to_new_env", migrate
+    ):
+        uploaded_paths = run(
+            aio.download_dependencies_from_dev_and_upload_to_prod(
+                source_env.host,
+                target_env.host,
+                source_env.api_token,
+                target_env.api_token,
+                "source",
+                "target",
+                {"cancelled": "1.0.0", "uploaded": "1.0.0"},
+            )
+        )
+
+    # Assert
+    assert uploaded_paths == ["target/target_dependencies/uploaded.ibsolution"]
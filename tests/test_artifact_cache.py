@@ -0,0 +1,89 @@
+"""Collection of unit tests for the artifact cache"""
+
+import os
+import hashlib
+from ib_cicd.artifact_cache import ArtifactCache, parse_ibsolution_name
+
+
+def test_parse_ibsolution_name():
+    assert parse_ibsolution_name("path/to/model_util-1.1.3.ibsolution") == (
+        "model_util",
+        "1.1.3",
+    )
+    assert parse_ibsolution_name("model-v2-0.0.1.ibsolution") == ("model-v2", "0.0.1")
+    assert parse_ibsolution_name("package.json") == (None, None)
+
+
+def test_cache_round_trip(tmp_path):
+    # Arrange
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    content = b"ibsolution bytes" * 100
+
+    # Act
+    with cache.writer("model_util", "1.1.3") as writer:
+        writer.write(content[:800])
+        writer.write(content[800:])
+
+    # Assert
+    cached_path = ArtifactCache(str(tmp_path / "cache")).get("model_util", "1.1.3")
+    with open(cached_path, "rb") as fp:
+        assert fp.read() == content
+    assert os.path.basename(cached_path) == hashlib.sha256(content).hexdigest()
+    assert cache.get("model_util", "1.1.4") is None
+
+
+def test_cache_discards_failed_writes(tmp_path):
+    # Arrange
+    cache = ArtifactCache(str(tmp_path))
+
+    # Act
+    try:
+        with cache.writer("model_util", "1.1.3") as writer:
+            writer.write(b"partial")
+            raise IOError("transfer failed")
+    except IOError:
+        pass
+
+    # Assert
+    assert cache.get("model_util", "1.1.3") is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".partial")]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    # Arrange
+    cache = ArtifactCache(str(tmp_path), max_bytes=250)
+    for version in ["0.0.1", "0.0.2"]:
+        with cache.writer("model", version) as writer:
+            writer.write(version.encode() * 20)
+    old_access_time = os.path.getmtime(cache.get("model", "0.0.1")) - 100
+    os.utime(cache.get("model", "0.0.2"), (old_access_time, old_access_time))
+
+    # Act
+    with cache.writer("model", "0.0.3") as writer:
+        writer.write(b"0.0.3" * 20)
+
+    # Assert
+    assert cache.get("model", "0.0.1") is not None
+    assert cache.get("model", "0.0.2") is None
+    assert cache.get("model", "0.0.3") is not None
+
+
+def test_cache_keeps_checked_out_artifacts(tmp_path):
+    # Arrange
+    cache = ArtifactCache(str(tmp_path), max_bytes=150)
+    with cache.writer("model", "0.0.1") as writer:
+        writer.write(b"0.0.1" * 20)
+    checked_out_path = cache.checkout("model", "0.0.1")
+
+    # Act
+    with cache.writer("model", "0.0.2") as writer:
+        writer.write(b"0.0.2" * 20)
+    kept = os.path.exists(checked_out_path)
+    cache.release(checked_out_path)
+    with cache.writer("model", "0.0.3") as writer:
+        writer.write(b"0.0.3" * 20)
+
+    # Assert
+    assert kept
+    assert cache.get("model", "0.0.1") is None
+    assert cache.get("model", "0.0.3") is not None
@@ -1,12 +1,35 @@
 """Collection of unit tests for IB Helpers"""
 
+import io
+import itertools
 import json
+import os
+import threading
+import time
+import zipfile
+import pytest
 from unittest import mock
 from requests.models import Response
-from ib_cicd.ib_helpers import upload_file, compile_solution
+from ib_cicd.ib_helpers import (
+    upload_file,
+    compile_solution,
+    get_ib_client,
+    list_folder,
+    publish_many,
+    read_member_from_remote_ibsolution,
+    stream_file_between_envs,
+    wait_until_job_finishes,
+    PollingPolicy,
+    get_polling_policy,
+    PartSizer,
+    set_run_deadline,
+)
+from ib_cicd import ib_helpers
+from tests.ib_stand_in import IBStandIn, make_ibsolution
 from tests.fixtures import (
     ib_host_url,
     ib_api_token,
+    ib_clients,
     _MOCK_IB_HOST_URL,
     _MOCK_AUTH_HEADERS,
 )
@@ -18,17 +41,19 @@ def test_compile_solution(mock_requests, ib_host_url, ib_api_token):
     mocked_response = mock.Mock(spec=Response)
     mocked_response.status_code = 200
     mocked_response.content = json.dumps({"status": "OK"})
-    mock_requests.post.return_value = mocked_response
+    mock_session = mock_requests.Session.return_value
+    mock_session.request.return_value = mocked_response
 
     solution_path = "Test Space/Test Subspace/fs/Instabase Drive/My Solution"
     relative_flow_path = "Path to flow/flow.ibflow"
     compile_solution(ib_host_url, ib_api_token, solution_path, relative_flow_path)
 
-    mock_requests.post.assert_called_with(
+    mock_session.request.assert_called_with(
+        "POST",
         "https://instbase-fake-testing-url.com/api/v1/flow_binary/compile/Test%20Space/Test%20Subspace/fs/Instabase%20Drive/My%20Solution",
-        headers={"Authorization": "Bearer fake-testing-token"},
         data='{"binary_type": "Single Flow", "flow_project_root": "Test Space/Test Subspace/fs/Instabase Drive/My Solution/Path to flow", "predefined_binary_path": "Test Space/Test Subspace/fs/Instabase Drive/My Solution/Path to flow/flow.ibflowbin", "settings": {"flow_file": "flow.ibflow", "is_flow_v3": true}}',
         verify=False,
+        timeout=(10, 120),
     )
 
 
@@ -37,7 +62,8 @@ def test_upload_file(mock_requests, ib_host_url, ib_api_token):
     # Arrange
     mocked_response = mock.Mock(spec=Response)
     mocked_response.status_code = 204
-    mock_requests.put.return_value = mocked_response
+    mock_session = mock_requests.Session.return_value
+    mock_session.request.return_value = mocked_response
     upload_file_path = "Test Space/Test Subspace/fs/Instabase Drive"
     upload_file_data = "This is my test file data"
 
@@ -47,10 +73,444 @@ def test_upload_file(mock_requests, ib_host_url, ib_api_token):
     )
 
     # Assert
-    mock_requests.put.assert_called_with(
+    mock_session.headers.update.assert_called_with(_MOCK_AUTH_HEADERS)
+    mock_session.request.assert_called_with(
+        "PUT",
         f"{_MOCK_IB_HOST_URL}/api/v2/files/{upload_file_path}",
-        headers=_MOCK_AUTH_HEADERS,
         data=upload_file_data,
         verify=False,
+        timeout=(10, 600),
     )
     assert file_upload.status_code == 204
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_ib_client_is_reused_per_environment(mock_requests, ib_host_url, ib_api_token):
+    # Arrange
+    mocked_response = mock.Mock(spec=Response)
+    mocked_response.status_code = 204
+    mock_requests.Session.return_value.request.return_value = mocked_response
+
+    # Act
+    upload_file(ib_host_url, ib_api_token, "path/one", b"1")
+    upload_file(ib_host_url, ib_api_token, "path/two", b"2")
+
+    # Assert
+    assert mock_requests.Session.call_count == 1
+    assert get_ib_client(ib_host_url, ib_api_token) is get_ib_client(
+        ib_host_url, ib_api_token
+    )
+    assert get_ib_client(ib_host_url, "other-token") is not get_ib_client(
+        ib_host_url, ib_api_token
+    )
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_stream_file_between_envs(mock_requests, ib_host_url, ib_api_token):
+    # Arrange
+    file_data = bytes(range(256)) * 10
+    download_response = mock.MagicMock(spec=Response)
+    download_response.status_code = 200
+    download_response.__enter__.return_value = download_response
+    download_response.iter_content.return_value = iter(
+        [file_data[i : i + 100] for i in range(0, len(file_data), 100)]
+    )
+    upload_response = mock.Mock(spec=Response)
+    upload_response.status_code = 204
+    uploaded_parts = []
+
+    def request(method, url, **kwargs):
+        if method == "GET":
+            return download_response
+        uploaded_parts.append((kwargs["headers"]["IB-Cursor"], kwargs["data"]))
+        return upload_response
+
+    mock_requests.Session.return_value.request.side_effect = request
+
+    # Act
+    resp = stream_file_between_envs(
+        ib_host_url,
+        ib_api_token,
+        "source/model-0.0.1.ibsolution",
+        ib_host_url,
+        "target-token",
+        "target/model-0.0.1.ibsolution",
+        part_size=1000,
+    )
+
+    # Assert
+    assert resp.status_code == 204
+    assert [cursor for cursor, _ in uploaded_parts] == ["0", "-1", "-1"]
+    assert [len(part) for _, part in uploaded_parts] == [1000, 1000, 560]
+    assert b"".join(part for _, part in uploaded_parts) == file_data
+
+
+def _job_status_response(state, status="OK"):
+    response = mock.Mock(spec=Response)
+    response.status_code = 200
+    response.content = json.dumps({"status": status, "state": state})
+    return response
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_wait_until_job_finishes_backs_off(mock_requests, ib_host_url, ib_api_token):
+    # Arrange
+    responses = iter(["RUNNING", "RUNNING", "RUNNING", "DONE"])
+    poll_times = []
+
+    def request(*args, **kwargs):
+        poll_times.append(time.monotonic())
+        return _job_status_response(next(responses))
+
+    mock_requests.Session.return_value.request.side_effect = request
+    policy = PollingPolicy(initial_interval=0.1, max_interval=0.3, jitter=0)
+
+    # Act
+    finished = wait_until_job_finishes(
+        ib_host_url, "job-id", "job", ib_api_token, polling_policy=policy
+    )
+
+    # Assert
+    assert finished
+    gaps = [later - earlier for earlier, later in zip(poll_times, poll_times[1:])]
+    assert gaps == pytest.approx([0.1, 0.2, 0.3], abs=0.05)
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_wait_until_job_finishes_times_out(mock_requests, ib_host_url, ib_api_token):
+    # Arrange
+    mock_requests.Session.return_value.request.side_effect = (
+        lambda *args, **kwargs: _job_status_response("RUNNING")
+    )
+    policy = PollingPolicy(initial_interval=0.01, max_interval=0.01, timeout=0.05)
+
+    # Act / Assert
+    with pytest.raises(TimeoutError, match="job-id"):
+        wait_until_job_finishes(
+            ib_host_url, "job-id", "job", ib_api_token, polling_policy=policy
+        )
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_wait_until_job_finishes_reports_failed_job_without_timeout(
+    mock_requests, ib_host_url, ib_api_token
+):
+    # Arrange
+    responses = iter(
+        [_job_status_response("RUNNING"), _job_status_response("FAILED", "FAILURE")]
+    )
+    mock_requests.Session.return_value.request.side_effect = (
+        lambda *args, **kwargs: next(responses)
+    )
+
+    # Act
+    finished = wait_until_job_finishes(
+        ib_host_url,
+        "job-id",
+        "job",
+        ib_api_token,
+        polling_policy=get_polling_policy("job").with_overrides(initial_interval=0.01),
+    )
+
+    # Assert
+    assert finished is False
+    assert get_polling_policy("job").timeout is None
+    assert get_polling_policy("async").timeout is None
+    assert get_polling_policy("flow").timeout is None
+
+
+def test_run_deadline_stops_polling():
+    # Arrange
+    with IBStandIn(job_duration=10) as stand_in:
+        job_id = stand_in.new_job()
+        set_run_deadline(0.3)
+        start_time = time.monotonic()
+
+        # Act / Assert
+        try:
+            with pytest.raises(TimeoutError, match="Run deadline passed"):
+                wait_until_job_finishes(
+                    stand_in.host, job_id, "flow", stand_in.api_token
+                )
+        finally:
+            set_run_deadline(None)
+    assert time.monotonic() - start_time < 1
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_request_fails_when_deadline_passes_while_clamping(
+    mock_requests, ib_host_url, ib_api_token
+):
+    # Arrange
+    client = get_ib_client(ib_host_url, ib_api_token)
+    # The deadline is still ahead when the connect timeout is clamped and has passed by the read timeout
+    clock = itertools.chain([99.0], itertools.repeat(101.0))
+
+    # Act / Assert
+    with (
+        mock.patch.object(ib_helpers, "_run_deadline", 100.0),
+        mock.patch.object(ib_helpers.time, "monotonic", lambda: next(clock)),
+    ):
+        with pytest.raises(TimeoutError, match="Run deadline passed before GET"):
+            client.get(f"{ib_host_url}/api/v1/jobs/status")
+    mock_requests.Session.return_value.request.assert_not_called()
+
+
+@mock.patch("ib_cicd.ib_helpers.requests")
+def test_list_folder_pages_and_caches_until_written(
+    mock_requests, ib_host_url, ib_api_token
+):
+    # Arrange
+    folder = "space/fs/Instabase Drive/compiled"
+    pages = [
+        {
+            "nodes": [
+                {"full_path": f"{folder}/solution-1.10.0.ibsolution"},
+                {"full_path": f"{folder}/solution-1.9.0.ibsolution"},
+            ],
+            "has_more": True,
+            "next_page_token": "page-2",
+        },
+        {
+            "nodes": [
+                {"full_path": f"{folder}/solution-1.2.0.ibsolution"},
+                {"full_path": f"{folder}/notes.txt"},
+            ],
+            "has_more": False,
+        },
+    ]
+    requests_sent = []
+
+    def request(method, url, **kwargs):
+        requests_sent.append((method, kwargs.get("params")))
+        resp = mock.Mock(spec=Response)
+        resp.status_code = 204 if method == "PUT" else 200
+        page = 1 if (kwargs.get("params") or {}).get("start-token") else 0
+        resp.content = json.dumps(pages[page])
+        return resp
+
+    mock_requests.Session.return_value.request.side_effect = request
+
+    # Act
+    listing = list_folder(ib_host_url, ib_api_token, folder)
+    cached_listing = list_folder(ib_host_url, ib_api_token, folder)
+    upload_file(ib_host_url, ib_api_token, f"{folder}/solution-2.0.0.ibsolution", b"")
+    relisted = list_folder(ib_host_url, ib_api_token, folder)
+
+    # Assert
+    assert listing.latest_ibsolution_path() == f"{folder}/solution-1.10.0.ibsolution"
+    assert len(listing.nodes) == 4
+    assert cached_listing is listing
+    assert relisted is not listing
+    assert [method for method, _ in requests_sent] == [
+        "GET",
+        "GET",
+        "PUT",
+        "GET",
+        "GET",
+    ]
+    assert requests_sent[1][1] == {
+        "expect-node-type": "folder",
+        "start-token": "page-2",
+    }
+
+
+@pytest.mark.parametrize("supports_range", [True, False])
+def test_read_member_from_remote_ibsolution(supports_range):
+    # Arrange
+    package = {"name": "my_solution", "version": "0.0.1"}
+    path = "space/fs/Instabase Drive/my_solution-0.0.1.ibsolution"
+    solution = make_ibsolution(package, {"flow.ibflowbin": os.urandom(500000)})
+
+    with IBStandIn(supports_range=supports_range) as stand_in:
+        stand_in.write_file(path, solution)
+
+        # Act
+        package_json = read_member_from_remote_ibsolution(
+            stand_in.host, stand_in.api_token, path, "package.json"
+        )
+
+    # Assert
+    assert json.loads(package_json) == package
+    stats = stand_in.stats()
+    assert stats["endpoints"] == {"GET /api/v2/files/...": 2 if supports_range else 1}
+    if supports_range:
+        assert stats["bytes_sent"] < len(solution) / 2
+
+
+def test_upload_directory_as_zip_streams_parts(tmp_path):
+    # Arrange
+    (tmp_path / "flow").mkdir()
+    (tmp_path / "package.json").write_text('{"name": "my_solution"}')
+    (tmp_path / "flow" / "flow.ibflow").write_bytes(b"flow " * 10000)
+    (tmp_path / "icon.png").write_bytes(os.urandom(5000))
+    path = "space/fs/Instabase Drive/my_solution.zip"
+
+    with IBStandIn() as stand_in:
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+
+        # Act
+        client.upload_directory_as_zip(path, str(tmp_path), part_size=2000)
+
+    # Assert
+    assert stand_in.stats()["endpoints"]["PATCH /api/v2/files/..."] > 1
+    with zipfile.ZipFile(io.BytesIO(stand_in.files[path])) as archive:
+        assert archive.namelist() == [
+            "icon.png",
+            "package.json",
+            "flow/",
+            "flow/flow.ibflow",
+        ]
+        assert archive.read("flow/flow.ibflow") == b"flow " * 10000
+        assert archive.getinfo("icon.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("package.json").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_upload_local_file_retries_failed_part_from_remote_size(tmp_path):
+    # Arrange
+    content = os.urandom(3000)
+    local_path = tmp_path / "model.ibsolution"
+    local_path.write_bytes(content)
+    path = "space/fs/Instabase Drive/model.ibsolution"
+    retry_policy = {"upload_part": PollingPolicy(initial_interval=0.01, timeout=5)}
+
+    with (
+        IBStandIn() as stand_in,
+        mock.patch.dict(ib_helpers._polling_policies, retry_policy),
+    ):
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+        # Second part fails after 400 of its bytes were written
+        stand_in.patch_failures = [None, 400]
+
+        # Act
+        client.upload_local_file(path, str(local_path), part_size=1000)
+
+    # Assert
+    assert stand_in.files[path] == content
+    stats = stand_in.stats()
+    assert stats["endpoints"]["PATCH /api/v2/files/..."] == 4
+    assert stats["endpoints"]["HEAD /api/v2/files/..."] == 1
+    # Only the 600 bytes that didn't arrive are sent again
+    assert stats["bytes_received"] == 3600
+
+
+def test_upload_local_file_resumes_from_checkpoint(tmp_path):
+    # Arrange
+    content = os.urandom(3000)
+    local_path = tmp_path / "model.ibsolution"
+    local_path.write_bytes(content)
+    checkpoint_dir = tmp_path / "checkpoints"
+    path = "space/fs/Instabase Drive/model.ibsolution"
+    no_retries = {"upload_part": PollingPolicy(timeout=0)}
+
+    with (
+        IBStandIn() as stand_in,
+        mock.patch.object(ib_helpers, "_upload_checkpoint_dir", str(checkpoint_dir)),
+    ):
+        checkpoint_dir.mkdir()
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+        stand_in.patch_failures = [None, 0]
+        with mock.patch.dict(ib_helpers._polling_policies, no_retries):
+            with pytest.raises(TimeoutError):
+                client.upload_local_file(path, str(local_path), part_size=1000)
+        stand_in.reset_stats()
+
+        # Act
+        client.upload_local_file(path, str(local_path), part_size=1000)
+
+    # Assert
+    assert stand_in.files[path] == content
+    assert stand_in.stats()["bytes_received"] == 2000
+    assert list(checkpoint_dir.iterdir()) == []
+
+
+def test_part_sizer_adapts_within_bounds():
+    # Arrange
+    sizer = PartSizer(
+        initial_size=4000, min_size=1000, max_size=10000, target_seconds=1
+    )
+
+    # Act
+    sizes = [sizer.next_size()]
+    for seconds in [0.1, 0.1, 0.1, 4, 100]:
+        sizer.record(sizer.next_size(), seconds)
+        sizes.append(sizer.next_size())
+
+    # Assert
+    # At most doubles or halves per part, and stays within the bounds
+    assert sizes == [4000, 8000, 10000, 10000, 5000, 2500]
+    sizer.record(2500, 100)
+    sizer.record(1250, 100)
+    assert sizer.next_size() == 1000
+
+
+@pytest.mark.parametrize("source", ["bytes", "path", "file"])
+def test_upload_chunks_accepts_bytes_paths_and_files(tmp_path, source):
+    # Arrange
+    content = os.urandom(5000)
+    local_path = tmp_path / "data.bin"
+    local_path.write_bytes(content)
+    path = "space/fs/Instabase Drive/data.bin"
+
+    with IBStandIn() as stand_in:
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+
+        # Act
+        if source == "bytes":
+            client.upload_chunks(path, content, part_size=2000)
+        elif source == "path":
+            client.upload_chunks(path, str(local_path), part_size=2000)
+        else:
+            with open(local_path, "rb") as f:
+                client.upload_chunks(path, f, part_size=2000)
+
+    # Assert
+    assert stand_in.files[path] == content
+    assert stand_in.stats()["endpoints"]["PATCH /api/v2/files/..."] == 3
+
+
+def test_job_poller_tracks_jobs_on_one_thread():
+    # Arrange
+    policy = PollingPolicy(initial_interval=0.1, max_interval=0.1, jitter=0)
+
+    with IBStandIn(job_duration=0.3) as stand_in:
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+        job_ids = [stand_in.new_job() for _ in range(5)]
+
+        # Act
+        jobs = [client.track_job(job_id, "job", policy) for job_id in job_ids]
+        pollers = [
+            thread for thread in threading.enumerate() if thread.name == "ib-job-poller"
+        ]
+        results = [job.result(timeout=5) for job in jobs]
+        status_requests = stand_in.stats()["endpoints"]["GET /api/v1/jobs/status"]
+
+    # Assert
+    assert len(pollers) == 1
+    assert all(result["state"] == "DONE" for result in results)
+    # Every job is checked on each shared poll, about 4 polls in 0.3 seconds
+    assert status_requests <= len(job_ids) * 5
+
+
+def test_publish_many_tracks_jobs_concurrently():
+    # Arrange
+    paths = [f"space/fs/Instabase Drive/package_{i}-1.0.0.ibsolution" for i in range(6)]
+
+    with IBStandIn(job_duration=0.3) as stand_in:
+        for i, path in enumerate(paths[:-1]):
+            stand_in.write_file(
+                path, make_ibsolution({"name": f"package_{i}", "version": "1.0.0"})
+            )
+        start_time = time.monotonic()
+
+        # Act
+        results = publish_many(stand_in.host, stand_in.api_token, paths)
+        elapsed = time.monotonic() - start_time
+
+    # Assert
+    assert [result["path"] for result in results] == paths
+    assert all(result["succeeded"] for result in results[:-1])
+    assert not results[-1]["succeeded"]
+    assert "No job ID" in results[-1]["error"]
+    assert all(result["seconds"] >= 0.3 for result in results[:-1])
+    assert elapsed < 1.5
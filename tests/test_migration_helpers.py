@@ -1,11 +1,31 @@
 """Collection of unit tests for IB Helpers"""
 
-from unittest.mock import mock_open, patch, Mock
+import hashlib
+import io
+import json
+import pytest
+import threading
+import zipfile
+from unittest.mock import mock_open, patch, Mock, MagicMock
 from requests.models import Response
-from ib_cicd.migration_helpers import download_ibsolution
+from ib_cicd.migration_helpers import (
+    download_ibsolution,
+    download_dependencies_from_dev_and_upload_to_prod,
+    compile_and_package_ib_solution,
+    copy_marketplace_package_and_move_to_new_env,
+    check_if_file_exists_on_ib_env,
+    sync_directory_to_ib,
+    migrate_dependencies_transitively,
+    get_dependency_levels,
+    publish_dependencies_in_levels,
+    cache_dependencies_from_source,
+)
+from ib_cicd.artifact_cache import ArtifactCache
+from tests.ib_stand_in import IBStandIn
 from tests.fixtures import (
     ib_host_url,
     ib_api_token,
+    ib_clients,
     _MOCK_IB_HOST_URL,
     _MOCK_AUTH_HEADERS,
 )
@@ -15,42 +35,564 @@ from tests.fixtures import (
 def test_download_ibsolution(mock_requests, ib_host_url, ib_api_token):
     mocked_response = Mock(spec=Response)
     mocked_response.status_code = 200
-    mock_requests.get.return_value = mocked_response
+    mock_session = mock_requests.Session.return_value
+    mock_session.request.return_value = mocked_response
     solution_path = "Test Space/Test Subspace/fs/Instabase Drive/solution/dummy_solution-0.0.1.ibsolution"
 
     resp = download_ibsolution(ib_host_url, ib_api_token, solution_path)
 
-    mock_requests.get.assert_called_with(
+    mock_session.request.assert_called_with(
+        "GET",
         f"{_MOCK_IB_HOST_URL}/api/v2/files/{solution_path}",
-        headers=_MOCK_AUTH_HEADERS,
         verify=False,
+        timeout=(10, 600),
         params={"expect-node-type": "file"},
     )
     assert resp.status_code == 200
 
 
-@patch("ib_cicd.migration_helpers.os.remove")
 @patch("ib_cicd.migration_helpers.ZipFile")
 @patch("builtins.open", new_callable=mock_open)
 @patch("ib_cicd.ib_helpers.requests")
 def test_download_ibsolution_and_unzip(
-    mock_requests, mock_open, mock_zip, mock_remove, ib_host_url, ib_api_token
+    mock_requests, mock_open, mock_zip, ib_host_url, ib_api_token
 ):
     mocked_response = Mock(spec=Response)
     mocked_response.status_code = 200
-    mock_requests.get.return_value = mocked_response
+    mock_session = mock_requests.Session.return_value
+    mock_session.request.return_value = mocked_response
     solution_path = "Test Space/Test Subspace/fs/Instabase Drive/solution/dummy_solution-0.0.1.ibsolution"
 
     resp = download_ibsolution(ib_host_url, ib_api_token, solution_path, True, True)
 
-    mock_zip.assert_called_with("dummy_solution-0.0.1.zip", "r")
-
-    mock_remove.assert_called_with("dummy_solution-0.0.1.zip")
+    mock_zip.assert_called_with("dummy_solution-0.0.1.ibsolution", "r")
+    mock_open.assert_called_once_with("dummy_solution-0.0.1.ibsolution", "wb")
 
-    mock_requests.get.assert_called_with(
+    mock_session.request.assert_called_with(
+        "GET",
         f"{_MOCK_IB_HOST_URL}/api/v2/files/{solution_path}",
-        headers=_MOCK_AUTH_HEADERS,
         verify=False,
+        timeout=(10, 600),
         params={"expect-node-type": "file"},
     )
     assert resp.status_code == 200
+
+
+@patch("ib_cicd.ib_helpers.requests")
+def test_download_ibsolution_streams_to_disk(
+    mock_requests, ib_host_url, ib_api_token, tmp_path, monkeypatch
+):
+    # Arrange
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        zip_file.writestr("package.json", '{"name": "dummy_solution"}')
+    solution_bytes = zip_buffer.getvalue()
+
+    mocked_response = MagicMock(spec=Response)
+    mocked_response.status_code = 200
+    mocked_response.__enter__.return_value = mocked_response
+    mocked_response.iter_content.return_value = [
+        solution_bytes[i : i + 16] for i in range(0, len(solution_bytes), 16)
+    ]
+    mock_session = mock_requests.Session.return_value
+    mock_session.request.return_value = mocked_response
+    solution_path = "Test Space/Test Subspace/fs/Instabase Drive/solution/dummy_solution-0.0.1.ibsolution"
+    monkeypatch.chdir(tmp_path)
+
+    # Act
+    download_ibsolution(
+        ib_host_url, ib_api_token, solution_path, True, True, stream=True
+    )
+
+    # Assert
+    mock_session.request.assert_called_with(
+        "GET",
+        f"{_MOCK_IB_HOST_URL}/api/v2/files/{solution_path}",
+        verify=False,
+        timeout=(10, 600),
+        params={"expect-node-type": "file"},
+        stream=True,
+    )
+    assert (tmp_path / "dummy_solution-0.0.1.ibsolution").read_bytes() == solution_bytes
+    assert (tmp_path / "dummy_solution-0.0.1" / "package.json").exists()
+    assert not (tmp_path / "dummy_solution-0.0.1.zip").exists()
+
+
+@patch("ib_cicd.migration_helpers.create_folder_if_it_does_not_exists")
+@patch("ib_cicd.migration_helpers.copy_marketplace_package_and_move_to_new_env")
+def test_download_dependencies_migrates_concurrently_in_order(
+    mock_copy, mock_create_folder, ib_host_url, ib_api_token
+):
+    # Arrange
+    all_started = threading.Barrier(3, timeout=5)
+
+    def copy_package(source, target, name, version, *args, **kwargs):
+        # Every package must be in flight at the same time to get past the barrier
+        all_started.wait()
+        if name == "broken_package":
+            raise Exception("copy failed")
+        return None, f"target_dependencies/{name}-{version}.ibsolution"
+
+    mock_copy.side_effect = copy_package
+    dependency_dict = {
+        "model_util": "1.1.3",
+        "broken_package": "0.0.1",
+        "ib_signature": "0.0.2",
+    }
+
+    # Act
+    uploaded_paths = download_dependencies_from_dev_and_upload_to_prod(
+        ib_host_url,
+        ib_host_url,
+        ib_api_token,
+        ib_api_token,
+        "source",
+        "target",
+        dependency_dict,
+        max_workers=3,
+    )
+
+    # Assert
+    assert uploaded_paths == [
+        "target_dependencies/model_util-1.1.3.ibsolution",
+        "target_dependencies/ib_signature-0.0.2.ibsolution",
+    ]
+
+
+@patch("ib_cicd.ib_helpers.time.sleep")
+@patch("ib_cicd.ib_helpers.requests")
+def test_compile_and_package_waits_for_compile_job(
+    mock_requests, mock_sleep, ib_host_url, ib_api_token
+):
+    # Arrange
+    def response(status_code, content):
+        resp = Mock(spec=Response)
+        resp.status_code = status_code
+        resp.content = json.dumps(content)
+        resp.headers = {}
+        return resp
+
+    requests_sent = []
+
+    def request(method, url, **kwargs):
+        requests_sent.append((method, url.split("?")[0]))
+        if method == "HEAD":
+            return response(404, {})
+        if "flow_binary/compile" in url:
+            return response(200, {"status": "OK", "data": {"job_id": "compile-job"}})
+        if "jobs/status" in url:
+            return response(200, {"status": "OK", "state": "DONE"})
+        return response(200, {"status": "OK"})
+
+    mock_requests.Session.return_value.request.side_effect = request
+
+    # Act
+    compile_and_package_ib_solution(
+        ib_host_url, ib_api_token, "space/solution", "flow/flow.ibflow", "space/out"
+    )
+
+    # Assert
+    assert [method for method, _ in requests_sent] == ["HEAD", "POST", "GET", "POST"]
+    assert requests_sent[2][1] == f"{_MOCK_IB_HOST_URL}/api/v1/jobs/status"
+    assert requests_sent[3][1] == f"{_MOCK_IB_HOST_URL}/api/v1/solution/create"
+    mock_sleep.assert_not_called()
+
+
+@patch("ib_cicd.ib_helpers.requests")
+def test_copy_marketplace_package_uses_artifact_cache(
+    mock_requests, ib_host_url, ib_api_token, tmp_path
+):
+    # Arrange
+    cache = ArtifactCache(str(tmp_path))
+    with cache.writer("model_util", "1.1.3") as writer:
+        writer.write(b"cached ibsolution")
+
+    requests_sent = []
+
+    def request(method, url, **kwargs):
+        requests_sent.append((method, url, kwargs.get("data")))
+        resp = Mock(spec=Response)
+        resp.status_code = 404 if method in ["HEAD", "GET"] else 204
+        resp.headers = {}
+        resp.content = b""
+        return resp
+
+    mock_requests.Session.return_value.request.side_effect = request
+
+    # Act
+    _, uploaded_path = copy_marketplace_package_and_move_to_new_env(
+        "https://source-env.com",
+        ib_host_url,
+        "model_util",
+        "1.1.3",
+        "source-token",
+        ib_api_token,
+        "source_dependencies",
+        "target_dependencies",
+        artifact_cache=cache,
+    )
+
+    # Assert
+    assert uploaded_path == "target_dependencies/model_util-1.1.3.ibsolution"
+    assert [method for method, _, _ in requests_sent] == ["GET", "PATCH", "PUT"]
+    assert requests_sent[1][2] == b"cached ibsolution"
+    assert requests_sent[2][1].endswith("model_util-1.1.3.ibsolution.manifest.json")
+    assert json.loads(requests_sent[2][2])["sha256"] == (
+        hashlib.sha256(b"cached ibsolution").hexdigest()
+    )
+    assert all(url.startswith(ib_host_url) for _, url, _ in requests_sent)
+
+
+@patch("ib_cicd.ib_helpers.requests")
+def test_check_if_file_exists_requires_complete_upload(
+    mock_requests, ib_host_url, ib_api_token
+):
+    # Arrange
+    manifest = {"sha256": "abc123", "size": 150}
+    uploaded_size = {"value": "150"}
+
+    def request(method, url, **kwargs):
+        resp = Mock(spec=Response)
+        resp.status_code = 200
+        resp.content = json.dumps(manifest)
+        resp.headers = {"Content-Length": uploaded_size["value"]}
+        return resp
+
+    mock_requests.Session.return_value.request.side_effect = request
+    path = "target_dependencies/small_package-0.0.1.ibsolution"
+
+    # Act / Assert
+    assert check_if_file_exists_on_ib_env(ib_host_url, ib_api_token, path)
+    assert check_if_file_exists_on_ib_env(
+        ib_host_url, ib_api_token, path, expected_sha256="abc123"
+    )
+    assert not check_if_file_exists_on_ib_env(
+        ib_host_url, ib_api_token, path, expected_sha256="def456"
+    )
+    uploaded_size["value"] = "100"
+    assert not check_if_file_exists_on_ib_env(ib_host_url, ib_api_token, path)
+
+
+def test_download_dependencies_checks_existing_packages_with_one_listing():
+    # Arrange
+    dependency_dict = {f"package_{i}": "1.0.0" for i in range(3)}
+
+    with IBStandIn() as source, IBStandIn() as target:
+        for package_name in [*dependency_dict, "package_3"]:
+            source.add_marketplace_package(package_name, "1.0.0")
+        download_dependencies_from_dev_and_upload_to_prod(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+        dependency_dict["package_3"] = "1.0.0"
+        target.reset_stats()
+
+        # Act
+        uploaded_paths = download_dependencies_from_dev_and_upload_to_prod(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+
+    # Assert
+    assert len(uploaded_paths) == 4
+    endpoints = target.stats()["endpoints"]
+    # The marketplace and upload folder listings plus the manifests of the 3 packages already there, no HEAD
+    # per package
+    assert endpoints["GET /api/v2/files/..."] == 5
+    assert endpoints["HEAD /api/v2/files/..."] == 1
+    assert endpoints["PATCH /api/v2/files/..."] == 1
+
+
+def test_download_dependencies_replaces_stale_copy_with_source_digest():
+    # Arrange
+    dependency_dict = {"package_0": "1.0.0"}
+    target_path = "target/target_dependencies/package_0-1.0.0.ibsolution"
+
+    with IBStandIn() as source, IBStandIn() as target:
+        source.add_marketplace_package("package_0", "1.0.0")
+        download_dependencies_from_dev_and_upload_to_prod(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+        content = target.files[target_path]
+
+        def write_stale_copy():
+            # A same-size copy of other content, with a manifest matching it
+            stale = bytes(len(content))
+            target.write_file(target_path, stale)
+            target.write_file(
+                f"{target_path}.manifest.json",
+                json.dumps(
+                    {"sha256": hashlib.sha256(stale).hexdigest(), "size": len(stale)}
+                ).encode(),
+            )
+
+        # Act
+        write_stale_copy()
+        download_dependencies_from_dev_and_upload_to_prod(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+        migrated_in_batch = target.files[target_path]
+        write_stale_copy()
+        copy_marketplace_package_and_move_to_new_env(
+            source.host,
+            target.host,
+            "package_0",
+            "1.0.0",
+            source.api_token,
+            target.api_token,
+            "source/source_dependencies",
+            "target/target_dependencies",
+        )
+
+    # Assert
+    assert migrated_in_batch == content
+    assert target.files[target_path] == content
+
+
+def test_download_dependencies_skips_packages_published_on_target():
+    # Arrange
+    dependency_dict = {"package_0": "1.0.0", "package_1": "2.0.0", "package_2": "1.0.0"}
+
+    with IBStandIn() as source, IBStandIn() as target:
+        for package_name, package_version in dependency_dict.items():
+            source.add_marketplace_package(package_name, package_version)
+        target.add_marketplace_package("package_0", "1.0.0")
+        target.add_marketplace_package("package_1", "1.0.0")
+
+        # Act
+        uploaded_paths = download_dependencies_from_dev_and_upload_to_prod(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            dependency_dict,
+        )
+        source_endpoints = source.stats()["endpoints"]
+
+    # Assert
+    assert uploaded_paths == [
+        "target/target_dependencies/package_1-2.0.0.ibsolution",
+        "target/target_dependencies/package_2-1.0.0.ibsolution",
+    ]
+    # Only the 2 packages missing from the target marketplace are copied out of the source marketplace
+    marketplace_copies = [
+        count
+        for endpoint, count in source_endpoints.items()
+        if endpoint.startswith("POST /api/v1/drives/")
+    ]
+    assert marketplace_copies == [2]
+
+
+def test_sync_directory_sends_only_changes(tmp_path):
+    # Arrange
+    (tmp_path / "modules").mkdir()
+    (tmp_path / "package.json").write_text('{"name": "my_solution"}')
+    (tmp_path / "modules" / "changed.py").write_text("v1")
+    (tmp_path / "modules" / "removed.py").write_text("old")
+    (tmp_path / "docs.pdf").write_bytes(b"x" * 100000)
+    folder = "space/fs/Instabase Drive/my_solution"
+
+    with IBStandIn() as stand_in:
+        first_sync = sync_directory_to_ib(
+            stand_in.host, stand_in.api_token, str(tmp_path), folder
+        )
+        stand_in.write_file(f"{folder}/flow.ibflowbin", b"compiled")
+        (tmp_path / "modules" / "changed.py").write_text("v2")
+        (tmp_path / "modules" / "removed.py").unlink()
+        (tmp_path / "modules" / "added.py").write_text("new")
+        stand_in.reset_stats()
+
+        # Act
+        uploaded, deleted = sync_directory_to_ib(
+            stand_in.host, stand_in.api_token, str(tmp_path), folder
+        )
+
+    # Assert
+    assert sorted(first_sync[0]) == [
+        "docs.pdf",
+        "modules/changed.py",
+        "modules/removed.py",
+        "package.json",
+    ]
+    assert uploaded == ["modules/added.py", "modules/changed.py"]
+    assert deleted == ["modules/removed.py"]
+    assert stand_in.stats()["bytes_received"] < 1000
+    assert sorted(path for path in stand_in.files if path.startswith(folder + "/")) == [
+        f"{folder}/docs.pdf",
+        f"{folder}/flow.ibflowbin",
+        f"{folder}/modules/added.py",
+        f"{folder}/modules/changed.py",
+        f"{folder}/package.json",
+    ]
+    assert stand_in.files[f"{folder}/modules/changed.py"] == b"v2"
+
+
+def test_migrate_dependencies_transitively_publishes_leaves_first():
+    # Arrange
+    def requires(*packages):
+        return {"models": [], "dev_exchange_packages": list(packages)}
+
+    with IBStandIn() as source, IBStandIn() as target:
+        source.add_marketplace_package(
+            "app", "1.0.0", requires("lib==2.0.0", "util==1.0.0")
+        )
+        source.add_marketplace_package("lib", "2.0.0", requires("util==1.0.0"))
+        source.add_marketplace_package("util", "1.0.0")
+
+        # Act
+        graph = migrate_dependencies_transitively(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            {"app": "1.0.0"},
+        )
+        levels = get_dependency_levels(graph)
+        publish_dependencies_in_levels(target.host, target.api_token, graph, levels)
+
+    # Assert
+    assert levels == [["util"], ["lib"], ["app"]]
+    assert graph["app"]["dependencies"] == {"lib": "2.0.0", "util": "1.0.0"}
+    assert list(target.marketplace) == [
+        ("util", "1.0.0"),
+        ("lib", "2.0.0"),
+        ("app", "1.0.0"),
+    ]
+
+
+def test_migrate_dependencies_transitively_stops_at_cycle():
+    # Arrange
+    def requires(*packages):
+        return {"models": [], "dev_exchange_packages": list(packages)}
+
+    with IBStandIn() as source, IBStandIn() as target:
+        source.add_marketplace_package("app", "1.0.0", requires("lib==1.0.0"))
+        source.add_marketplace_package(
+            "lib", "1.0.0", requires("app==1.0.0", "util==1.0.0")
+        )
+        source.add_marketplace_package("util", "1.0.0")
+
+        # Act / Assert
+        with pytest.raises(
+            Exception, match="Circular dependencies between packages: app, lib"
+        ):
+            migrate_dependencies_transitively(
+                source.host,
+                target.host,
+                source.api_token,
+                target.api_token,
+                "source",
+                "target",
+                {"app": "1.0.0"},
+            )
+
+    # The wave after the cycle closed isn't uploaded
+    assert not [path for path in target.files if "util-1.0.0" in path]
+
+
+def test_migrate_dependencies_transitively_reads_published_packages_on_target():
+    # Arrange
+    def requires(*packages):
+        return {"models": [], "dev_exchange_packages": list(packages)}
+
+    with IBStandIn() as source, IBStandIn() as target:
+        source.add_marketplace_package("app", "1.0.0", requires("lib==2.0.0"))
+        target.add_marketplace_package("lib", "2.0.0", requires("util==1.0.0"))
+        source.add_marketplace_package("util", "1.0.0")
+
+        # Act
+        graph = migrate_dependencies_transitively(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            "source",
+            "target",
+            {"app": "1.0.0"},
+        )
+        levels = get_dependency_levels(graph)
+        publish_dependencies_in_levels(target.host, target.api_token, graph, levels)
+
+    # Assert
+    assert levels == [["util"], ["lib"], ["app"]]
+    assert graph["lib"]["published"]
+    assert graph["lib"]["dependencies"] == {"util": "1.0.0"}
+    assert list(target.marketplace) == [
+        ("lib", "2.0.0"),
+        ("util", "1.0.0"),
+        ("app", "1.0.0"),
+    ]
+
+
+def test_cache_dependencies_from_source_fetches_each_package_once(tmp_path):
+    # Arrange
+    artifact_cache = ArtifactCache(str(tmp_path))
+
+    with IBStandIn() as source:
+        source.add_marketplace_package(
+            "lib",
+            "2.0.0",
+            {"models": [], "dev_exchange_packages": ["util==1.0.0"]},
+        )
+        source.add_marketplace_package("util", "1.0.0")
+
+        # Act
+        cached = cache_dependencies_from_source(
+            source.host,
+            source.api_token,
+            "source",
+            {"lib": "2.0.0"},
+            artifact_cache,
+            transitive=True,
+        )
+        source.reset_stats()
+        cache_dependencies_from_source(
+            source.host,
+            source.api_token,
+            "source",
+            {"lib": "2.0.0"},
+            artifact_cache,
+            transitive=True,
+        )
+
+    # Assert
+    assert cached == {"lib": "2.0.0", "util": "1.0.0"}
+    assert artifact_cache.get("util", "1.0.0")
+    # Only the download folder is checked when everything is already cached
+    assert source.stats()["requests"] == 1
+
+
+def test_get_dependency_levels_detects_cycles():
+    graph = {
+        "a": {"version": "1.0.0", "dependencies": {"b": "1.0.0"}},
+        "b": {"version": "1.0.0", "dependencies": {"a": "1.0.0"}},
+    }
+
+    with pytest.raises(Exception, match="Circular dependencies between packages: a, b"):
+        get_dependency_levels(graph)
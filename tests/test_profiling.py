@@ -0,0 +1,90 @@
+import json
+from unittest import mock
+
+from ib_cicd import ib_helpers
+from ib_cicd.ib_helpers import PollingPolicy, get_ib_client
+from ib_cicd.profiling import (
+    disable_profiling,
+    enable_profiling,
+    endpoint_template,
+)
+from ib_cicd.step_scheduler import StepGraph
+from tests.ib_stand_in import IBStandIn
+
+
+def test_endpoint_template_groups_file_paths():
+    # Act / Assert
+    assert (
+        endpoint_template("https://ib.test/api/v2/files/space/fs/my%20file.zip")
+        == "/api/v2/files/{path}"
+    )
+    assert (
+        endpoint_template("https://ib.test/api/v2/files/copy") == "/api/v2/files/copy"
+    )
+    assert (
+        endpoint_template("https://ib.test/api/v1/jobs/status?job_id=1&type=job")
+        == "/api/v1/jobs/status"
+    )
+
+
+def test_profiler_records_steps_and_api_calls(tmp_path):
+    # Arrange
+    path = "space/fs/Instabase Drive/model.ibsolution"
+    trace_path = tmp_path / "trace.json"
+    retry_policy = {"upload_part": PollingPolicy(initial_interval=0.01, timeout=5)}
+
+    with (
+        IBStandIn() as stand_in,
+        mock.patch.dict(ib_helpers._polling_policies, retry_policy),
+    ):
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+        stand_in.patch_failures = [0]
+        steps = StepGraph()
+        steps.add("upload", lambda: client.upload_chunks(path, b"x" * 1000))
+
+        # Act
+        profiler = enable_profiling()
+        try:
+            steps.run()
+        finally:
+            disable_profiling()
+        profiler.write_trace(str(trace_path))
+        summary = profiler.summary()
+
+    # Assert
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    patches = [event for event in events if event["name"].startswith("PATCH")]
+    assert [event["args"]["status"] for event in patches] == [503, 204]
+    assert all(event["args"]["bytes_sent"] == 1000 for event in patches)
+    assert {event["cat"] for event in events} == {"step", "http", "sleep"}
+
+    rows = {
+        " ".join(line.split()[:2]): line.split()[2:]
+        for line in summary.splitlines()
+        if line.startswith("PATCH")
+    }
+    calls, _, sent, _, retries = rows["PATCH /api/v2/files/{path}"]
+    assert (calls, sent, retries) == ("2", "2000", "1")
+    assert summary.splitlines()[1].startswith("upload")
+
+
+def test_profiler_times_streamed_download_body(tmp_path):
+    # Arrange
+    path = "space/fs/Instabase Drive/model.ibsolution"
+    content = b"x" * (256 * 1024)
+
+    with IBStandIn(bandwidth=len(content) / 0.5) as stand_in:
+        stand_in.write_file(path, content)
+        client = get_ib_client(stand_in.host, stand_in.api_token)
+
+        # Act
+        profiler = enable_profiling()
+        try:
+            client.download_file(path, str(tmp_path / "model.ibsolution"))
+        finally:
+            disable_profiling()
+
+    # Assert
+    (download,) = [span for span in profiler.spans() if span["name"].startswith("GET")]
+    assert download["args"]["bytes_received"] == len(content)
+    assert download["duration"] >= 0.4
@@ -0,0 +1,80 @@
+"""Collection of unit tests for the promote_solution command line helpers"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from ib_cicd import promote_solution
+from ib_cicd.promote_solution import copy_solution_to_working_dir, read_targets_file
+
+
+def test_read_targets_file(tmp_path):
+    # Arrange
+    targets_file = tmp_path / "targets.json"
+    targets_file.write_text(
+        json.dumps(
+            [
+                {"host": "https://uat.ib.test", "path": "uat/fs", "token_env": "UAT"},
+                {
+                    "name": "prod",
+                    "host": "https://prod.ib.test",
+                    "path": "prod/fs",
+                    "token_env": "PROD",
+                },
+            ]
+        )
+    )
+
+    # Act
+    with mock.patch.dict("os.environ", {"UAT": "uat-token", "PROD": "prod-token"}):
+        targets = read_targets_file(str(targets_file))
+
+    # Assert
+    assert [target["name"] for target in targets] == ["uat.ib.test", "prod"]
+    assert [target["token"] for target in targets] == ["uat-token", "prod-token"]
+
+
+def test_read_targets_file_rejects_empty_list(tmp_path):
+    # Arrange
+    targets_file = tmp_path / "targets.json"
+    targets_file.write_text("[]")
+
+    # Act / Assert
+    with pytest.raises(Exception, match="doesn't list any targets"):
+        read_targets_file(str(targets_file))
+
+
+def test_copy_solution_to_working_dir_waits_for_new_copies():
+    # Arrange
+    def get_file_metadata(ib_host, api_token, path):
+        # package.json was left in the working dir by a previous run
+        if path.endswith("package.json"):
+            return mock.Mock(
+                status_code=200,
+                headers={"Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"},
+            )
+        return mock.Mock(status_code=404, headers={})
+
+    # Act
+    with mock.patch.multiple(
+        promote_solution,
+        SOURCE_SOLUTION_DIR="space/fs/Instabase Drive/solution",
+        REL_FLOW_PATH="flow/main.ibflow",
+        get_file_metadata=get_file_metadata,
+        copy_file_within_ib=mock.Mock(),
+        wait_until_request_completes=mock.DEFAULT,
+    ) as mocks:
+        copy_solution_to_working_dir("space/fs/Instabase Drive/working/solution")
+
+    # Assert
+    waits = {
+        call.kwargs["expected_path"]: call.kwargs["previous_last_modified"]
+        for call in mocks["wait_until_request_completes"].call_args_list
+    }
+    assert waits == {
+        "space/fs/Instabase Drive/working/solution/package.json": "Mon, 05 Oct 2026 10:00:00 GMT",
+        "space/fs/Instabase Drive/working/solution/icon.png": None,
+        "space/fs/Instabase Drive/working/solution/flow/main.ibflow": None,
+        "space/fs/Instabase Drive/working/solution/flow/modules": None,
+    }
@@ -0,0 +1,44 @@
+"""Collection of end to end tests for solution migration, run against local IB stand-ins"""
+
+import json
+
+from ib_cicd.solution_migration_udf import migrate_solution
+from tests.fixtures import ib_clients
+from tests.ib_stand_in import IBStandIn, make_ibsolution
+
+
+def test_migrate_solution():
+    # Arrange
+    package = {
+        "name": "my_solution",
+        "version": "0.0.1",
+        "dependencies": {"models": [], "dev_exchange_packages": ["model_util==1.1.3"]},
+    }
+    build_dir = "space/fs/Instabase Drive/build"
+    solution = make_ibsolution(package)
+
+    with IBStandIn("source-token") as source, IBStandIn("target-token") as target:
+        source.write_file(f"{build_dir}/package.json", json.dumps(package).encode())
+        source.write_file(f"{build_dir}/my_solution-0.0.1.ibsolution", solution)
+        source.add_marketplace_package("model_util", "1.1.3")
+        target.folders.add("prod/fs/Instabase Drive/solutions")
+
+        # Act
+        migrate_solution(
+            source.host,
+            target.host,
+            source.api_token,
+            target.api_token,
+            build_dir,
+            "prod/fs/Instabase Drive/solutions",
+        )
+
+    # Assert
+    assert (
+        target.files["prod/fs/Instabase Drive/solutions/my_solution-0.0.1.ibsolution"]
+        == solution
+    )
+    assert target.marketplace[("model_util", "1.1.3")] == (
+        source.marketplace[("model_util", "1.1.3")]
+    )
+    assert list(source.marketplace) == [("model_util", "1.1.3")]
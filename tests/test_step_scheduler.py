@@ -0,0 +1,93 @@
+"""Collection of unit tests for the step scheduler"""
+
+import threading
+import time
+
+import pytest
+
+from ib_cicd.step_scheduler import StepGraph
+
+
+def test_independent_steps_run_concurrently_after_dependencies():
+    # Arrange
+    both_started = threading.Barrier(2, timeout=5)
+    finished = []
+
+    def step(name, wait_for_other=False):
+        def run():
+            if wait_for_other:
+                both_started.wait()
+            finished.append(name)
+            return name
+
+        return run
+
+    steps = StepGraph()
+    steps.add("compile", step("compile"))
+    steps.add("publish_source", step("publish_source", True), depends_on=["compile"])
+    steps.add("promote", step("promote", True), depends_on=["compile"])
+    steps.add("download", step("download"), depends_on=["promote", "not_selected"])
+
+    # Act
+    results = steps.run()
+
+    # Assert
+    assert finished[0] == "compile"
+    assert finished.index("download") > finished.index("promote")
+    assert results == {name: name for name in finished}
+
+
+def test_failed_step_stops_dependent_steps():
+    # Arrange
+    started = []
+
+    def fail():
+        raise Exception("compile failed")
+
+    steps = StepGraph()
+    steps.add("compile", fail)
+    steps.add("publish", lambda: started.append("publish"), depends_on=["compile"])
+
+    # Act / Assert
+    with pytest.raises(Exception, match="compile failed"):
+        steps.run()
+    assert started == []
+
+
+def test_circular_dependencies_raise():
+    steps = StepGraph()
+    steps.add("a", lambda: None, depends_on=["b"])
+    steps.add("b", lambda: None, depends_on=["a"])
+
+    with pytest.raises(Exception, match="circular"):
+        steps.run()
+
+
+def test_deadline_names_steps_still_running():
+    # Arrange
+    started = []
+    steps = StepGraph()
+    steps.add("quick", lambda: started.append("quick"))
+    steps.add("slow", lambda: time.sleep(0.3))
+    steps.add("after", lambda: started.append("after"), depends_on=["slow"])
+
+    # Act / Assert
+    with pytest.raises(TimeoutError, match="running steps: slow"):
+        steps.run(deadline=time.monotonic() + 0.1)
+    assert started == ["quick"]
+
+
+def test_deadline_does_not_wait_for_blocked_steps():
+    # Arrange
+    release = threading.Event()
+    steps = StepGraph()
+    steps.add("blocked", release.wait)
+    start_time = time.monotonic()
+
+    # Act / Assert
+    try:
+        with pytest.raises(TimeoutError, match="running steps: blocked"):
+            steps.run(deadline=time.monotonic() + 0.1)
+        assert time.monotonic() - start_time < 1
+    finally:
+        release.set()